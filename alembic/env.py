@@ -12,7 +12,11 @@ settings = get_settings()
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
-config.set_main_option("sqlalchemy.url", settings.POSTGRES_DATABASE_URL)
+# Migrations bypass PgBouncer when there's a direct url
+config.set_main_option(
+    "sqlalchemy.url",
+    settings.POSTGRES_DIRECT_DATABASE_URL or settings.POSTGRES_DATABASE_URL,
+)
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
 if config.config_file_name is not None:
@@ -0,0 +1,36 @@
+"""added_refresh_token_families
+
+Revision ID: 210f8ed009ef
+Revises: 6a3f193a4391
+Create Date: 2026-10-17 23:41:15.537699
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "210f8ed009ef"
+down_revision: Union[str, None] = "6a3f193a4391"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ("user_refresh_tokens", "admin_refresh_tokens")
+
+
+def upgrade() -> None:
+    for table in TABLES:
+        op.add_column(table, sa.Column("family_id", sa.String(32), nullable=True))
+        # Every existing token starts its own family
+        op.execute(f"UPDATE {table} SET family_id = md5(random()::text || id::text)")
+        op.alter_column(table, "family_id", nullable=False)
+        op.create_unique_constraint(f"{table}_family_id_key", table, ["family_id"])
+
+
+def downgrade() -> None:
+    for table in TABLES:
+        op.drop_constraint(f"{table}_family_id_key", table, type_="unique")
+        op.drop_column(table, "family_id")
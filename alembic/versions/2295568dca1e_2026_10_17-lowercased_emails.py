@@ -0,0 +1,62 @@
+"""lowercased_emails
+
+Revision ID: 2295568dca1e
+Revises: 210f8ed009ef
+Create Date: 2026-10-17 23:47:44.689036
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "2295568dca1e"
+down_revision: Union[str, None] = "210f8ed009ef"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+EMAIL_COLUMNS = (
+    ("users", "email"),
+    ("users", "exception_alert_email"),
+    ("admins", "email"),
+    ("newsletter", "email"),
+    ("companies", "email"),
+)
+
+
+def upgrade() -> None:
+    # Emails that only differ by case can't be merged automatically, stop before
+    # changing anything so they can be resolved by hand (not checked in --sql mode)
+    duplicates = []
+    for table, column in EMAIL_COLUMNS:
+        if op.get_context().as_sql:
+            break
+        rows = op.get_bind().execute(
+            sa.text(
+                f"SELECT lower({column}) FROM {table} WHERE {column} IS NOT NULL "
+                f"GROUP BY lower({column}) HAVING count(*) > 1"
+            )
+        )
+        duplicates += [f"{table}.{column}: {email}" for (email,) in rows]
+    if duplicates:
+        raise RuntimeError(
+            "Emails that only differ by case: " + ", ".join(sorted(duplicates))
+        )
+
+    for table, column in EMAIL_COLUMNS:
+        op.execute(
+            f"UPDATE {table} SET {column} = lower({column}) "
+            f"WHERE {column} <> lower({column})"
+        )
+        op.create_check_constraint(
+            f"ck_{table}_{column}_lowercase", table, f"{column} = lower({column})"
+        )
+
+
+def downgrade() -> None:
+    # The original case of the emails isn't kept
+    for table, column in EMAIL_COLUMNS:
+        op.drop_constraint(f"ck_{table}_{column}_lowercase", table, type_="check")
@@ -0,0 +1,52 @@
+"""hashed_refresh_tokens
+
+Revision ID: 430f43fe111a
+Revises: 4bbc66e4ca46
+Create Date: 2026-10-17 23:18:24.155592
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "430f43fe111a"
+down_revision: Union[str, None] = "4bbc66e4ca46"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ("user_refresh_tokens", "admin_refresh_tokens")
+
+
+def upgrade() -> None:
+    for table in TABLES:
+        op.add_column(table, sa.Column("token_hash", sa.String(64), nullable=True))
+        op.add_column(
+            table, sa.Column("expires_at", sa.DateTime(timezone=True), nullable=True)
+        )
+        # Existing tokens are hashed in place and given the longest refresh lifetime
+        op.execute(
+            f"UPDATE {table} SET token_hash = encode(sha256(token::bytea), 'hex'), "
+            "expires_at = created_at + interval '72 hours'"
+        )
+        op.execute(
+            f"DELETE FROM {table} a USING {table} b "
+            "WHERE a.token_hash = b.token_hash AND a.id < b.id"
+        )
+        op.alter_column(table, "token_hash", nullable=False)
+        op.alter_column(table, "expires_at", nullable=False)
+        op.create_unique_constraint(f"{table}_token_hash_key", table, ["token_hash"])
+        op.drop_column(table, "token")
+
+
+def downgrade() -> None:
+    # The raw tokens can't be recovered from their digests, so they are all revoked
+    for table in TABLES:
+        op.execute(f"DELETE FROM {table}")
+        op.add_column(table, sa.Column("token", sa.String, nullable=False))
+        op.drop_constraint(f"{table}_token_hash_key", table, type_="unique")
+        op.drop_column(table, "expires_at")
+        op.drop_column(table, "token_hash")
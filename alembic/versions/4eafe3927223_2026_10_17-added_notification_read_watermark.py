@@ -0,0 +1,36 @@
+"""added_notification_read_watermark
+
+Revision ID: 4eafe3927223
+Revises: 63e6068dfe32
+Create Date: 2026-10-17 23:24:20.335577
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "4eafe3927223"
+down_revision: Union[str, None] = "63e6068dfe32"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+TABLES = ("user_notification_states", "admin_notification_states")
+
+
+def upgrade() -> None:
+    for table in TABLES:
+        op.add_column(
+            table,
+            sa.Column(
+                "read_up_to_id", sa.Integer(), server_default="0", nullable=False
+            ),
+        )
+
+
+def downgrade() -> None:
+    for table in TABLES:
+        op.drop_column(table, "read_up_to_id")
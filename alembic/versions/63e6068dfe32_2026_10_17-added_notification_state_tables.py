@@ -0,0 +1,47 @@
+"""added_notification_state_tables
+
+Revision ID: 63e6068dfe32
+Revises: eac73af9df46
+Create Date: 2026-10-17 23:22:47.814714
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "63e6068dfe32"
+down_revision: Union[str, None] = "eac73af9df46"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (state table, notification table, owner column, owner table)
+STATE_TABLES = (
+    ("user_notification_states", "user_notifications", "user_id", "users"),
+    ("admin_notification_states", "admin_notifications", "admin_id", "admins"),
+)
+
+
+def upgrade() -> None:
+    for table, notification_table, owner, owner_table in STATE_TABLES:
+        op.create_table(
+            table,
+            sa.Column(owner, sa.Integer(), nullable=False),
+            sa.Column("unread_count", sa.Integer(), server_default="0", nullable=False),
+            sa.ForeignKeyConstraint([owner], [f"{owner_table}.id"], ondelete="CASCADE"),
+            sa.PrimaryKeyConstraint(owner),
+        )
+        # Backfill the counters from the existing notifications
+        op.execute(
+            f"INSERT INTO {table} ({owner}, unread_count) "
+            f"SELECT {owner}, count(*) FROM {notification_table} "
+            f"WHERE is_read = false GROUP BY {owner}"
+        )
+
+
+def downgrade() -> None:
+    for table, *_ in STATE_TABLES:
+        op.drop_table(table)
@@ -0,0 +1,42 @@
+"""created_token_revocations_table
+
+Revision ID: 6a3f193a4391
+Revises: 4eafe3927223
+Create Date: 2026-10-17 23:38:22.889957
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "6a3f193a4391"
+down_revision: Union[str, None] = "4eafe3927223"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "token_revocations",
+        sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+        sa.Column("subject", sa.String(50), nullable=False),
+        sa.Column(
+            "revoked_at",
+            sa.DateTime(timezone=True),
+            server_default=sa.text("now()"),
+            nullable=False,
+        ),
+        sa.Column("expires_at", sa.DateTime(timezone=True), nullable=False),
+    )
+    op.create_index(
+        "ix_token_revocations_expires_at", "token_revocations", ["expires_at"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_token_revocations_expires_at", table_name="token_revocations")
+    op.drop_table("token_revocations")
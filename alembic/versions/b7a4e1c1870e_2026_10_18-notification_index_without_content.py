@@ -0,0 +1,56 @@
+"""notification_index_without_content
+
+Revision ID: b7a4e1c1870e
+Revises: 2295568dca1e
+Create Date: 2026-10-18 00:07:23.995860
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "b7a4e1c1870e"
+down_revision: Union[str, None] = "2295568dca1e"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+NOTIFICATION_TABLES = (
+    ("user_notifications", "user_id"),
+    ("admin_notifications", "admin_id"),
+)
+
+
+def rebuild_list_indexes():
+    """This function rebuilds the notification list indexes without content"""
+    # CONCURRENTLY can't run in a transaction, it keeps the tables writable meanwhile
+    with op.get_context().autocommit_block():
+        for table, owner in NOTIFICATION_TABLES:
+            op.drop_index(
+                f"ix_{table}_{owner}_created_at_id",
+                table_name=table,
+                postgresql_concurrently=True,
+                if_exists=True,
+            )
+            op.create_index(
+                f"ix_{table}_{owner}_created_at_id",
+                table,
+                [owner, sa.text("created_at DESC"), sa.text("id DESC")],
+                postgresql_include=["is_read"],
+                postgresql_concurrently=True,
+            )
+
+
+def upgrade() -> None:
+    # content (unbounded text) made inserts of notifications past ~2.7KB fail
+    rebuild_list_indexes()
+
+
+def downgrade() -> None:
+    # The index isn't rebuilt with content, a concurrent build would fail on the rows
+    # past the btree limit and leave an INVALID index behind. The index without it
+    # serves the same queries
+    pass
@@ -0,0 +1,86 @@
+"""added_notification_and_foreign_key_indexes
+
+Revision ID: eac73af9df46
+Revises: 430f43fe111a
+Create Date: 2026-10-17 23:31:05.412337
+
+"""
+
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "eac73af9df46"
+down_revision: Union[str, None] = "430f43fe111a"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (table, column) of the foreign keys not covered by a composite index
+FOREIGN_KEYS = (
+    ("user_configurations", "user_id"),
+    ("user_refresh_tokens", "user_id"),
+    ("user_password_reset_tokens", "user_id"),
+    ("companies", "user_id"),
+    ("support", "user_id"),
+    ("admins", "added_by"),
+    ("admin_configurations", "admin_id"),
+    ("admin_refresh_tokens", "admin_id"),
+)
+
+
+def upgrade() -> None:
+    # CONCURRENTLY can't run in a transaction, it keeps the tables writable meanwhile
+    with op.get_context().autocommit_block():
+        for table, owner in (
+            ("user_notifications", "user_id"),
+            ("admin_notifications", "admin_id"),
+        ):
+            # Covers the notification list (filter on owner, newest first)
+            op.create_index(
+                f"ix_{table}_{owner}_created_at_id",
+                table,
+                [owner, sa.text("created_at DESC"), sa.text("id DESC")],
+                postgresql_include=["content", "is_read"],
+                postgresql_concurrently=True,
+            )
+            # Only the unread rows, used when marking notifications as read
+            op.create_index(
+                f"ix_{table}_{owner}_unread",
+                table,
+                [owner, "id"],
+                postgresql_where=sa.text("is_read = false"),
+                postgresql_concurrently=True,
+            )
+
+        for table, column in FOREIGN_KEYS:
+            op.create_index(
+                f"ix_{table}_{column}",
+                table,
+                [column],
+                postgresql_concurrently=True,
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for table, column in FOREIGN_KEYS:
+            op.drop_index(
+                f"ix_{table}_{column}", table_name=table, postgresql_concurrently=True
+            )
+        for table, owner in (
+            ("user_notifications", "user_id"),
+            ("admin_notifications", "admin_id"),
+        ):
+            op.drop_index(
+                f"ix_{table}_{owner}_unread",
+                table_name=table,
+                postgresql_concurrently=True,
+            )
+            op.drop_index(
+                f"ix_{table}_{owner}_created_at_id",
+                table_name=table,
+                postgresql_concurrently=True,
+            )
@@ -3,5 +3,9 @@ from typing import Annotated
 from fastapi import Depends
 
 from app.admins import models, selectors
+from app.common.types import AccessTokenClaims
 
 CurrentAdmin = Annotated[models.Admin, Depends(selectors.get_current_admin)]
+CurrentAdminClaims = Annotated[
+    AccessTokenClaims, Depends(selectors.get_current_admin_claims)
+]
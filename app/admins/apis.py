@@ -1,19 +1,30 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+from uuid import uuid4
 
-from fastapi import APIRouter, Body, HTTPException, status
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import delete, select
 
 from app.admins import models, selectors, services
-from app.admins.annotations import CurrentAdmin
+from app.admins.annotations import CurrentAdmin, CurrentAdminClaims
 from app.admins.schemas import (
     base_schemas,
     create_schemas,
     edit_schemas,
     response_schemas,
 )
-from app.common.annotations import DatabaseSession, PaginationParams
-from app.common.paginators import get_pagination_metadata, paginate
+from app.common.annotations import (
+    CursorPaginationParams,
+    DatabaseSession,
+    SessionMaker,
+)
+from app.common.dependencies import Deadline
+from app.common.paginators import MAX_PAGE_SIZE, cursor_paginate
+from app.common.pubsub import stream_events
+from app.common.revocation import revoke_subject
 from app.common.schemas import ResponseSchema
-from app.common.security import hash_password, verify_password
+from app.common.types import CountStrategy
+from app.common.security import password_hasher
 from app.config.settings import get_settings
 from app.user import security
 
@@ -33,12 +44,7 @@ async def admin_create(admin_in: create_schemas.AdminCreate, db: DatabaseSession
     """Create a new admin"""
     created_admin = await services.create_admin(data=admin_in, db=db)
 
-    try:
-        await services.create_admin_configuration(admin_id=created_admin.id, db=db)
-    except HTTPException as e:
-        db.delete(created_admin)
-        db.commit()
-        raise e
+    await services.create_admin_configuration(admin_id=created_admin.id, db=db)
 
     # Send Notification
     await services.create_admin_notification(
@@ -65,16 +71,25 @@ async def admin_login(
     else:
         expire_in = settings.REFRESH_TOKEN_EXPIRE_HOURS
 
+    family_id = uuid4().hex
     refresh_token = security.generate_user_token(
-        token_type="refresh", sub=f"ADMIN-{admin.id}", expire_in=expire_in
+        token_type="refresh",
+        sub=f"ADMIN-{admin.id}",
+        expire_in=expire_in,
+        claims={"fam": family_id},
     )
     access_token = security.generate_user_token(
         token_type="access",
         sub=f"ADMIN-{admin.id}",
         expire_in=settings.ACCESS_TOKEN_EXPIRE_MINUTES,
+        claims={"active": admin.is_active, "permission": admin.permission},
     )
     await services.create_admin_refresh_token(
-        admin_id=admin.id, token=refresh_token, db=db
+        admin_id=admin.id,
+        token=refresh_token,
+        family_id=family_id,
+        expires_at=datetime.now() + timedelta(hours=expire_in),
+        db=db,
     )
     return {
         "data": {
@@ -114,21 +129,21 @@ async def user_refresh_token(
         description="The Admin's refresh token", min_length=1, embed=True
     ),
 ):
-    """This endpoint generates a new access token for the admin using the refresh token"""
-    admin_id = security.verify_user_refresh_token(token=refresh_token)
-    await selectors.get_admin_refresh_token(
-        admin_id=admin_id, token=refresh_token, db=db
+    """This endpoint generates a new access token for the admin using the refresh token
+
+    The refresh token is rotated, the new one must be used for the next refresh"""
+    refresh_token, admin = await services.rotate_admin_refresh_token(
+        token=refresh_token, db=db
     )
-    admin = await selectors.get_admin_by_id(admin_id=admin_id, db=db)
-    admin.last_login = datetime.now()
-    db.commit()
     return {
         "data": {
             "access_token": security.generate_user_token(
                 token_type="access",
-                sub=f"ADMIN-{admin_id}",
+                sub=f"ADMIN-{admin.id}",
                 expire_in=settings.ACCESS_TOKEN_EXPIRE_MINUTES,
-            )
+                claims={"active": admin.is_active, "permission": admin.permission},
+            ),
+            "refresh_token": refresh_token,
         }
     }
 
@@ -140,10 +155,12 @@ async def user_refresh_token(
     status_code=status.HTTP_200_OK,
     response_model=ResponseSchema,
 )
-async def admin_logout(admin_user: CurrentAdmin, db: DatabaseSession):
-    """This endpoint logs out the current admin by deleting all their refresh tokens"""
-    db.query(models.AdminRefreshToken).filter_by(admin_id=admin_user.id).delete()
-    db.commit()
+async def admin_logout(admin_user: CurrentAdminClaims, db: DatabaseSession):
+    """This endpoint logs out the current admin by deleting all their refresh tokens and
+    revoking their access tokens"""
+    await db.execute(delete(models.AdminRefreshToken).filter_by(admin_id=admin_user.id))
+    await selectors.invalidate_cached_admin(admin_id=admin_user.id, db=db)
+    await revoke_subject(db=db, subject=admin_user.subject)
     return {"data": {"message": "Admin has been logged out"}}
 
 
@@ -165,8 +182,9 @@ async def admin_me(admin: CurrentAdmin):
     response_description="The admin's configuration",
     status_code=status.HTTP_200_OK,
     response_model=response_schemas.AdminConfigurationResponse,
+    dependencies=[Depends(Deadline(seconds=2))],
 )
-async def admin_configurations(current_admin: CurrentAdmin, db: DatabaseSession):
+async def admin_configurations(current_admin: CurrentAdminClaims, db: DatabaseSession):
     """This endpoint returns the admin's configurations"""
 
     return {
@@ -185,7 +203,7 @@ async def admin_configurations(current_admin: CurrentAdmin, db: DatabaseSession)
 )
 async def admin_configurations_edit(
     configuration_in: edit_schemas.AdminConfigurationEdit,
-    current_admin: CurrentAdmin,
+    current_admin: CurrentAdminClaims,
     db: DatabaseSession,
 ):
     """This endpoint returns the admin's configurations"""
@@ -196,7 +214,6 @@ async def admin_configurations_edit(
     # Update configurations
     for field, value in configuration_in.model_dump().items():
         setattr(configurations, field, value)
-    db.commit()
 
     return {"data": configurations}
 
@@ -207,18 +224,24 @@ async def admin_configurations_edit(
     response_description="The list of the admin's notifications",
     status_code=status.HTTP_200_OK,
     response_model=response_schemas.AdminNotificationListResponse,
+    dependencies=[Depends(Deadline(seconds=5))],
 )
 async def admin_notifications(
-    pagination: PaginationParams,
-    current_admin: CurrentAdmin,
+    pagination: CursorPaginationParams,
+    current_admin: CurrentAdminClaims,
     db: DatabaseSession,
 ):
     """This endpoint returns a paginated list of the current logged in admin's notifications"""
-    notifications_qs = db.query(models.AdminNotification).filter_by(
-        admin_id=current_admin.id
+    notifications, meta = await cursor_paginate(
+        qs=select(models.AdminNotification).filter_by(admin_id=current_admin.id),
+        db=db,
+        order_by=(models.AdminNotification.created_at, models.AdminNotification.id),
+        size=pagination.size,
+        cursor=pagination.cursor,
+        count_strategy=CountStrategy.CACHED,
     )
-    paginated_notifications: list[models.AdminNotification] = paginate(
-        qs=notifications_qs, page=pagination.page, size=pagination.size
+    state = await selectors.get_admin_notification_state(
+        admin_id=current_admin.id, db=db
     )
     return {
         "data": {
@@ -227,21 +250,100 @@ async def admin_notifications(
                     "id": noti.id,
                     "content": noti.content,
                     "created_at": noti.created_at,
-                    "is_read": noti.is_read,
+                    "is_read": noti.is_read or noti.id <= state.read_up_to_id,
                 }
-                for noti in paginated_notifications
+                for noti in notifications
             ],
-            "unread": any(not noti.is_read for noti in paginated_notifications),
-            "meta": get_pagination_metadata(
-                qs=notifications_qs,
-                count=len(paginated_notifications),
-                page=pagination.page,
-                size=pagination.size,
-            ),
+            "unread": state.unread_count > 0,
+            "unread_count": state.unread_count,
+            "meta": meta,
         }
     }
 
 
+@router.get(
+    "/notifications/unread",
+    summary="Get Admin Unread Notification Count",
+    response_description="The number of unread notifications",
+    status_code=status.HTTP_200_OK,
+    response_model=response_schemas.AdminNotificationUnreadResponse,
+    dependencies=[Depends(Deadline(seconds=2))],
+)
+async def admin_notification_unread(
+    current_admin: CurrentAdminClaims, db: DatabaseSession
+):
+    """This endpoint returns the number of unread notifications, it's cheap enough to poll"""
+    state = await selectors.get_admin_notification_state(
+        admin_id=current_admin.id, db=db
+    )
+    return {
+        "data": {"unread": state.unread_count > 0, "unread_count": state.unread_count}
+    }
+
+
+@router.get(
+    "/notifications/stream",
+    summary="Stream Admin Notifications",
+    response_description="A text/event-stream of the admin's new notifications",
+    status_code=status.HTTP_200_OK,
+    response_class=StreamingResponse,
+)
+async def admin_notification_stream(
+    current_admin: CurrentAdminClaims,
+    db: DatabaseSession,
+    session_maker: SessionMaker,
+    last_event_id: int | None = Header(
+        default=None,
+        alias="Last-Event-ID",
+        description="The ID of the last notification received, to resume from",
+    ),
+):
+    """This endpoint streams the admin's new notifications as Server-Sent Events
+
+    Without a Last-Event-ID only notifications created after connecting are sent
+    """
+    admin_id = current_admin.id
+    if last_event_id is None:
+        last_event_id = await selectors.get_admin_latest_notification_id(
+            admin_id=admin_id, db=db
+        )
+
+    async def fetch_notifications(after_id: int):
+        # A session per fetch, so an idle stream doesn't hold a connection
+        async with session_maker() as stream_db:
+            notifications = await selectors.get_admin_notifications_after(
+                admin_id=admin_id, after_id=after_id, db=stream_db
+            )
+            state = await selectors.get_admin_notification_state(
+                admin_id=admin_id, db=stream_db
+            )
+        return [
+            (
+                noti.id,
+                {
+                    "id": noti.id,
+                    "content": noti.content,
+                    "created_at": noti.created_at,
+                    "is_read": noti.is_read or noti.id <= state.read_up_to_id,
+                },
+            )
+            for noti in notifications
+        ]
+
+    return StreamingResponse(
+        stream_events(
+            channel=models.AdminNotification.__tablename__,
+            key=admin_id,
+            fetch_events=fetch_notifications,
+            last_event_id=last_event_id,
+            event_name="notification",
+        ),
+        media_type="text/event-stream",
+        # identity keeps the gzip middleware from buffering the events
+        headers={"Cache-Control": "no-cache", "Content-Encoding": "identity"},
+    )
+
+
 @router.put(
     "/notifications/read",
     summary="Mark Admin Notifications as Read",
@@ -249,13 +351,21 @@ async def admin_notifications(
     status_code=status.HTTP_200_OK,
     response_model=ResponseSchema,
 )
-async def admin_notification_read(current_admin: CurrentAdmin, db: DatabaseSession):
-    """This endpoint marks all the admin's notifications as read"""
+async def admin_notification_read(
+    current_admin: CurrentAdminClaims,
+    db: DatabaseSession,
+    notification_ids: list[int] | None = Body(
+        default=None,
+        description="The notifications to mark as read, all of them when omitted",
+        max_length=MAX_PAGE_SIZE,
+        embed=True,
+    ),
+):
+    """This endpoint marks the admin's notifications as read"""
 
-    db.query(models.AdminNotification).filter_by(
-        admin_id=current_admin.id, is_read=False
-    ).update({"is_read": True}, synchronize_session=False)
-    db.commit()
+    await services.read_admin_notifications(
+        admin_id=current_admin.id, db=db, notification_ids=notification_ids
+    )
     return {"data": {"message": "Notifications have been marked as read"}}
 
 
@@ -272,7 +382,9 @@ async def admin_password_confirm(
 ):
     """This endpoints confirms the admin's password"""
 
-    if verify_password(plain_password=password, hashed_password=current_admin.password):
+    if await password_hasher.verify(
+        plain_password=password, hashed_password=current_admin.password
+    ):
         return {"data": {"is_correct": True}}
     return {"data": {"is_correct": False}}
 
@@ -291,12 +403,14 @@ async def admin_password_change(
 ):
     """This endpoint changes the admin's password"""
 
-    if verify_password(
+    if await password_hasher.verify(
         plain_password=password_change.old_password,
         hashed_password=current_admin.password,
     ):
-        current_admin.password = hash_password(raw=password_change.new_password)
-        db.commit()
+        current_admin.password = await password_hasher.hash(
+            raw=password_change.new_password
+        )
+        await selectors.invalidate_cached_admin(admin_id=current_admin.id, db=db)
 
         # Notifications
         await services.create_admin_notification(
@@ -1,6 +1,18 @@
 from datetime import datetime
-
-from sqlalchemy import Boolean, Column, DateTime, Enum, ForeignKey, Integer, String
+from uuid import uuid4
+
+from sqlalchemy import (
+    Boolean,
+    CheckConstraint,
+    Column,
+    DateTime,
+    Enum,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    text,
+)
 
 from app.config.database import DBBase
 
@@ -9,6 +21,10 @@ class Admin(DBBase):
     """Database model for Admin"""
 
     __tablename__ = "admins"
+    __table_args__ = (
+        # Emails are stored lowercased, see NormalizedEmail
+        CheckConstraint("email = lower(email)", name="ck_admins_email_lowercase"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     profile_picture_url = Column(String, default="/default_profile.jpg", nullable=False)
@@ -17,7 +33,7 @@ class Admin(DBBase):
     phone_number = Column(String(20), nullable=False)
     password = Column(String, nullable=False)
     is_active = Column(Boolean, default=True)
-    added_by = Column(Integer, ForeignKey("admins.id"), nullable=True)
+    added_by = Column(Integer, ForeignKey("admins.id"), nullable=True, index=True)
     gender = Column(Enum("MALE", "FEMALE", "OTHER", name="gender_enum"), nullable=False)
     permission = Column(Enum("SUPER_ADMIN", "ADMIN", name="admin_enum"), nullable=False)
     last_login = Column(DateTime(timezone=True), nullable=True)
@@ -31,7 +47,10 @@ class AdminConfiguration(DBBase):
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     admin_id = Column(
-        Integer, ForeignKey("admins.id", ondelete="CASCADE"), nullable=False
+        Integer,
+        ForeignKey("admins.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
     )
     notification_email = Column(Boolean, default=True)
     notification_inapp = Column(Boolean, default=True)
@@ -41,6 +60,24 @@ class AdminNotification(DBBase):
     """This is the base database schema for admin notifications"""
 
     __tablename__ = "admin_notifications"
+    __table_args__ = (
+        # Serves the notification list (filter on owner, newest first). content isn't
+        # included, rows past the btree limit (~2.7KB) would fail to insert
+        Index(
+            "ix_admin_notifications_admin_id_created_at_id",
+            "admin_id",
+            text("created_at DESC"),
+            text("id DESC"),
+            postgresql_include=["is_read"],
+        ),
+        # Only the unread rows, used when marking notifications as read
+        Index(
+            "ix_admin_notifications_admin_id_unread",
+            "admin_id",
+            "id",
+            postgresql_where=text("is_read = false"),
+        ),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     admin_id = Column(
@@ -51,14 +88,38 @@ class AdminNotification(DBBase):
     created_at = Column(DateTime(timezone=True), default=datetime.now, nullable=False)
 
 
+class AdminNotificationState(DBBase):
+    """Database model for the admin's notification state, kept in sync on every write"""
+
+    __tablename__ = "admin_notification_states"
+
+    admin_id = Column(
+        Integer, ForeignKey("admins.id", ondelete="CASCADE"), primary_key=True
+    )
+    unread_count = Column(Integer, default=0, server_default="0", nullable=False)
+    # Every notification with an id <= read_up_to_id is read
+    read_up_to_id = Column(Integer, default=0, server_default="0", nullable=False)
+
+
 class AdminRefreshToken(DBBase):
-    """Database model for admin refresh tokens"""
+    """Database model for admin refresh tokens
+
+    A row is a family of refresh tokens, every refresh swaps its token_hash for the
+    next token's so only the latest token of the family is valid
+    """
 
     __tablename__ = "admin_refresh_tokens"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     admin_id = Column(
-        Integer, ForeignKey("admins.id", ondelete="CASCADE"), nullable=False
+        Integer,
+        ForeignKey("admins.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+    token_hash = Column(String(64), unique=True, nullable=False)  # sha256 hex digest
+    family_id = Column(
+        String(32), unique=True, default=lambda: uuid4().hex, nullable=False
     )
-    token = Column(String, nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
     created_at = Column(DateTime(timezone=True), default=datetime.now, nullable=False)
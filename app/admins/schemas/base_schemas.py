@@ -1,8 +1,9 @@
 from datetime import datetime
 
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, Field
 
-from app.common.schemas import PaginationSchema, Token
+from app.common.schemas import CursorPaginationSchema, Token
+from app.common.types import NormalizedEmail
 
 
 class Admin(BaseModel):
@@ -27,7 +28,7 @@ class AdminLogin(BaseModel):
 class AdminLoginCredential(BaseModel):
     """The base admin login credential model"""
 
-    email: EmailStr = Field(
+    email: NormalizedEmail = Field(
         description="The admin's email address", examples=["admin@shipnlogic.com"]
     )
     password: str = Field(description="The admin's password", examples=["admin"])
@@ -54,6 +55,13 @@ class AdminNotification(BaseModel):
     created_at: datetime = Field(description="The notification created date")
 
 
+class AdminNotificationUnread(BaseModel):
+    """The base schema for the admin's unread notification count"""
+
+    unread: bool = Field(description="Indicates if there are unread notifications")
+    unread_count: int = Field(description="The number of unread notifications")
+
+
 class PaginatedAdminNotification(BaseModel):
     """The base schema for paginated admin notifications"""
 
@@ -61,4 +69,5 @@ class PaginatedAdminNotification(BaseModel):
         description="The list of admin notifications"
     )
     unread: bool = Field(description="Indicates if there are unread notifications")
-    meta: PaginationSchema = Field(description="The pagination details")
+    unread_count: int = Field(description="The number of unread notifications")
+    meta: CursorPaginationSchema = Field(description="The pagination details")
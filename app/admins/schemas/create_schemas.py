@@ -1,6 +1,8 @@
 from typing import Literal
 
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, Field
+
+from app.common.types import NormalizedEmail
 
 
 class AdminCreate(BaseModel):
@@ -12,7 +14,7 @@ class AdminCreate(BaseModel):
         max_length=255,
         examples=["Alice"],
     )
-    email: EmailStr = Field(
+    email: NormalizedEmail = Field(
         description="The user's email", min_length=1, examples=["user@shipnlogic.com"]
     )
     phone_number: str = Field(
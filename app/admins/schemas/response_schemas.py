@@ -4,6 +4,7 @@ from app.admins.schemas.base_schemas import (
     Admin,
     AdminConfiguration,
     AdminLogin,
+    AdminNotificationUnread,
     PaginatedAdminNotification,
 )
 from app.common.schemas import ResponseSchema
@@ -33,3 +34,11 @@ class AdminNotificationListResponse(ResponseSchema):
     data: PaginatedAdminNotification = Field(
         description="The paginated list of admin notifications"
     )
+
+
+class AdminNotificationUnreadResponse(ResponseSchema):
+    """This is the response schema for the admin's unread notification count"""
+
+    data: AdminNotificationUnread = Field(
+        description="The admin's unread notification count"
+    )
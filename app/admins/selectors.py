@@ -1,7 +1,12 @@
 from fastapi import Depends, Header, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.common.cache import cache_principal, get_cached_principal
 from app.common.dependencies import get_db
+from app.common.paginators import MAX_PAGE_SIZE
+from app.common.pubsub import invalidate_cached
+from app.common.types import AccessTokenClaims
 from app.config.settings import get_settings
 from app.admins import models
 from app.user import security
@@ -9,12 +14,14 @@ from app.user import security
 settings = get_settings()
 
 
-async def get_admin_by_id(admin_id: int, db: Session, raise_exception: bool = True):
+async def get_admin_by_id(
+    admin_id: int, db: AsyncSession, raise_exception: bool = True
+):
     """This function returns an admin obj using it's id
 
     Args:
         admin_id (int): The admin's id
-        db (Session): The database session
+        db (AsyncSession): The database session
         raise_exception (bool, default=True): Raise HTTPException[404] when admin isn't found
 
     Raises:
@@ -23,7 +30,7 @@ async def get_admin_by_id(admin_id: int, db: Session, raise_exception: bool = Tr
     Returns:
         (models.Admin| None): The Admin obj or None
     """
-    if obj := db.query(models.Admin).filter_by(id=admin_id).first():
+    if obj := await db.scalar(select(models.Admin).filter_by(id=admin_id)):
         return obj
     if raise_exception:
         raise HTTPException(
@@ -33,12 +40,14 @@ async def get_admin_by_id(admin_id: int, db: Session, raise_exception: bool = Tr
     return None
 
 
-async def get_admin_by_email(email: str, db: Session, raise_exception: bool = True):
+async def get_admin_by_email(
+    email: str, db: AsyncSession, raise_exception: bool = True
+):
     """This function returns an admin obj based on the admin's email
 
     Args:
         email (str): The admin's email
-        db (Session): The database session
+        db (AsyncSession): The database session
         raise_exception (bool, default=True): Raise a HTTPException[404] when admin isn't found
 
     Raises:
@@ -47,7 +56,7 @@ async def get_admin_by_email(email: str, db: Session, raise_exception: bool = Tr
     Returns:
         (models.Admin, None): The admin obj or None
     """
-    if obj := db.query(models.Admin).filter_by(email=email).first():
+    if obj := await db.scalar(select(models.Admin).filter_by(email=email.lower())):
         return obj
     if raise_exception:
         raise HTTPException(
@@ -57,32 +66,64 @@ async def get_admin_by_email(email: str, db: Session, raise_exception: bool = Tr
     return None
 
 
-async def get_admin_refresh_token(admin_id: int, token: str, db: Session):
-    """This function returns an admin's refresh token
+async def get_current_admin_claims(token: str = Header(alias="Authorization")):
+    """This function returns the claims of the current admin's access token
 
-    Args:
-        admin_id (int): The admin's ID
-        token (str): The admin's refresh token
-        db (Session): The database session
+    Nothing is queried, the token is verified (once, then cached) and checked against
+    the revocation list, so use it when the admin's id/status/permission is enough.
+    The permission is the one the admin had when the token was issued, endpoints that
+    grant or take it away use get_current_admin.
+
+    Raises:
+        HTTPException[401]: Invalid token
+        HTTPException[403]: Inactive account or not an admin's token
 
     Returns:
-        (models.AdminRefreshToken): The admin refresh token obj
+        AccessTokenClaims: The claims
     """
-    obj = (
-        db.query(models.AdminRefreshToken)
-        .filter_by(admin_id=admin_id, token=token)
-        .first()
-    )
-    if not obj:
+    try:
+        token_type, token = token.split(" ")
+    except ValueError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid Token",
+            detail="Invalid token",
         )
-    return obj
+    if token_type != "Bearer":
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid token",
+        )
+    claims = security.get_user_access_token_claims(token=token)
+    if not claims.get("active", True):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Account is inactive"
+        )
+    # Users and admins share the signing keys, only the subject tells them apart
+    if not claims["sub"].startswith("ADMIN-"):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Invalid token type"
+        )
+    return AccessTokenClaims(
+        id=int(claims["sub"].split("-")[1]),
+        subject=claims["sub"],
+        is_active=claims.get("active", True),
+        permission=claims.get("permission"),
+    )
+
+
+async def invalidate_cached_admin(admin_id: int, db: AsyncSession):
+    """This function evicts a admin from the caches of every worker, call it before
+    committing a change to the admin
+
+    Args:
+        admin_id (int): The admin's ID
+        db (AsyncSession): The database session the admin was changed in
+    """
+    await invalidate_cached(db=db, key=f"ADMIN-{admin_id}")
 
 
 async def get_current_admin(
-    token: str = Header(alias="Authorization"), db: Session = Depends(get_db)
+    token: str = Header(alias="Authorization"), db: AsyncSession = Depends(get_db)
 ):
     """This function returns the current admin based on the token provided"""
     try:
@@ -98,7 +139,14 @@ async def get_current_admin(
             detail="Invalid token",
         )
     admin_id = int(security.verify_user_access_token(token=token))
-    if admin := await get_admin_by_id(admin_id=admin_id, db=db, raise_exception=False):
+    if admin := await get_cached_principal(key=f"ADMIN-{admin_id}", db=db):
+        return admin
+    # Read from the primary, a stale replica row would stay cached for the cache's TTL
+    admin = await db.scalar(
+        select(models.Admin).filter_by(id=admin_id).execution_options(use_primary=True)
+    )
+    if admin:
+        cache_principal(key=f"ADMIN-{admin_id}", obj=admin)
         return admin
     raise HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -106,20 +154,83 @@ async def get_current_admin(
     )
 
 
-async def get_admin_configuration_by_admin_id(admin_id: int, db: Session):
+async def get_admin_configuration_by_admin_id(admin_id: int, db: AsyncSession):
     """This function returns the admin configuration based on the admin's ID
 
     Args:
         admin_id (int): The admin's ID
-        db (Session): The database session
+        db (AsyncSession): The database session
 
     Returns:
         (models.AdminConfiguration): The Admin configuration obj
     """
-    obj = db.query(models.AdminConfiguration).filter_by(admin_id=admin_id).first()
+    obj = await db.scalar(
+        select(models.AdminConfiguration).filter_by(admin_id=admin_id)
+    )
     if not obj:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Admin Configuration for admin {admin_id} not found",
         )
     return obj
+
+
+async def get_admin_notification_state(admin_id: int, db: AsyncSession):
+    """This function returns the notification state of a admin
+
+    Args:
+        admin_id (int): The admin's ID
+        db (AsyncSession): The database session
+
+    Returns:
+        models.AdminNotificationState: The admin's notification state obj (a blank one when
+            they've never been notified)
+    """
+    state = await db.scalar(
+        select(models.AdminNotificationState).filter_by(admin_id=admin_id)
+    )
+    if state is None:
+        state = models.AdminNotificationState(
+            admin_id=admin_id, unread_count=0, read_up_to_id=0
+        )
+    return state
+
+
+async def get_admin_latest_notification_id(admin_id: int, db: AsyncSession):
+    """This function returns the ID of the admin's latest notification
+
+    Args:
+        admin_id (int): The admin's ID
+        db (AsyncSession): The database session
+
+    Returns:
+        int: The notification ID (0 when they have none)
+    """
+    latest_id = await db.scalar(
+        select(func.max(models.AdminNotification.id)).filter_by(admin_id=admin_id)
+    )
+    return latest_id or 0
+
+
+async def get_admin_notifications_after(
+    admin_id: int, after_id: int, db: AsyncSession, limit: int = MAX_PAGE_SIZE
+):
+    """This function returns the admin's notifications created after a notification
+
+    Args:
+        admin_id (int): The admin's ID
+        after_id (int): The ID of the notification to start after
+        db (AsyncSession): The database session
+        limit (int, default=MAX_PAGE_SIZE): The max number of notifications to return
+
+    Returns:
+        list[models.AdminNotification]: The notifications, oldest first
+    """
+    notifications = await db.scalars(
+        select(models.AdminNotification)
+        .filter_by(admin_id=admin_id)
+        .where(models.AdminNotification.id > after_id)
+        .order_by(models.AdminNotification.id)
+        .limit(limit)
+    )
+    return list(notifications)
@@ -1,19 +1,24 @@
 from datetime import datetime
+from uuid import uuid4
 
 from fastapi import HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.common.security import hash_password, verify_password
+from app.common.pubsub import broker
+from app.common.queries import dialect_insert, insert_unique
+from app.common.security import hash_token, password_hasher
 from app.admins import models, selectors
 from app.admins.schemas import base_schemas, create_schemas, edit_schemas
+from app.user import security
 
 
-async def create_admin(data: create_schemas.AdminCreate, db: Session):
+async def create_admin(data: create_schemas.AdminCreate, db: AsyncSession):
     """This function creates a new admin
 
     Args:
         data (create_schemas.AdminCreate): The admin's data
-        db (Session): The database session
+        db (AsyncSession): The database session
 
     Raises:
         HTTPException[400]: Admin with email exists
@@ -21,73 +26,73 @@ async def create_admin(data: create_schemas.AdminCreate, db: Session):
     Returns:
         models.Admin: The created admin obj
     """
-    # Validate unique email
-    if db.query(models.Admin).filter_by(email=data.email).first():
+    values = data.model_dump()
+    values["password"] = await password_hasher.hash(raw=data.password)
+    obj = await insert_unique(db=db, model=models.Admin, values=values)
+    if obj is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Admin with email {data.email} exists",
         )
-
-    obj = models.Admin(**data.model_dump())
-    obj.password = hash_password(raw=data.password)
-    db.add(obj)
-    db.commit()
-    db.refresh(obj)
     return obj
 
 
-async def create_admin_configuration(admin_id: int, db: Session):
+async def create_admin_configuration(admin_id: int, db: AsyncSession):
     """This function creates the admin's configuration obj
 
     Args:
         admin_id (int): The admin's ID
-        db (Session): The database session
+        db (AsyncSession): The database session
 
     Returns:
         models.AdminConfiguration: The created admin configuration obj
     """
-    await selectors.get_admin_by_id(admin_id=admin_id, db=db)
-    if db.query(models.AdminConfiguration).filter_by(admin_id=admin_id).first():
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"admin configuration for admin {admin_id} already exists",
-        )
     obj = models.AdminConfiguration(admin_id=admin_id)
     db.add(obj)
-    db.commit()
-    db.refresh(obj)
+    await db.flush()
     return obj
 
 
-async def create_admin_notification(admin_id: int, content: str, db: Session):
+async def create_admin_notification(admin_id: int, content: str, db: AsyncSession):
     """This function creates an admin notification
 
     Args:
         admin_id (int): The admin's ID
         content (str): The notification content
-        db (Session): The database session
+        db (AsyncSession): The database session
 
     Returns:
         models.AdminNotification: The created notifcation notification obj
     """
-    await selectors.get_admin_by_id(admin_id=admin_id, db=db)
+    # Keep the unread counter in sync, the state row is locked before the notification
+    # gets its id so the id can't end up below a concurrent read watermark
+    await db.execute(
+        dialect_insert(db, models.AdminNotificationState)
+        .values(admin_id=admin_id, unread_count=1)
+        .on_conflict_do_update(
+            index_elements=["admin_id"],
+            set_={"unread_count": models.AdminNotificationState.unread_count + 1},
+        )
+    )
     obj = models.AdminNotification(admin_id=admin_id, content=content)
     db.add(obj)
-    db.commit()
-    db.refresh(obj)
+    await broker.publish(
+        db=db, channel=models.AdminNotification.__tablename__, key=admin_id
+    )
+    await db.flush()
     return obj
 
 
 async def login_admin(
     data: base_schemas.AdminLoginCredential,
-    db: Session,
+    db: AsyncSession,
     raise_exception: bool = True,
 ):
     """This function logs in an admin and updates their last_login
 
     Args:
         data (base_schemas.AdminLoginCredential): The admin's login credentials
-        db (Session): The database session
+        db (AsyncSession): The database session
         raise_exception(bool, default=True): Indicates whether to raise an exception or not
 
     Raises:
@@ -106,10 +111,11 @@ async def login_admin(
                 detail="Invalid login credentials",
             )
         return None
-    if verify_password(plain_password=data.password, hashed_password=admin.password):
+    if await password_hasher.verify(
+        plain_password=data.password, hashed_password=admin.password
+    ):
         admin.last_login = datetime.now()
-        db.commit()
-        db.refresh(admin)
+        await selectors.invalidate_cached_admin(admin_id=admin.id, db=db)
         return admin
     if raise_exception:
         raise HTTPException(
@@ -118,32 +124,102 @@ async def login_admin(
     return None
 
 
-async def create_admin_refresh_token(admin_id: int, token: str, db: Session):
+async def create_admin_refresh_token(
+    admin_id: int, token: str, family_id: str, expires_at: datetime, db: AsyncSession
+):
     """This function creates an admin refresh token
 
     Args:
         admin_id (int): The admin's ID
-        token(str): The access token
-        db (Session): The database session
+        token(str): The refresh token (only its digest is stored)
+        family_id (str): The token's fam claim, its rotations share it
+        expires_at (datetime): When the refresh token expires
+        db (AsyncSession): The database session
 
     Returns:
         models.AdminRefreshToken: The created admin refresh token obj
     """
-    await selectors.get_admin_by_id(admin_id=admin_id, db=db)
-    obj = models.AdminRefreshToken(admin_id=admin_id, token=token)
+    obj = models.AdminRefreshToken(
+        admin_id=admin_id,
+        token_hash=hash_token(token=token),
+        family_id=family_id,
+        expires_at=expires_at,
+    )
     db.add(obj)
-    db.commit()
-    db.refresh(obj)
+    await db.flush()
     return obj
 
 
-async def edit_admin(admin_id: int, data: edit_schemas.AdminEdit, db: Session):
+async def rotate_admin_refresh_token(token: str, db: AsyncSession):
+    """This function swaps a refresh token for the next token of its family
+
+    The token is swapped and the admin's claims are read in a single UPDATE ... RETURNING.
+    The new token expires with the family, so rotating doesn't extend the session. A
+    validly signed token that isn't its family's latest has been used before, i.e it
+    was stolen or replayed, so the whole family is revoked.
+
+    Args:
+        token (str): The refresh token
+        db (AsyncSession): The database session
+
+    Raises:
+        HTTPException[401]: Invalid, expired or reused token
+
+    Returns:
+        tuple[str, Row]: The new refresh token and the admin's id, is_active and permission
+    """
+    claims = security.get_user_refresh_token_claims(token=token)
+    admin_id = int(claims["sub"].split("-")[1])
+    # Tokens issued before families existed start one
+    family_id = claims.get("fam") or uuid4().hex
+    new_token = security.generate_user_token(
+        token_type="refresh",
+        sub=claims["sub"],
+        expire_in=0,
+        claims={"fam": family_id, "exp": claims["exp"]},
+    )
+
+    token_admin = models.Admin.id == models.AdminRefreshToken.admin_id
+    row = (
+        await db.execute(
+            update(models.AdminRefreshToken)
+            .filter_by(token_hash=hash_token(token=token), admin_id=admin_id)
+            .where(models.AdminRefreshToken.expires_at > datetime.now())
+            .values(token_hash=hash_token(token=new_token), family_id=family_id)
+            .returning(
+                models.AdminRefreshToken.admin_id.label("id"),
+                select(models.Admin.is_active)
+                .where(token_admin)
+                .scalar_subquery()
+                .label("is_active"),
+                select(models.Admin.permission)
+                .where(token_admin)
+                .scalar_subquery()
+                .label("permission"),
+            )
+        )
+    ).one_or_none()
+    if row is None:
+        # Committed right away, the request fails so its unit of work is rolled back
+        if "fam" in claims:
+            await db.execute(
+                delete(models.AdminRefreshToken).filter_by(family_id=claims["fam"])
+            )
+        await db.commit()
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Token",
+        )
+    return new_token, row
+
+
+async def edit_admin(admin_id: int, data: edit_schemas.AdminEdit, db: AsyncSession):
     """This function edits an admin's details
 
     Args:
         admin_id (int): The admin's ID
         data (edit_schemas.AdminEdit): The admin's data
-        db (Session): The database session
+        db (AsyncSession): The database session
 
     Returns:
         models.Admin: The edited admin obj
@@ -161,6 +237,81 @@ async def edit_admin(admin_id: int, data: edit_schemas.AdminEdit, db: Session):
         )
     for field, value in data.items():
         setattr(obj, field, value)
-    db.commit()
-    db.refresh(obj)
+    await selectors.invalidate_cached_admin(admin_id=obj.id, db=db)
+    await db.flush()
     return obj
+
+
+async def read_admin_notifications(
+    admin_id: int, db: AsyncSession, notification_ids: list[int] | None = None
+):
+    """This function marks the admin's notifications as read
+
+    Marking every notification read only moves the admin's read watermark up to their
+    latest notification (a single row write), specific notifications are marked read
+    in one UPDATE. The unread counter is adjusted in the same transaction.
+
+    Args:
+        admin_id (int): The admin's ID
+        db (AsyncSession): The database session
+        notification_ids (list[int] | None, default=None): The notifications to mark
+            as read, all of them when None
+
+    Returns:
+        int | None: The number of notifications marked as read (None when all of
+            them were)
+    """
+    if notification_ids is None:
+        # Upserting first locks the state row, so the watermark below sees every
+        # notification counted before it
+        await db.execute(
+            dialect_insert(db, models.AdminNotificationState)
+            .values(admin_id=admin_id)
+            .on_conflict_do_update(
+                index_elements=["admin_id"], set_={"unread_count": 0}
+            )
+        )
+        latest_id = (
+            select(func.max(models.AdminNotification.id))
+            .filter_by(admin_id=admin_id)
+            .scalar_subquery()
+        )
+        await db.execute(
+            update(models.AdminNotificationState)
+            .filter_by(admin_id=admin_id)
+            .values(
+                read_up_to_id=func.coalesce(
+                    latest_id, models.AdminNotificationState.read_up_to_id
+                )
+            )
+        )
+        return None
+
+    if not notification_ids:
+        return 0
+    state = await db.scalar(
+        select(models.AdminNotificationState)
+        .filter_by(admin_id=admin_id)
+        .with_for_update()
+    )
+    if state is None:
+        return 0  # Never notified
+    result = await db.execute(
+        update(models.AdminNotification)
+        .filter_by(admin_id=admin_id, is_read=False)
+        .where(
+            models.AdminNotification.id.in_(notification_ids),
+            models.AdminNotification.id > state.read_up_to_id,
+        )
+        .values(is_read=True)
+    )
+    if result.rowcount:
+        await db.execute(
+            update(models.AdminNotificationState)
+            .filter_by(admin_id=admin_id)
+            .values(
+                unread_count=models.AdminNotificationState.unread_count
+                - result.rowcount
+            )
+        )
+    return result.rowcount
@@ -0,0 +1,220 @@
+"""This module contains the admission control (load shedding) middleware.
+
+Only so many requests are let through at once, the rest wait in a bounded queue, most
+important first. A request that can't be queued, or waits longer than the queue
+timeout, is rejected with a 503 and a Retry-After header right away instead of piling
+up until its client has given up on it.
+"""
+
+import asyncio
+import heapq
+import itertools
+
+import orjson
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.config.settings import get_settings
+
+settings = get_settings()
+
+HIGH_PRIORITY, NORMAL_PRIORITY, LOW_PRIORITY = 0, 1, 2
+
+# Health checks, token refreshes (a failed refresh logs the client out) and the
+# internal endpoints used to diagnose the overload
+HIGH_PRIORITY_PATHS = {
+    "/health",
+    "/.well-known/jwks.json",
+    "/users/token",
+    "/admins/token",
+}
+HIGH_PRIORITY_PREFIXES = ("/internal/",)
+
+# Bulk reads, the first to go when overloaded
+LOW_PRIORITY_PATHS = {"/users/notifications", "/admins/notifications"}
+
+# Long lived streams would hold a slot for as long as they're open
+EXEMPT_PATHS = {"/users/notifications/stream", "/admins/notifications/stream"}
+
+
+def get_priority(scope: Scope):
+    """This function returns the priority class of a request
+
+    Args:
+        scope (Scope): The request's ASGI scope
+
+    Returns:
+        int | None: The priority (lower goes first) or None when it isn't admission
+            controlled
+    """
+    path = scope["path"].rstrip("/") or "/"
+    if path in EXEMPT_PATHS:
+        return None
+    if path in HIGH_PRIORITY_PATHS or path.startswith(HIGH_PRIORITY_PREFIXES):
+        return HIGH_PRIORITY
+    if scope["method"] == "GET" and path in LOW_PRIORITY_PATHS:
+        return LOW_PRIORITY
+    return NORMAL_PRIORITY
+
+
+class AdmissionController:
+    """Lets up to max_concurrency requests run at once, queueing up to max_queue more
+
+    A freed slot goes to the highest priority waiter, oldest first. When the queue is
+    full a request takes the place of the newest waiter of a lower priority, if there
+    is one, otherwise it's rejected. This isn't thread safe, it's meant to be used from
+    the event loop.
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._queue: list[tuple[int, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+
+    def _shed(self, priority: int):
+        """This function rejects the newest lowest priority waiter, if it's of a lower
+        priority than priority
+
+        Returns:
+            bool: True if a waiter was rejected
+        """
+        lowest = max(self._queue, key=lambda entry: (entry[0], entry[1]))
+        if lowest[0] <= priority:
+            return False
+        self._queue.remove(lowest)
+        heapq.heapify(self._queue)
+        lowest[2].set_result(False)
+        return True
+
+    def _abandon(self, entry: tuple[int, int, asyncio.Future]):
+        """This function gives up a waiter's place, or its slot if it was just handed
+        one"""
+        future = entry[2]
+        if future.done() and not future.cancelled() and future.result():
+            self.release()
+        elif entry in self._queue:
+            self._queue.remove(entry)
+            heapq.heapify(self._queue)
+
+    async def acquire(self, priority: int):
+        """This function waits for a slot
+
+        Args:
+            priority (int): The request's priority class, lower goes first
+
+        Returns:
+            bool: True once the request can run, False if it's rejected
+        """
+        if self.active < self.max_concurrency and not self._queue:
+            self.active += 1
+            self.admitted += 1
+            return True
+        if len(self._queue) >= self.max_queue and not (
+            self._queue and self._shed(priority)
+        ):
+            self.rejected += 1
+            return False
+
+        entry = (
+            priority,
+            next(self._counter),
+            asyncio.get_running_loop().create_future(),
+        )
+        heapq.heappush(self._queue, entry)
+        future = entry[2]
+        try:
+            async with asyncio.timeout(self.queue_timeout):
+                admitted = await future
+        except TimeoutError:
+            self._abandon(entry)
+            self.timed_out += 1
+            return False
+        except asyncio.CancelledError:  # e.g the client disconnected
+            self._abandon(entry)
+            raise
+        if admitted:
+            self.admitted += 1
+        else:
+            self.rejected += 1
+        return admitted
+
+    def release(self):
+        """This function hands a finished request's slot to the next waiter"""
+        while self._queue:
+            _, _, future = heapq.heappop(self._queue)
+            if not future.done():
+                future.set_result(True)
+                return
+        self.active -= 1
+
+    def stats(self):
+        """This function returns the admission stats
+
+        Returns:
+            dict: The admission stats
+        """
+        return {
+            "active": self.active,
+            "queued": len(self._queue),
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+
+admission_controller = AdmissionController(
+    max_concurrency=settings.ADMISSION_MAX_CONCURRENCY,
+    max_queue=settings.ADMISSION_QUEUE_DEPTH,
+    queue_timeout=settings.ADMISSION_QUEUE_TIMEOUT_SECONDS,
+)
+
+
+class AdmissionControlMiddleware:
+    """The ASGI middleware running every HTTP request through an admission controller"""
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        controller: AdmissionController = admission_controller,
+        retry_after: int = settings.ADMISSION_RETRY_AFTER_SECONDS,
+    ):
+        self.app = app
+        self.controller = controller
+        self.retry_after = retry_after
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or (priority := get_priority(scope)) is None:
+            await self.app(scope, receive, send)
+            return
+        if not await self.controller.acquire(priority):
+            await self.reject(send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release()
+
+    async def reject(self, send: Send):
+        """This function sends the 503 response of a rejected request"""
+        body = orjson.dumps(
+            {"status": "error", "data": {"message": "Server is busy, please try again"}}
+        )
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(self.retry_after).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
@@ -1,11 +1,17 @@
 from typing import Annotated
 
 from fastapi import Depends
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
-from app.common.dependencies import get_db, pagination_params
-from app.common.types import PaginationParamsType
+from app.common.dependencies import (
+    cursor_pagination_params,
+    get_db,
+    get_session_maker,
+)
+from app.common.types import CursorPaginationParamsType
 
-
-DatabaseSession = Annotated[Session, Depends(get_db)]
-PaginationParams = Annotated[PaginationParamsType, Depends(pagination_params)]
+DatabaseSession = Annotated[AsyncSession, Depends(get_db)]
+SessionMaker = Annotated[async_sessionmaker, Depends(get_session_maker)]
+CursorPaginationParams = Annotated[
+    CursorPaginationParamsType, Depends(cursor_pagination_params)
+]
@@ -0,0 +1,60 @@
+"""This module contains the internal (operational) endpoints of the application."""
+
+from fastapi import APIRouter, status
+
+from app.admins.annotations import CurrentAdminClaims
+from app.common.admission import admission_controller
+from app.common.cache import principal_cache, recent_writers, token_cache
+from app.common.paginators import count_cache
+from app.common.revocation import revocation_list
+from app.common.schemas import ResponseSchema
+from app.config.database import engine, replica_engine
+from app.config.pool import get_pool_status, pool_tracer
+
+router = APIRouter()
+
+
+@router.get(
+    "/caches",
+    summary="Get Cache Stats",
+    response_description="The size and hit rate of the in-process caches",
+    status_code=status.HTTP_200_OK,
+    response_model=ResponseSchema,
+)
+async def cache_stats(_: CurrentAdminClaims):
+    """This endpoint returns the stats of this worker's in-process caches"""
+    return {
+        "data": {
+            "principals": principal_cache.stats(),
+            "tokens": token_cache.stats(),
+            "pagination_counts": count_cache.stats(),
+            "token_revocations": revocation_list.stats(),
+            "recent_writers": recent_writers.stats(),
+        }
+    }
+
+
+@router.get(
+    "/pool",
+    summary="Get Connection Pool Stats",
+    response_description="The pools' usage and how long each route waits for and holds connections",
+    status_code=status.HTTP_200_OK,
+    response_model=ResponseSchema,
+)
+async def pool_stats(_: CurrentAdminClaims):
+    """This endpoint returns the stats of this worker's connection pools
+
+    It doesn't query the database, it's needed most when the pools are exhausted.
+    """
+    return {
+        "data": {
+            "primary": get_pool_status(engine.pool),
+            "replica": (
+                get_pool_status(replica_engine.pool)
+                if replica_engine is not None
+                else None
+            ),
+            "routes": pool_tracer.stats(),
+            "admission": admission_controller.stats(),
+        }
+    }
@@ -0,0 +1,149 @@
+"""This module contains the in-process caches used in the application."""
+
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+from sqlalchemy import inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
+
+from app.config.settings import get_settings
+
+settings = get_settings()
+
+
+class TTLCache:
+    """A bounded LRU cache whose entries expire after a time to live
+
+    This isn't thread safe, it's meant to be used from the event loop.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable):
+        return self.get(key, count=False) is not None
+
+    def get(self, key: Hashable, default: Any = None, count: bool = True):
+        """This function returns the cached value of a key
+
+        Args:
+            key (Hashable): The key
+            default (Any, default=None): Returned when the key isn't cached or has expired
+            count (bool, default=True): Record the lookup in the hit/miss counters
+
+        Returns:
+            Any: The cached value or default
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            if count:
+                self.hits += 1
+            return entry[1]
+        if entry is not None:
+            del self._entries[key]
+        if count:
+            self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None):
+        """This function caches a value, evicting the least recently used entry when full
+
+        Args:
+            key (Hashable): The key
+            value (Any): The value to cache
+            ttl (float | None, default=None): Seconds until the entry expires (defaults to the cache's ttl)
+        """
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        """This function evicts a key from the cache"""
+        self._entries.pop(key, None)
+
+    def clear(self):
+        """This function evicts every key from the cache"""
+        self._entries.clear()
+
+    def stats(self):
+        """This function returns the size and hit rate of the cache
+
+        Returns:
+            dict: The cache stats
+        """
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+# The verified claims of access tokens, keyed by the token digest, until they expire
+token_cache = TTLCache(maxsize=settings.TOKEN_CACHE_MAXSIZE, ttl=0)
+
+# The users/admins resolved from access tokens, keyed by the token subject e.g USER-1
+principal_cache = TTLCache(
+    maxsize=settings.PRINCIPAL_CACHE_MAXSIZE, ttl=settings.PRINCIPAL_CACHE_TTL
+)
+
+
+def cache_principal(key: str, obj):
+    """This function caches a snapshot of a user/admin's columns
+
+    Only the column values are cached, never the instance, so nothing cached is ever
+    attached to (or mutated through) a session.
+
+    Args:
+        key (str): The token subject e.g USER-1
+        obj: The user/admin obj
+    """
+    values = {
+        attr.key: getattr(obj, attr.key) for attr in inspect(obj).mapper.column_attrs
+    }
+    principal_cache.set(key, (type(obj), values))
+
+
+async def get_cached_principal(key: str, db: AsyncSession):
+    """This function returns a cached user/admin attached to the session
+
+    The snapshot is merged in without loading, so a hit doesn't touch the database
+    yet the obj can still be modified and committed like a loaded one.
+
+    Args:
+        key (str): The token subject e.g USER-1
+        db (AsyncSession): The database session
+
+    Returns:
+        The user/admin obj or None when it isn't cached
+    """
+    cached = principal_cache.get(key)
+    if cached is None:
+        return None
+    model, values = cached
+    obj = model(**values)
+    make_transient_to_detached(obj)
+    return await db.merge(obj, load=False)
+
+
+# The clients (by token digest) that wrote recently, their reads skip the replica until
+# it has had time to catch up
+recent_writers = TTLCache(
+    maxsize=settings.PRINCIPAL_CACHE_MAXSIZE, ttl=settings.REPLICA_MAX_LAG_SECONDS
+)
@@ -0,0 +1,75 @@
+"""This module contains the read after write tracking of clients.
+
+A client that wrote gets a short lived cookie holding the commit time. Its reads skip
+the replica while the cookie is younger than REPLICA_MAX_LAG_SECONDS, whichever worker
+or host handles them, so a client always reads its own writes.
+"""
+
+import math
+import time
+
+from starlette.datastructures import MutableHeaders
+from starlette.requests import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.config.settings import get_settings
+
+settings = get_settings()
+
+LAST_WRITE_COOKIE = "last_write"
+
+
+def wrote_recently(request: Request):
+    """This function checks if the client wrote within the replica's max lag
+
+    Args:
+        request (Request): The request
+
+    Returns:
+        bool: True if the replica may not have the client's last write yet
+    """
+    try:
+        wrote_at = float(request.cookies.get(LAST_WRITE_COOKIE, ""))
+    except ValueError:
+        return False
+    return 0 <= time.time() - wrote_at < settings.REPLICA_MAX_LAG_SECONDS
+
+
+def mark_written(request: Request):
+    """This function records that the request's transaction committed a write, the
+    LastWriteCookieMiddleware sets the cookie on its response
+
+    Args:
+        request (Request): The request
+    """
+    request.state.wrote_at = time.time()
+
+
+class LastWriteCookieMiddleware:
+    """The ASGI middleware setting the last write cookie on the responses of requests
+    that wrote
+
+    The session is committed before the response is sent, so the commit time is known
+    by the time the response starts.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.max_age = math.ceil(settings.REPLICA_MAX_LAG_SECONDS)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cookie(message: Message):
+            wrote_at = scope.get("state", {}).get("wrote_at")
+            if message["type"] == "http.response.start" and wrote_at is not None:
+                MutableHeaders(scope=message).append(
+                    "set-cookie",
+                    f"{LAST_WRITE_COOKIE}={wrote_at}; Max-Age={self.max_age}; Path=/; "
+                    "HttpOnly; SameSite=Lax",
+                )
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
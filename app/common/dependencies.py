@@ -1,18 +1,122 @@
 """This module contains common dependencies used in the application"""
 
-from app.common.types import PaginationParamsType
+import asyncio
+import time
+from contextvars import ContextVar
+
+from fastapi import HTTPException, Query, Request, status
+from sqlalchemy.exc import DBAPIError
+
+from app.common.cache import recent_writers
+from app.common.consistency import mark_written, wrote_recently
+from app.common.paginators import MAX_PAGE_SIZE
+from app.common.security import hash_token
+from app.common.types import CursorPaginationParamsType
 from app.config.database import SessionLocal
+from app.config.pool import current_route
+
+# The monotonic time the current request's deadline passes at, if it has one
+request_deadline: ContextVar[float | None] = ContextVar(
+    "request_deadline", default=None
+)
+
+# The SQLSTATE of a statement cancelled by its statement_timeout
+QUERY_CANCELED = "57014"
+
 
+def set_current_route(request: Request):
+    """This function attributes the connections checked out from here on to the
+    request's route, e.g GET /users/me
 
-def get_db():
-    """This function starts a db session"""
-    db = SessionLocal()
-    try:
+    Args:
+        request (Request): The request
+    """
+    route = request.scope.get("route")
+    current_route.set(f"{request.method} {route.path if route else request.url.path}")
+
+
+async def get_db(request: Request):
+    """This function starts a db session, the request's unit of work
+
+    Services only flush their changes, the session is committed once when the endpoint
+    returns (before the response is sent) and rolled back if it raises.
+
+    GET/HEAD sessions are read only, their SELECTs go to the replica (if there's one)
+    unless the client wrote something in the last REPLICA_MAX_LAG_SECONDS, so clients
+    read their own writes. Writes are tracked by the client's last write cookie (see
+    app.common.consistency), and by its token on this worker for clients that don't
+    keep cookies. Routes with a Deadline give their statements the time left.
+    """
+    set_current_route(request)
+    token = request.headers.get("authorization")
+    writer_key = hash_token(token) if token else None
+    async with SessionLocal() as db:
+        db.info["deadline"] = request_deadline.get()
+        db.info["read_only"] = request.method in ("GET", "HEAD") and not (
+            wrote_recently(request) or (writer_key and recent_writers.get(writer_key))
+        )
         yield db
-    finally:
-        db.close()
+        await db.commit()
+        if db.info.get("wrote"):
+            mark_written(request)
+            if writer_key:
+                recent_writers.set(writer_key, True)
+
+
+class Deadline:
+    """A route dependency bounding how long the route's requests may take e.g
+
+        @router.get(..., dependencies=[Depends(Deadline(seconds=2))])
+
+    The request's transactions get a statement_timeout of the time left (postgres
+    only), so a slow query fails fast and releases its connection, and the request is
+    cancelled once the deadline passes.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+
+    async def __call__(self):
+        """This function runs the rest of the request within the deadline
+
+        Raises:
+            HTTPException[503]: A query was cancelled by its statement timeout
+            HTTPException[504]: The request took longer than the deadline
+        """
+        request_deadline.set(time.monotonic() + self.seconds)
+        try:
+            async with asyncio.timeout(self.seconds):
+                yield
+        except TimeoutError:
+            raise HTTPException(
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                detail="Request timed out",
+            )
+        except DBAPIError as e:
+            if getattr(e.orig, "sqlstate", None) != QUERY_CANCELED:
+                raise
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy, please try again",
+            )
+
+
+async def get_session_maker(request: Request):
+    """This function returns the session factory, for endpoints that outlive a session
+
+    e.g streams that only need a connection for the short moments they query
+    """
+    set_current_route(request)
+    return SessionLocal
 
 
-def pagination_params(page: int = 1, size: int = 10):
-    """Helper Dependency for pagination"""
-    return PaginationParamsType(page=page, size=size)
+def cursor_pagination_params(
+    cursor: str | None = Query(
+        default=None, description="The cursor of the page to return"
+    ),
+    size: int = Query(
+        default=10, ge=1, le=MAX_PAGE_SIZE, description="Max number of items to return"
+    ),
+):
+    """Helper Dependency for cursor pagination"""
+    return CursorPaginationParamsType(cursor=cursor, size=size)
@@ -0,0 +1,20 @@
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Integer, String
+
+from app.config.database import DBBase
+
+
+class TokenRevocation(DBBase):
+    """Database model for access token revocations
+
+    Every access token of the subject issued up to revoked_at is revoked, the row is
+    only kept until those tokens have expired (expires_at)
+    """
+
+    __tablename__ = "token_revocations"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    subject = Column(String(50), nullable=False)  # The token's sub e.g USER-1
+    revoked_at = Column(DateTime(timezone=True), default=datetime.now, nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
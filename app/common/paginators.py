@@ -1,52 +1,211 @@
 """This module contains the pagination logic for the application."""
 
-import math
-from sqlalchemy.orm import Query
+import base64
+import binascii
+from datetime import datetime
+from typing import Literal, Sequence
 
+import orjson
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import Select, func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import InstrumentedAttribute
 
-def get_pagination_metadata(*, qs: Query, count: int, page: int, size: int):
-    """This function is used to the pagination metadata of a response.
+from app.common.cache import TTLCache
+from app.common.types import CountStrategy
+from app.config.settings import get_settings
+
+settings = get_settings()
+
+MAX_PAGE_SIZE = 100
+
+count_cache = TTLCache(maxsize=10_000, ttl=settings.PAGINATION_COUNT_CACHE_TTL)
+
+
+async def _exact_count(*, qs: Select, db: AsyncSession):
+    """This function runs a SELECT count(*) over qs"""
+    return await db.scalar(
+        select(func.count()).select_from(qs.order_by(None).subquery())
+    )
+
+
+async def _estimated_count(*, qs: Select, db: AsyncSession):
+    """This function returns the query planner's row estimate for qs
+
+    Returns:
+        int | None: The estimate or None when the database isn't postgres
+    """
+    # Bound by the query, so a read only session runs the EXPLAIN on the replica
+    connection = await db.connection(bind_arguments={"clause": qs})
+    if connection.dialect.name != "postgresql":
+        return None
+    compiled = qs.order_by(None).compile(dialect=connection.dialect)
+    params = tuple(compiled.params[name] for name in compiled.positiontup or ())
+    result = await connection.exec_driver_sql(
+        f"EXPLAIN (FORMAT JSON) {compiled}", params
+    )
+    plan = result.scalar()
+    if isinstance(plan, (str, bytes)):
+        plan = orjson.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def _count_cache_key(qs: Select):
+    """This function returns the count cache key of a query, its SQL and parameters"""
+    compiled = qs.order_by(None).compile()
+    return str(compiled), tuple(sorted(compiled.params.items()))
+
+
+def encode_cursor(*, values: list, direction: Literal["next", "prev"]):
+    """This function encodes the ordering key values of a row into an opaque cursor
 
     Args:
-        qs (Query): The query to derive the metadata (Pre Pagination)
-        count (int): The number of items you are returning
-        page (int): The current page
-        size (int): The number of items per page
+        values (list): The values of the ordering keys
+        direction (next, prev): The direction to paginate in from the row
 
     Returns:
-        dict: A dictionary containing the paginated response
-
-    Sample:
-        {
-            "page": 1,
-            "size": 10,
-            "count": 10,
-            "items": []
-        }
+        str: The cursor
     """
-    total_no_items = qs.count()
-    total_no_pages = math.ceil(total_no_items / size)
-    metadata = {
-        "total_no_items": total_no_items,
-        "total_no_pages": total_no_pages,
-        "page": page,
-        "size": size,
-        "count": count,
-        "has_next_page": page < total_no_pages,
-        "has_prev_page": page > 1,
-    }
-    return metadata
+    payload = orjson.dumps({"d": direction, "v": jsonable_encoder(values)})
+    return base64.urlsafe_b64encode(payload).decode()
 
 
-def paginate(*, qs: Query, page: int, size: int):
-    """This function paginates a queryset
+def decode_cursor(*, cursor: str, order_by: Sequence[InstrumentedAttribute]):
+    """This function decodes a cursor created by encode_cursor
 
     Args:
-        qs (Query): The qs to paginate
-        page (int): The page to return
-        size (int): The max number of items to return
+        cursor (str): The cursor
+        order_by (Sequence[InstrumentedAttribute]): The ordering keys of the query
+
+    Raises:
+        HTTPException[400]: Invalid cursor
 
     Returns:
-        Query: The paginated qs
+        tuple[str, list]: The direction and the values of the ordering keys
     """
-    return qs.limit(size).offset(size * (page - 1)).all()
+    try:
+        payload = orjson.loads(base64.urlsafe_b64decode(cursor.encode()))
+        direction, raw_values = payload["d"], payload["v"]
+        if direction not in ("next", "prev") or len(raw_values) != len(order_by):
+            raise ValueError("Malformed cursor")
+        values = []
+        for column, value in zip(order_by, raw_values):
+            python_type = column.type.python_type
+            if python_type is datetime:
+                values.append(datetime.fromisoformat(value))
+            else:
+                values.append(python_type(value))
+    except (ValueError, TypeError, KeyError, binascii.Error, orjson.JSONDecodeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+        )
+    return direction, values
+
+
+async def cursor_paginate(
+    *,
+    qs: Select,
+    db: AsyncSession,
+    order_by: Sequence[InstrumentedAttribute],
+    size: int,
+    cursor: str | None = None,
+    count_strategy: CountStrategy = CountStrategy.NONE,
+):
+    """This function paginates a queryset with a keyset (cursor) instead of an offset
+
+    Every page is a single indexed range scan of size + 1 rows, so the cost of a page
+    doesn't depend on how deep it is. Items are returned newest first i.e in
+    descending order of the ordering keys.
+
+    Args:
+        qs (Select): The qs to paginate
+        db (AsyncSession): The database session
+        order_by (Sequence[InstrumentedAttribute]): The ordering keys, the last key
+            must be unique e.g (created_at, id)
+        size (int): The max number of items to return (capped at MAX_PAGE_SIZE)
+        cursor (str | None, default=None): The cursor returned by a previous page
+        count_strategy (CountStrategy, default=none): How to count the total items.
+            exact (and cached, when it isn't cached yet) is counted in the page query
+            itself, estimated costs a cheap EXPLAIN
+
+    Raises:
+        HTTPException[400]: Invalid cursor
+
+    Returns:
+        tuple[list, dict]: The paginated items and the pagination metadata
+    """
+    size = max(1, min(size, MAX_PAGE_SIZE))
+    unfiltered_qs, total_no_items, cache_key = qs, None, None
+    if count_strategy == CountStrategy.ESTIMATED:
+        total_no_items = await _estimated_count(qs=qs, db=db)
+        if total_no_items is None:
+            count_strategy = CountStrategy.EXACT
+    elif count_strategy == CountStrategy.CACHED:
+        cache_key = _count_cache_key(qs)
+        total_no_items = count_cache.get(cache_key)
+    count_in_query = count_strategy == CountStrategy.EXACT or (
+        count_strategy == CountStrategy.CACHED and total_no_items is None
+    )
+
+    direction = "next"
+    if cursor is not None:
+        direction, values = decode_cursor(cursor=cursor, order_by=order_by)
+        keys, key_values = tuple_(*order_by), tuple_(*values)
+        qs = qs.where(keys < key_values if direction == "next" else keys > key_values)
+
+    if direction == "next":
+        qs = qs.order_by(*(column.desc() for column in order_by))
+    else:
+        qs = qs.order_by(*(column.asc() for column in order_by))
+    if count_in_query:
+        # A scalar subquery over the unfiltered query, a window count (count(*) OVER ())
+        # would only count the rows past the cursor
+        total_column = (
+            select(func.count())
+            .select_from(unfiltered_qs.order_by(None).subquery())
+            .scalar_subquery()
+            .label("total_no_items")
+        )
+        result = (await db.execute(qs.add_columns(total_column).limit(size + 1))).all()
+        rows = [row[0] for row in result]
+        if result:
+            total_no_items = result[0].total_no_items
+        else:
+            # An empty page has no row to report the total on
+            total_no_items = await _exact_count(qs=unfiltered_qs, db=db)
+        if cache_key is not None:
+            count_cache.set(cache_key, total_no_items)
+    else:
+        rows = list(await db.scalars(qs.limit(size + 1)))
+
+    has_more = len(rows) > size
+    items = rows[:size]
+    if direction == "next":
+        has_next_page, has_prev_page = has_more, cursor is not None
+    else:
+        items.reverse()
+        has_next_page, has_prev_page = True, has_more
+
+    def key_values_of(item):
+        return [getattr(item, column.key) for column in order_by]
+
+    metadata = {
+        "total_no_items": total_no_items,
+        "size": size,
+        "count": len(items),
+        "count_strategy": count_strategy,
+        "next_cursor": (
+            encode_cursor(values=key_values_of(items[-1]), direction="next")
+            if items and has_next_page
+            else None
+        ),
+        "prev_cursor": (
+            encode_cursor(values=key_values_of(items[0]), direction="prev")
+            if items and has_prev_page
+            else None
+        ),
+        "has_next_page": has_next_page,
+        "has_prev_page": has_prev_page,
+    }
+    return items, metadata
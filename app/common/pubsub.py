@@ -0,0 +1,331 @@
+"""This module contains the pub/sub used to push events to clients and across workers.
+
+On postgres events are published with NOTIFY inside the writing transaction (so they're
+only delivered once it commits) and every worker fans them out to its subscribers and
+handlers from a single LISTEN connection. On other databases (e.g in tests) events are
+delivered in process after the session commits.
+
+The LISTEN connection is reopened (with backoff) when it drops. The events sent while it
+was down are lost, so the reconnect handlers (e.g clearing the caches) are run and the
+subscribers are woken up to fetch what they missed.
+"""
+
+import asyncio
+import logging
+from collections import defaultdict
+from contextlib import asynccontextmanager, suppress
+from typing import Any, Awaitable, Callable, Hashable
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import event, func, select
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession
+
+from app.common.cache import principal_cache, token_cache
+from app.common.paginators import MAX_PAGE_SIZE
+from app.config.settings import get_settings
+
+settings = get_settings()
+
+logger = logging.getLogger(__name__)
+
+
+class Broker:
+    """Fans the events of a channel out to its handlers and the subscribers of a key
+
+    Subscribers only get woken up, they then fetch whatever is new themselves. So a
+    burst of events costs them one fetch and a missed event is picked up on the next.
+    Handlers are called with the key of every event of their channel.
+    """
+
+    def __init__(
+        self, min_reconnect_delay: float = 0.5, max_reconnect_delay: float = 30
+    ):
+        self._subscribers: defaultdict[tuple[str, str], set[asyncio.Queue]] = (
+            defaultdict(set)
+        )
+        self._handlers: defaultdict[str, list[Callable[[str], None]]] = defaultdict(
+            list
+        )
+        self._reconnect_handlers: list[Callable[[], Awaitable[None]]] = []
+        self.min_reconnect_delay = min_reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self._engine: AsyncEngine | None = None
+        self._connection: AsyncConnection | None = None
+        self._reconnect_task: asyncio.Task | None = None
+        self._channels: set[str] = set()
+        self._listening: set[str] = set()
+        self._lock = asyncio.Lock()
+
+    def add_handler(self, channel: str, handler: Callable[[str], None]):
+        """This function registers a function to call with the key of every event
+
+        Args:
+            channel (str): The channel
+            handler (Callable[[str], None]): The function, it must not block
+        """
+        self._handlers[channel].append(handler)
+        self._channels.add(channel)
+
+    def add_reconnect_handler(self, handler: Callable[[], Awaitable[None]]):
+        """This function registers a function to call after the LISTEN connection was
+        lost and reopened, to make up for the events sent in between
+
+        Args:
+            handler (Callable[[], Awaitable[None]]): The function
+        """
+        self._reconnect_handlers.append(handler)
+
+    async def start(self, engine: AsyncEngine):
+        """This function opens the worker's LISTEN connection (postgres only)
+
+        Args:
+            engine (AsyncEngine): The database engine
+        """
+        if engine.dialect.name != "postgresql" or self._engine is not None:
+            return
+        self._engine = engine
+        await self._connect()
+
+    async def stop(self):
+        """This function closes the worker's LISTEN connection"""
+        self._engine = None
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._reconnect_task
+            self._reconnect_task = None
+        if self._connection is not None:
+            await self._connection.close()
+            self._connection = None
+            self._listening.clear()
+
+    async def _connect(self):
+        """This function opens the LISTEN connection and LISTENs on every channel"""
+        self._connection = await self._engine.connect()
+        raw_connection = await self._connection.get_raw_connection()
+        raw_connection.driver_connection.add_termination_listener(self._on_terminate)
+        for channel in list(self._channels):
+            await self._listen(channel)
+
+    def _on_terminate(self, _connection):
+        """This is the asyncpg callback of the LISTEN connection being closed"""
+        if self._engine is not None and self._reconnect_task is None:
+            self._reconnect_task = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self):
+        """This function reopens the LISTEN connection, retrying with backoff
+
+        Events sent while disconnected are lost, so the reconnect handlers are run and
+        every subscriber is woken up to fetch whatever it missed.
+        """
+        if self._connection is not None:
+            with suppress(Exception):
+                await self._connection.invalidate()  # Don't put it back in the pool
+                await self._connection.close()
+            self._connection = None
+            self._listening.clear()
+
+        delay = self.min_reconnect_delay
+        while True:
+            try:
+                await self._connect()
+                break
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logger.warning("LISTEN reconnect failed, retrying in %ss: %s", delay, e)
+                if self._connection is not None:
+                    with suppress(Exception):
+                        await self._connection.invalidate()
+                    self._connection = None
+                    self._listening.clear()
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+        self._reconnect_task = None
+        logger.info("LISTEN connection reopened")
+
+        for handler in self._reconnect_handlers:
+            try:
+                await handler()
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.exception("Broker reconnect handler failed")
+        for queues in self._subscribers.values():
+            for queue in queues:
+                if queue.empty():
+                    queue.put_nowait(None)
+
+    async def _listen(self, channel: str):
+        """This function LISTENs on a channel the first time it's subscribed to"""
+        self._channels.add(channel)
+        if self._connection is None or channel in self._listening:
+            return
+        async with self._lock:
+            if channel in self._listening:
+                return
+            raw_connection = await self._connection.get_raw_connection()
+            await raw_connection.driver_connection.add_listener(
+                channel, self._on_notify
+            )
+            self._listening.add(channel)
+
+    def _on_notify(self, _connection, _pid, channel: str, payload: str):
+        """This is the asyncpg listener callback"""
+        self.dispatch(channel=channel, key=payload)
+
+    def dispatch(self, channel: str, key: Hashable):
+        """This function runs the handlers of a channel and wakes up the subscribers of
+        a key in this worker
+
+        Args:
+            channel (str): The channel
+            key (Hashable): The key the event is for
+        """
+        for handler in self._handlers.get(channel, ()):
+            handler(str(key))
+        for queue in self._subscribers.get((channel, str(key)), ()):
+            if queue.empty():
+                queue.put_nowait(None)
+
+    async def publish(self, db: AsyncSession, channel: str, key: Hashable):
+        """This function publishes an event once the session's transaction commits
+
+        Args:
+            db (AsyncSession): The database session the event was written in
+            channel (str): The channel
+            key (Hashable): The key the event is for
+        """
+        if db.get_bind().dialect.name == "postgresql":
+            # Queued in the writing transaction, sent by the primary when it commits
+            await db.execute(
+                select(func.pg_notify(channel, str(key))).execution_options(
+                    use_primary=True
+                )
+            )
+            return
+        event.listen(
+            db.sync_session,
+            "after_commit",
+            lambda _session: self.dispatch(channel=channel, key=key),
+            once=True,
+        )
+
+    @asynccontextmanager
+    async def subscribe(self, channel: str, key: Hashable):
+        """This function subscribes to the events of a key
+
+        Args:
+            channel (str): The channel
+            key (Hashable): The key to receive events for
+
+        Yields:
+            asyncio.Queue: Gets an item whenever there are new events
+        """
+        await self._listen(channel)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        subscribers = self._subscribers[(channel, str(key))]
+        subscribers.add(queue)
+        try:
+            yield queue
+        finally:
+            subscribers.discard(queue)
+            if not subscribers:
+                self._subscribers.pop((channel, str(key)), None)
+
+
+broker = Broker()
+
+CACHE_INVALIDATION_CHANNEL = "cache_invalidation"
+
+
+def evict_cached(key: str):
+    """This function evicts a key from this worker's caches
+
+    Args:
+        key (str): The cache key e.g USER-1 or a token digest
+    """
+    for cache in (principal_cache, token_cache):
+        cache.delete(key)
+
+
+broker.add_handler(channel=CACHE_INVALIDATION_CHANNEL, handler=evict_cached)
+
+
+async def clear_cached():
+    """This function empties this worker's caches, the invalidations sent while the
+    LISTEN connection was down never arrived"""
+    for cache in (principal_cache, token_cache):
+        cache.clear()
+
+
+broker.add_reconnect_handler(clear_cached)
+
+
+async def invalidate_cached(db: AsyncSession, key: str):
+    """This function evicts a changed entity from the caches of every worker
+
+    The entity is evicted in this worker right away and again on every worker once the
+    session's transaction commits, so call it before committing the change.
+
+    Args:
+        db (AsyncSession): The database session the entity was changed in
+        key (str): The entity's cache key e.g USER-1 or a revoked token's digest
+    """
+    evict_cached(key)
+    await broker.publish(db=db, channel=CACHE_INVALIDATION_CHANNEL, key=key)
+
+
+def format_event(*, event_id: int, data: Any, event_name: str = "message"):
+    """This function formats a Server-Sent Event
+
+    Args:
+        event_id (int): The event's ID, sent back by the client as Last-Event-ID
+        data (Any): The event's data, sent as JSON
+        event_name (str, default=message): The event's type
+
+    Returns:
+        str: The event
+    """
+    payload = orjson.dumps(jsonable_encoder(data)).decode()
+    return f"id: {event_id}\nevent: {event_name}\ndata: {payload}\n\n"
+
+
+async def stream_events(
+    *,
+    channel: str,
+    key: Hashable,
+    fetch_events: Callable[[int], Awaitable[list[tuple[int, Any]]]],
+    last_event_id: int,
+    event_name: str = "message",
+    keepalive: float = settings.SSE_KEEPALIVE_SECONDS,
+):
+    """This function streams the events of a key as Server-Sent Events
+
+    New events are fetched right after subscribing (which replays anything after
+    last_event_id), then whenever the broker wakes the stream up. A comment is sent
+    every keepalive seconds to keep proxies from closing the idle connection, events
+    are fetched then too in case a wake up was missed.
+
+    Args:
+        channel (str): The channel
+        key (Hashable): The key to stream the events of
+        fetch_events (Callable[[int], Awaitable[list[tuple[int, Any]]]]): Returns the
+            (id, data) of up to MAX_PAGE_SIZE events after an id in ascending order
+        last_event_id (int): The ID of the last event the client has
+        event_name (str, default=message): The events' type
+        keepalive (float): The max number of seconds between messages
+
+    Yields:
+        str: The events
+    """
+    async with broker.subscribe(channel=channel, key=key) as wake_up:
+        while True:
+            events = await fetch_events(last_event_id)
+            for event_id, data in events:
+                last_event_id = event_id
+                yield format_event(event_id=event_id, data=data, event_name=event_name)
+            if len(events) >= MAX_PAGE_SIZE:
+                continue  # There may be more to replay
+
+            try:
+                await asyncio.wait_for(wake_up.get(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
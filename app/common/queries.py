@@ -0,0 +1,79 @@
+"""This module contains helpers for dialect specific queries and constraint checked writes."""
+
+from sqlalchemy import or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+def dialect_insert(db: AsyncSession, table):
+    """This function returns an INSERT that supports ON CONFLICT for the session's database
+
+    Args:
+        db (AsyncSession): The database session
+        table: The model or table to insert into
+
+    Returns:
+        (postgresql.Insert | sqlite.Insert): The insert statement
+    """
+    if db.get_bind().dialect.name == "sqlite":
+        return sqlite.insert(table)
+    return postgresql.insert(table)
+
+
+async def insert_unique(db: AsyncSession, model, values: dict):
+    """This function inserts a row unless one of its unique values is already taken
+
+    It's a single INSERT ... ON CONFLICT DO NOTHING RETURNING, so the unique constraints
+    do the checking and concurrent inserts of the same value can't both get through.
+
+    Args:
+        db (AsyncSession): The database session
+        model: The model to insert
+        values (dict): The row's values
+
+    Returns:
+        The created obj or None when it conflicts with an existing row
+    """
+    return await db.scalar(
+        dialect_insert(db, model)
+        .values(**values)
+        .on_conflict_do_nothing()
+        .returning(model)
+    )
+
+
+async def get_unique_conflicts(
+    db: AsyncSession, model, values: dict, exclude_id: int | None = None
+):
+    """This function returns the unique columns whose values are already taken
+
+    A failed write only reports one of the constraints it broke, this finds all of them
+    for the error message. Only call it once the write has failed.
+
+    Args:
+        db (AsyncSession): The database session
+        model: The model that was written to
+        values (dict): The values that were written
+        exclude_id (int | None, default=None): The ID of the row that was updated
+
+    Returns:
+        list[str]: The names of the conflicting columns
+    """
+    columns = [
+        column
+        for column in model.__table__.columns
+        if column.unique and values.get(column.key) is not None
+    ]
+    if not columns:
+        return []
+    query = select(model).where(
+        or_(*(column == values[column.key] for column in columns))
+    )
+    if exclude_id is not None:
+        query = query.where(model.id != exclude_id)
+    rows = (await db.scalars(query)).all()
+    return [
+        column.key
+        for column in columns
+        if any(getattr(row, column.key) == values[column.key] for row in rows)
+    ]
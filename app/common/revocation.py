@@ -0,0 +1,223 @@
+"""This module contains the in-memory access token revocation list.
+
+Every worker keeps the revoked subjects in memory, behind a bloom filter so the common
+case (not revoked) is a few bit lookups. It's reloaded from the token_revocations table
+periodically and new revocations are pushed to every worker through the broker.
+"""
+
+import asyncio
+import hashlib
+import logging
+import math
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.common.models import TokenRevocation
+from app.common.pubsub import broker
+from app.config.database import SessionLocal
+from app.config.settings import get_settings
+
+settings = get_settings()
+
+logger = logging.getLogger(__name__)
+
+TOKEN_REVOCATION_CHANNEL = "token_revocation"
+RECENT_REVOCATION_SECONDS = 60
+
+
+class BloomFilter:
+    """A fixed size set that can have false positives but never false negatives"""
+
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(capacity, 1)
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray(math.ceil(self.size / 8))
+
+    def _positions(self, key: str):
+        """This function returns the bit positions of a key (double hashing)"""
+        digest = hashlib.sha256(key.encode()).digest()
+        h1, h2 = int.from_bytes(digest[:8], "big"), int.from_bytes(digest[8:16], "big")
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, key: str):
+        """This function adds a key to the filter"""
+        for position in self._positions(key):
+            self._bits[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, key: str):
+        return all(
+            self._bits[position // 8] & (1 << (position % 8))
+            for position in self._positions(key)
+        )
+
+
+class RevocationList:
+    """The revoked subjects and when they were revoked
+
+    A token is revoked when its subject was revoked at or after the token was issued,
+    so logging in again after being logged out works right away.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.false_positives = 0
+        self._revoked: dict[str, float] = {}
+        self._bloom = BloomFilter(capacity=capacity, error_rate=error_rate)
+
+    def __len__(self):
+        return len(self._revoked)
+
+    def add(self, subject: str, revoked_at: float):
+        """This function revokes the tokens of a subject issued up to revoked_at
+
+        Args:
+            subject (str): The token subject e.g USER-1
+            revoked_at (float): The revocation timestamp
+        """
+        if revoked_at > self._revoked.get(subject, 0):
+            self._revoked[subject] = revoked_at
+        if len(self._revoked) > self.capacity:
+            # Past capacity the false positive rate climbs, so grow the filter
+            self.replace(entries=self._revoked)
+        else:
+            self._bloom.add(subject)
+
+    def replace(self, entries: dict[str, float]):
+        """This function replaces every revocation, e.g with a fresh load of the table
+
+        Args:
+            entries (dict[str, float]): The subjects and their revocation timestamps
+        """
+        self.capacity = max(self.capacity, 2 * len(entries))
+        bloom = BloomFilter(capacity=self.capacity, error_rate=self.error_rate)
+        for subject in entries:
+            bloom.add(subject)
+        self._revoked, self._bloom = dict(entries), bloom
+
+    def is_revoked(self, subject: str, issued_at: float):
+        """This function checks if a token has been revoked
+
+        Args:
+            subject (str): The token's subject
+            issued_at (float): The token's iat
+
+        Returns:
+            bool: True if the token has been revoked
+        """
+        if subject not in self._bloom:
+            return False
+        revoked_at = self._revoked.get(subject)
+        if revoked_at is None:
+            self.false_positives += 1
+            return False
+        return issued_at <= revoked_at
+
+    async def load(self, db: AsyncSession):
+        """This function reloads the unexpired revocations from the database
+
+        Args:
+            db (AsyncSession): The database session
+        """
+        now = datetime.now().astimezone()
+        rows = await db.execute(
+            select(TokenRevocation.subject, func.max(TokenRevocation.revoked_at))
+            .where(TokenRevocation.expires_at > now)
+            .group_by(TokenRevocation.subject)
+        )
+        entries = {subject: revoked_at.timestamp() for subject, revoked_at in rows}
+
+        # Keep the revocations made while loading, they may not have been committed yet
+        recent = now.timestamp() - RECENT_REVOCATION_SECONDS
+        for subject, revoked_at in self._revoked.items():
+            if revoked_at >= recent and revoked_at > entries.get(subject, 0):
+                entries[subject] = revoked_at
+        self.replace(entries=entries)
+
+    def stats(self):
+        """This function returns the size of the revocation list
+
+        Returns:
+            dict: The revocation list stats
+        """
+        return {
+            "size": len(self._revoked),
+            "capacity": self.capacity,
+            "bloom_filter_bits": self._bloom.size,
+            "false_positives": self.false_positives,
+        }
+
+
+revocation_list = RevocationList(capacity=settings.TOKEN_REVOCATION_CAPACITY)
+
+
+def _on_revocation(key: str):
+    """This is the broker handler of the token revocation channel"""
+    subject, revoked_at = key.rsplit(" ", 1)
+    revocation_list.add(subject=subject, revoked_at=float(revoked_at))
+
+
+broker.add_handler(channel=TOKEN_REVOCATION_CHANNEL, handler=_on_revocation)
+
+
+async def _reload_revocations():
+    """This is the broker reconnect handler, it picks up the revocations pushed while
+    the LISTEN connection was down"""
+    async with SessionLocal() as db:
+        await revocation_list.load(db=db)
+
+
+broker.add_reconnect_handler(_reload_revocations)
+
+
+async def revoke_subject(db: AsyncSession, subject: str):
+    """This function revokes every access token issued to a subject so far
+
+    Tokens are rejected by every worker once the session's transaction commits (this
+    one without waiting for the NOTIFY), so call it before committing. Nothing is
+    revoked if the transaction is rolled back.
+
+    Args:
+        db (AsyncSession): The database session
+        subject (str): The token subject e.g USER-1
+    """
+    revoked_at = datetime.now().astimezone()  # Aware, compared with the tokens' iat
+    db.add(
+        TokenRevocation(
+            subject=subject,
+            revoked_at=revoked_at,
+            expires_at=revoked_at
+            + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES),
+        )
+    )
+    event.listen(
+        db.sync_session,
+        "after_commit",
+        lambda _session: revocation_list.add(
+            subject=subject, revoked_at=revoked_at.timestamp()
+        ),
+        once=True,
+    )
+    await broker.publish(
+        db=db,
+        channel=TOKEN_REVOCATION_CHANNEL,
+        key=f"{subject} {revoked_at.timestamp()}",
+    )
+
+
+async def sync_revocations_periodically(interval: int):
+    """This function reloads the revocation list every interval seconds until cancelled
+
+    Args:
+        interval (int): The number of seconds between reloads
+    """
+    while True:
+        try:
+            async with SessionLocal() as db:
+                await revocation_list.load(db=db)
+        except Exception:  # pylint: disable=broad-exception-caught
+            logger.exception("Reload of the token revocation list failed")
+        await asyncio.sleep(interval)
@@ -3,6 +3,8 @@
 from typing import Any
 from pydantic import BaseModel, Field
 
+from app.common.types import CountStrategy
+
 
 class ResponseSchema(BaseModel):
     """The generic response schema for the application."""
@@ -11,14 +13,19 @@ class ResponseSchema(BaseModel):
     data: Any = Field(description="The data")
 
 
-class PaginationSchema(BaseModel):
-    """The generic pagination schema for the application."""
+class CursorPaginationSchema(BaseModel):
+    """The generic cursor pagination schema for the application."""
 
-    total_no_items: int = Field(description="The total number of items available")
-    total_no_pages: int = Field(description="The total number of pages")
-    page: int = Field(description="The current page number")
+    total_no_items: int | None = Field(
+        description="The total number of items available (None when not counted)"
+    )
     size: int = Field(description="Max number of items to return per page")
     count: int = Field(description="The number of items returned")
+    count_strategy: CountStrategy = Field(
+        description="The strategy that produced total_no_items"
+    )
+    next_cursor: str | None = Field(description="The cursor of the next page")
+    prev_cursor: str | None = Field(description="The cursor of the previous page")
     has_next_page: bool = Field(description="Indicates if there is a next page")
     has_prev_page: bool = Field(description="Indicates if there is a previous page")
 
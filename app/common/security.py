@@ -1,12 +1,30 @@
 """This module contains the security functions for the application."""
 
+import asyncio
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+from cryptography.hazmat.primitives.serialization import (
+    load_pem_private_key,
+    load_pem_public_key,
+)
+from fastapi import HTTPException, status
+from jwt.algorithms import OKPAlgorithm, RSAAlgorithm
 from passlib.context import CryptContext
+from starlette.concurrency import run_in_threadpool
 
 from app.config.settings import get_settings
 
-
 settings = get_settings()
 
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
 
 def hash_password(raw: str) -> str:
     """This function hashes a password
@@ -17,7 +35,6 @@ def hash_password(raw: str) -> str:
     Returns:
         str: The hashed password
     """
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
     return pwd_context.hash(raw)
 
 
@@ -31,5 +48,250 @@ def verify_password(plain_password: str, hashed_password: str):
     Returns:
         bool: True if the password is correct, False otherwise
     """
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
     return pwd_context.verify(plain_password, hashed_password)
+
+
+def hash_token(token: str) -> str:
+    """This function returns the fixed width digest tokens are stored and looked up by
+
+    Args:
+        token (str): The raw token
+
+    Returns:
+        str: The sha256 hex digest of the token
+    """
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class PasswordHasher:
+    """Runs the bcrypt hashing functions in a bounded process pool
+
+    bcrypt is CPU bound, running it on the event loop stalls every in-flight request.
+    Until `start` is called (e.g in tests) the work falls back to the thread pool.
+    """
+
+    def __init__(self, max_workers: int, max_queue: int):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor: ProcessPoolExecutor | None = None
+        self._pending = 0
+
+    def start(self):
+        """This function starts the process pool"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+
+    def stop(self):
+        """This function shuts down the process pool"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    async def _run(self, func, *args):
+        """This function runs func in the pool
+
+        Raises:
+            HTTPException[503]: The pool's queue is full
+        """
+        if self._pending >= self.max_workers + self.max_queue:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server is busy, please try again",
+            )
+        self._pending += 1
+        try:
+            if self._executor is None:
+                return await run_in_threadpool(func, *args)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self._pending -= 1
+
+    async def hash(self, raw: str) -> str:
+        """This function hashes a password without blocking the event loop
+
+        Args:
+            raw (str): The raw password
+
+        Returns:
+            str: The hashed password
+        """
+        return await self._run(hash_password, raw)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        """This function verifies a password without blocking the event loop
+
+        Args:
+            plain_password (str): The plain password
+            hashed_password (str): The hashed password
+
+        Returns:
+            bool: True if the password is correct, False otherwise
+        """
+        return await self._run(verify_password, plain_password, hashed_password)
+
+
+password_hasher = PasswordHasher(
+    max_workers=settings.PASSWORD_HASHER_WORKERS,
+    max_queue=settings.PASSWORD_HASHER_QUEUE_DEPTH,
+)
+
+
+@dataclass(frozen=True)
+class SigningKey:
+    """A key of the key ring, the private key is None for verification only keys"""
+
+    kid: str
+    algorithm: str
+    public_key: Any
+    private_key: Any = None
+
+
+class KeyRing:
+    """The keys tokens are signed and verified with, indexed by kid
+
+    Every key is loaded once, when the ring is built. Tokens are signed with the active
+    key (EdDSA for Ed25519 keys, RS256 for RSA keys) and carry its kid in their header,
+    they're verified with the key of that kid and its algorithm only. Without a kid
+    they're verified with the HS secret, if there is one.
+
+    To rotate, add the new key and publish it (it shows up in the JWKS), switch the
+    active kid once downstream caches have it, then swap the old private key for its
+    public key (<kid>.pub.pem) until the tokens it signed have expired.
+    """
+
+    def __init__(
+        self,
+        keys: list[SigningKey],
+        active_kid: str | None = None,
+        secret: str | None = None,
+        secret_algorithm: str | None = None,
+    ):
+        self.keys = {key.kid: key for key in keys}
+        self.secret = secret
+        self.secret_algorithm = secret_algorithm
+        signing_kids = [key.kid for key in keys if key.private_key is not None]
+        if active_kid is None and signing_kids:
+            active_kid = sorted(signing_kids)[-1]
+        if active_kid is not None and active_kid not in signing_kids:
+            raise ValueError(f"No private key for the active kid {active_kid}")
+        if active_kid is None and not secret:
+            raise ValueError("A signing key or secret is required")
+        self.active_kid = active_kid
+
+    @staticmethod
+    def load_key(kid: str, pem: bytes):
+        """This function loads a PEM encoded Ed25519/RSA private or public key
+
+        Args:
+            kid (str): The key's ID
+            pem (bytes): The PEM encoded key
+
+        Raises:
+            ValueError: The key isn't an Ed25519 or RSA key
+
+        Returns:
+            SigningKey: The key
+        """
+        if b"PRIVATE KEY" in pem:
+            private_key = load_pem_private_key(pem, password=None)
+            public_key = private_key.public_key()
+        else:
+            private_key, public_key = None, load_pem_public_key(pem)
+        if isinstance(public_key, ed25519.Ed25519PublicKey):
+            algorithm = "EdDSA"
+        elif isinstance(public_key, rsa.RSAPublicKey):
+            algorithm = "RS256"
+        else:
+            raise ValueError(f"Unsupported key type for kid {kid}")
+        return SigningKey(
+            kid=kid, algorithm=algorithm, public_key=public_key, private_key=private_key
+        )
+
+    @classmethod
+    def from_settings(cls):
+        """This function builds the key ring from the settings
+
+        Keys are read from JWT_KEYS_DIR, <kid>.pem for signing keys and <kid>.pub.pem
+        for verification only keys.
+
+        Returns:
+            KeyRing: The key ring
+        """
+        keys = []
+        if settings.JWT_KEYS_DIR:
+            for path in sorted(Path(settings.JWT_KEYS_DIR).glob("*.pem")):
+                kid = path.name.removesuffix(".pem").removesuffix(".pub")
+                keys.append(cls.load_key(kid=kid, pem=path.read_bytes()))
+        return cls(
+            keys=keys,
+            active_kid=settings.JWT_ACTIVE_KID or None,
+            secret=settings.SECRET_KEY,
+            secret_algorithm=settings.HASHING_ALGORITHM,
+        )
+
+    def encode(self, payload: dict):
+        """This function signs a token with the active key
+
+        Args:
+            payload (dict): The token's claims
+
+        Returns:
+            str: The token
+        """
+        if self.active_kid is None:
+            return jwt.encode(
+                payload=payload, key=self.secret, algorithm=self.secret_algorithm
+            )
+        key = self.keys[self.active_kid]
+        return jwt.encode(
+            payload=payload,
+            key=key.private_key,
+            algorithm=key.algorithm,
+            headers={"kid": key.kid},
+        )
+
+    def decode(self, token: str):
+        """This function verifies a token with the key of its kid
+
+        Args:
+            token (str): The token
+
+        Raises:
+            jwt.PyJWTError: The token is invalid, expired or signed with an unknown key
+
+        Returns:
+            dict: The token's claims
+        """
+        kid = jwt.get_unverified_header(token).get("kid")
+        if kid is None:
+            if not self.secret:
+                raise jwt.InvalidKeyError("Token has no kid")
+            return jwt.decode(
+                jwt=token, key=self.secret, algorithms=[self.secret_algorithm]
+            )
+        key = self.keys.get(kid)
+        if key is None:
+            raise jwt.InvalidKeyError(f"Unknown kid {kid}")
+        return jwt.decode(jwt=token, key=key.public_key, algorithms=[key.algorithm])
+
+    def jwks(self):
+        """This function returns the public keys as a JSON Web Key Set
+
+        Returns:
+            dict: The JWKS
+        """
+        jwks = []
+        for key in self.keys.values():
+            if key.algorithm == "EdDSA":
+                jwk = OKPAlgorithm.to_jwk(key.public_key, as_dict=True)
+            else:
+                jwk = RSAAlgorithm.to_jwk(key.public_key, as_dict=True)
+            jwks.append({**jwk, "kid": key.kid, "alg": key.algorithm, "use": "sig"})
+        return {"keys": jwks}
+
+
+key_ring = KeyRing.from_settings()
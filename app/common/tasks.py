@@ -0,0 +1,144 @@
+"""This module contains the background maintenance tasks of the application.
+
+The token purge can also be run on its own e.g from a cron job:
+    $ python -m app.common.tasks
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, or_, select
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.admins import models as admin_models
+from app.common.models import TokenRevocation
+from app.config.database import SessionLocal
+from app.config.settings import get_settings
+from app.user import models as user_models
+
+settings = get_settings()
+
+logger = logging.getLogger(__name__)
+
+
+def get_expired_token_filters():
+    """This function returns the expired rows filter of each token table
+
+    Returns:
+        dict: The token model and its expired rows filter
+    """
+    now = datetime.now()
+    reset_token_expiry = now - timedelta(
+        minutes=settings.PASSWORD_RESET_TOKEN_EXPIRE_MINUTES
+    )
+    return {
+        user_models.UserRefreshToken: user_models.UserRefreshToken.expires_at <= now,
+        admin_models.AdminRefreshToken: admin_models.AdminRefreshToken.expires_at
+        <= now,
+        TokenRevocation: TokenRevocation.expires_at <= now,
+        user_models.UserPasswordResetToken: or_(
+            user_models.UserPasswordResetToken.is_used.is_(True),
+            user_models.UserPasswordResetToken.created_at <= reset_token_expiry,
+        ),
+    }
+
+
+async def purge_expired_tokens(
+    db: AsyncSession,
+    batch_size: int = settings.TOKEN_PURGE_BATCH_SIZE,
+    max_batches: int = settings.TOKEN_PURGE_MAX_BATCHES,
+    lock_timeout: int = settings.TOKEN_PURGE_LOCK_TIMEOUT_MS,
+):
+    """This function deletes expired refresh tokens and revocations, and used/expired
+    password reset tokens
+
+    Rows are deleted in batches of batch_size, each in its own short transaction.
+    On postgres, rows locked by other transactions are skipped and each batch gives
+    up after lock_timeout ms instead of queueing behind a lock. A table stops being
+    purged once a batch comes back short or after max_batches batches.
+
+    Args:
+        db (AsyncSession): The database session
+        batch_size (int): The max number of rows deleted per statement
+        max_batches (int): The max number of batches per table
+        lock_timeout (int): The max time (ms) a batch waits for a lock on postgres
+
+    Returns:
+        dict: The number of rows deleted per table and how long the purge took
+    """
+    started_at = time.perf_counter()
+    is_postgres = (await db.connection()).dialect.name == "postgresql"
+    rows_deleted = {}
+
+    for model, expired in get_expired_token_filters().items():
+        rows_deleted[model.__tablename__] = 0
+        for _ in range(max_batches):
+            expired_ids = (
+                select(model.id)
+                .where(expired)
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            try:
+                if is_postgres:
+                    # SET LOCAL lock_timeout, scoped to this batch's transaction
+                    await db.execute(
+                        select(
+                            func.set_config("lock_timeout", f"{lock_timeout}ms", True)
+                        )
+                    )
+                result = await db.execute(
+                    delete(model)
+                    .where(model.id.in_(expired_ids.scalar_subquery()))
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+            except DBAPIError as e:
+                await db.rollback()
+                logger.warning(
+                    "Purge of %s stopped early: %s", model.__tablename__, e.orig
+                )
+                break
+            rows_deleted[model.__tablename__] += result.rowcount
+            if result.rowcount < batch_size:
+                break
+            await asyncio.sleep(0)  # Let other tasks run between batches
+
+    return {
+        "rows_deleted": rows_deleted,
+        "duration_seconds": round(time.perf_counter() - started_at, 3),
+    }
+
+
+async def purge_expired_tokens_periodically(interval: int):
+    """This function runs purge_expired_tokens every interval seconds until cancelled
+
+    Args:
+        interval (int): The number of seconds between purges
+    """
+    while True:
+        try:
+            async with SessionLocal() as db:
+                report = await purge_expired_tokens(db=db)
+            logger.info(
+                "Purged expired tokens %s in %ss",
+                report["rows_deleted"],
+                report["duration_seconds"],
+            )
+        except Exception:  # pylint: disable=broad-exception-caught
+            logger.exception("Purge of expired tokens failed")
+        await asyncio.sleep(interval)
+
+
+async def main():
+    """This function purges the expired tokens once and prints the report"""
+    async with SessionLocal() as db:
+        report = await purge_expired_tokens(db=db)
+    print(report)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
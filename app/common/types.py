@@ -1,10 +1,37 @@
 """This module contains common types used in the application."""
 
-from typing import NamedTuple
+from enum import Enum
+from typing import Annotated, NamedTuple
 
+from pydantic import AfterValidator, EmailStr
 
-class PaginationParamsType(NamedTuple):
-    """The pagination parameters for the application."""
 
-    page: int
+class CursorPaginationParamsType(NamedTuple):
+    """The cursor pagination parameters for the application."""
+
+    cursor: str | None
     size: int
+
+
+class AccessTokenClaims(NamedTuple):
+    """The claims of a verified access token, enough to authorize without a query."""
+
+    id: int
+    subject: str
+    is_active: bool
+    is_verified: bool | None = None  # Users only
+    permission: str | None = None  # Admins only
+
+
+class CountStrategy(str, Enum):
+    """The strategies used to count the total items of a paginated query."""
+
+    EXACT = "exact"  # count(*) OVER () computed in the page query
+    ESTIMATED = "estimated"  # The query planner's row estimate
+    CACHED = "cached"  # An exact count cached for PAGINATION_COUNT_CACHE_TTL seconds
+    NONE = "none"  # Not counted, has_next_page is derived by fetching size + 1 rows
+
+
+# Emails are stored and looked up lowercased, so they're unique case insensitively and
+# compared with the plain unique index
+NormalizedEmail = Annotated[EmailStr, AfterValidator(str.lower)]
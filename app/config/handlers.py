@@ -2,6 +2,7 @@ from fastapi import HTTPException, Request, status
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
+from sqlalchemy.exc import IntegrityError
 
 
 async def request_validation_exception_handler(_: Request, exc: RequestValidationError):
@@ -44,6 +45,24 @@ async def http_exception_handler(_: Request, exc: HTTPException):
     )
 
 
+async def integrity_error_handler(request: Request, exc: IntegrityError):
+    """This function handles constraint violations that weren't handled where they
+    were raised
+
+    Emails are lowercased in Python but the CHECK constraints (ck_*_lowercase) compare
+    them with the database's lower(), the two can disagree on some non-ASCII
+    characters. Such emails are rejected instead of failing with a 500.
+    """
+    if "_lowercase" in str(exc.orig):
+        return JSONResponse(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            content=jsonable_encoder(
+                {"status": "error", "data": {"message": "Invalid email"}}
+            ),
+        )
+    return await uncaptured_exception_handler(request, exc)
+
+
 async def uncaptured_exception_handler(_: Request, exc: Exception):
     """This function handles uncaptured exceptions raised by the application"""
     # send email to the developers
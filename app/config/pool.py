@@ -0,0 +1,202 @@
+"""This module contains the connection pool tracing.
+
+Every checkout is attributed to the route of the request it was made for (set by
+get_db), so when the pool runs dry the routes waiting on and holding connections show
+up in the internal pool endpoint. Connections held too long are logged with the stack
+of the task holding them.
+"""
+
+import asyncio
+import io
+import logging
+import time
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
+
+from sqlalchemy import AsyncAdaptedQueuePool, Pool, QueuePool, event
+
+from app.config.settings import get_settings
+
+settings = get_settings()
+
+logger = logging.getLogger(__name__)
+
+# The route connections are checked out for e.g GET /users/me, None outside requests
+current_route: ContextVar[str | None] = ContextVar("current_route", default=None)
+
+BACKGROUND_ROUTE = "(background)"
+
+
+@dataclass
+class RouteStats:
+    """The checkouts of a route"""
+
+    checkouts: int = 0
+    held: int = 0
+    leaks: int = 0
+    wait_total: float = 0.0
+    wait_max: float = 0.0
+    hold_total: float = 0.0
+    hold_max: float = 0.0
+
+
+@dataclass
+class Checkout:
+    """A checked out connection"""
+
+    route: str
+    checked_out_at: float
+    task: asyncio.Task | None
+    leaked: bool = False
+
+
+class PoolTracer:
+    """Records how long every route waits for and holds connections
+
+    This isn't thread safe, it's meant to be used from the event loop.
+    """
+
+    def __init__(self, leak_threshold: float):
+        self.leak_threshold = leak_threshold
+        self.routes: dict[str, RouteStats] = {}
+        self._checkouts: dict[object, Checkout] = {}
+
+    def _route_stats(self, route: str):
+        """This function returns the stats of a route, created on first use"""
+        if (stats := self.routes.get(route)) is None:
+            stats = self.routes[route] = RouteStats()
+        return stats
+
+    def on_wait(self, seconds: float):
+        """This function records how long a checkout waited for a connection
+
+        Args:
+            seconds (float): The time spent waiting
+        """
+        stats = self._route_stats(current_route.get() or BACKGROUND_ROUTE)
+        stats.wait_total += seconds
+        stats.wait_max = max(stats.wait_max, seconds)
+
+    def on_checkout(self, _dbapi_connection, connection_record, _connection_proxy):
+        """This is the pool listener that starts the hold time of a connection"""
+        route = current_route.get() or BACKGROUND_ROUTE
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:  # No running event loop
+            task = None
+        self._checkouts[connection_record] = Checkout(
+            route=route, checked_out_at=time.perf_counter(), task=task
+        )
+        stats = self._route_stats(route)
+        stats.checkouts += 1
+        stats.held += 1
+
+    def on_checkin(self, _dbapi_connection, connection_record):
+        """This is the pool listener that records the hold time of a connection"""
+        checkout = self._checkouts.pop(connection_record, None)
+        if checkout is None:
+            return
+        held_for = time.perf_counter() - checkout.checked_out_at
+        stats = self._route_stats(checkout.route)
+        stats.held -= 1
+        stats.hold_total += held_for
+        stats.hold_max = max(stats.hold_max, held_for)
+
+    def check_leaks(self):
+        """This function logs the connections held longer than the leak threshold
+
+        Each one is logged once, with the stack of the task holding it. Connections
+        checked out outside requests (e.g the LISTEN connection) are expected to be
+        held and aren't reported.
+
+        Returns:
+            int: The number of new leaks
+        """
+        now = time.perf_counter()
+        leaks = 0
+        for checkout in self._checkouts.values():
+            held_for = now - checkout.checked_out_at
+            if (
+                checkout.leaked
+                or checkout.route == BACKGROUND_ROUTE
+                or held_for < self.leak_threshold
+            ):
+                continue
+            checkout.leaked = True
+            self._route_stats(checkout.route).leaks += 1
+            leaks += 1
+            stack = io.StringIO()
+            if checkout.task is not None:
+                checkout.task.print_stack(file=stack)
+            logger.warning(
+                "Connection held for %.1fs by %s\n%s",
+                held_for,
+                checkout.route,
+                stack.getvalue(),
+            )
+        return leaks
+
+    async def check_leaks_periodically(self):
+        """This function checks for leaks every leak threshold seconds until cancelled"""
+        while True:
+            await asyncio.sleep(self.leak_threshold)
+            self.check_leaks()
+
+    def stats(self):
+        """This function returns the checkout stats of every route
+
+        Returns:
+            dict: The stats by route, the slowest waits first
+        """
+        routes = {}
+        for route, stats in self.routes.items():
+            values = asdict(stats)
+            wait_total, hold_total = values.pop("wait_total"), values.pop("hold_total")
+            values["wait_avg"] = (
+                wait_total / stats.checkouts if stats.checkouts else 0.0
+            )
+            values["hold_avg"] = (
+                hold_total / stats.checkouts if stats.checkouts else 0.0
+            )
+            routes[route] = values
+        return dict(
+            sorted(routes.items(), key=lambda item: item[1]["wait_max"], reverse=True)
+        )
+
+
+pool_tracer = PoolTracer(leak_threshold=settings.DB_POOL_LEAK_SECONDS)
+
+
+class TracedQueuePool(AsyncAdaptedQueuePool):
+    """The async queue pool, timing how long every checkout waits for a connection"""
+
+    def connect(self):
+        started_at = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            pool_tracer.on_wait(time.perf_counter() - started_at)
+
+
+event.listen(Pool, "checkout", pool_tracer.on_checkout)
+event.listen(Pool, "checkin", pool_tracer.on_checkin)
+
+
+def get_pool_status(pool: Pool):
+    """This function returns how many connections a pool has and how many are in use
+
+    Args:
+        pool (Pool): The connection pool
+
+    Returns:
+        dict: The pool's status
+    """
+    if not isinstance(pool, QueuePool):
+        return {"class": type(pool).__name__}
+    return {
+        "class": type(pool).__name__,
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+    }
@@ -17,13 +17,97 @@ class Settings(BaseSettings):
     SECRET_KEY: str = os.environ.get("SECRET_KEY")
     HASHING_ALGORITHM: str = os.environ.get("HASHING_ALGORITHM")
 
+    # Token Signing Keys (<kid>.pem files, tokens are signed with SECRET_KEY when unset)
+    JWT_KEYS_DIR: str | None = os.environ.get("JWT_KEYS_DIR")
+    JWT_ACTIVE_KID: str | None = os.environ.get("JWT_ACTIVE_KID")
+    JWKS_MAX_AGE_SECONDS: int = os.environ.get("JWKS_MAX_AGE_SECONDS", 300)
+
     # Token
     ACCESS_TOKEN_EXPIRE_MINUTES: int = os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES")
     REFRESH_TOKEN_EXPIRE_HOURS: int = os.environ.get("REFRESH_TOKEN_EXPIRE_MINUTES")
     REFRESH_TOKEN_EXPIRE_HOURS_LONG: int = os.environ.get("REFRESH_TOKEN")
-    # PASSWORD_RESET_TOKEN_EXPIRE_MINUTES: int = os.environ.get("PASSWORD_RESET_TOKEN_EXPIRE_MINUTES")
+    PASSWORD_RESET_TOKEN_EXPIRE_MINUTES: int = os.environ.get(
+        "PASSWORD_RESET_TOKEN_EXPIRE_MINUTES", 60
+    )
+
+    # Token Purge (set TOKEN_PURGE_INTERVAL_SECONDS to 0 to only purge from the CLI)
+    TOKEN_PURGE_INTERVAL_SECONDS: int = os.environ.get(
+        "TOKEN_PURGE_INTERVAL_SECONDS", 3600
+    )
+    TOKEN_PURGE_BATCH_SIZE: int = os.environ.get("TOKEN_PURGE_BATCH_SIZE", 1000)
+    TOKEN_PURGE_MAX_BATCHES: int = os.environ.get("TOKEN_PURGE_MAX_BATCHES", 100)
+    TOKEN_PURGE_LOCK_TIMEOUT_MS: int = os.environ.get(
+        "TOKEN_PURGE_LOCK_TIMEOUT_MS", 100
+    )
+
+    # Password Hashing
+    PASSWORD_HASHER_WORKERS: int = os.environ.get("PASSWORD_HASHER_WORKERS", 2)
+    PASSWORD_HASHER_QUEUE_DEPTH: int = os.environ.get("PASSWORD_HASHER_QUEUE_DEPTH", 64)
+
+    # Access Token Revocation List
+    TOKEN_REVOCATION_CAPACITY: int = os.environ.get("TOKEN_REVOCATION_CAPACITY", 10_000)
+    TOKEN_REVOCATION_SYNC_SECONDS: int = os.environ.get(
+        "TOKEN_REVOCATION_SYNC_SECONDS", 30
+    )
+
+    # Verified Access Token Cache
+    TOKEN_CACHE_MAXSIZE: int = os.environ.get("TOKEN_CACHE_MAXSIZE", 10_000)
+
+    # Principal Cache (get_current_user/get_current_admin)
+    PRINCIPAL_CACHE_TTL: int = os.environ.get("PRINCIPAL_CACHE_TTL", 60)
+    PRINCIPAL_CACHE_MAXSIZE: int = os.environ.get("PRINCIPAL_CACHE_MAXSIZE", 10_000)
+
+    # Pagination
+    PAGINATION_COUNT_CACHE_TTL: int = os.environ.get("PAGINATION_COUNT_CACHE_TTL", 30)
+
+    # Server-Sent Events
+    SSE_KEEPALIVE_SECONDS: int = os.environ.get("SSE_KEEPALIVE_SECONDS", 15)
+
+    # Admission Control (requests over ADMISSION_MAX_CONCURRENCY are queued, 0 to disable)
+    ADMISSION_MAX_CONCURRENCY: int = os.environ.get("ADMISSION_MAX_CONCURRENCY", 100)
+    ADMISSION_QUEUE_DEPTH: int = os.environ.get("ADMISSION_QUEUE_DEPTH", 200)
+    ADMISSION_QUEUE_TIMEOUT_SECONDS: float = os.environ.get(
+        "ADMISSION_QUEUE_TIMEOUT_SECONDS", 5
+    )
+    ADMISSION_RETRY_AFTER_SECONDS: int = os.environ.get(
+        "ADMISSION_RETRY_AFTER_SECONDS", 1
+    )
+
     # DB Settings
     POSTGRES_DATABASE_URL: str = os.environ.get("POSTGRES_DATABASE_URL")
+    # Bypasses PgBouncer, for LISTEN and migrations when behind a transaction pooler
+    POSTGRES_DIRECT_DATABASE_URL: str | None = os.environ.get(
+        "POSTGRES_DIRECT_DATABASE_URL"
+    )
+
+    # Connection Pool (DB_POOL_MODE is queue, or null to leave pooling to PgBouncer)
+    DB_POOL_MODE: str = os.environ.get("DB_POOL_MODE", "queue")
+    DB_TRANSACTION_POOLER: bool = os.environ.get("DB_TRANSACTION_POOLER", False)
+    DB_MAX_CONNECTIONS: int = os.environ.get("DB_MAX_CONNECTIONS", 100)
+    # DB_MAX_CONNECTIONS is shared by the workers of every host, DB_WORKER_COUNT is
+    # their total (0 for DB_HOST_COUNT x WEB_CONCURRENCY, the workers per host)
+    DB_HOST_COUNT: int = os.environ.get("DB_HOST_COUNT", 1)
+    WEB_CONCURRENCY: int = os.environ.get("WEB_CONCURRENCY", 1)
+    DB_WORKER_COUNT: int = os.environ.get("DB_WORKER_COUNT", 0)
+    DB_POOL_TIMEOUT_SECONDS: float = os.environ.get("DB_POOL_TIMEOUT_SECONDS", 30)
+
+    # Connection Validation (checkout pings on every checkout, background pings idle
+    # connections every DB_POOL_VALIDATION_INTERVAL_SECONDS)
+    DB_POOL_VALIDATION: str = os.environ.get("DB_POOL_VALIDATION", "checkout")
+    DB_POOL_VALIDATION_INTERVAL_SECONDS: float = os.environ.get(
+        "DB_POOL_VALIDATION_INTERVAL_SECONDS", 30
+    )
+    DB_POOL_RECYCLE_SECONDS: int = os.environ.get("DB_POOL_RECYCLE_SECONDS", 1800)
+
+    # Connection Leaks (connections held longer by a request are logged, 0 to disable)
+    DB_POOL_LEAK_SECONDS: float = os.environ.get("DB_POOL_LEAK_SECONDS", 10)
+
+    # Read Replica (GET requests read from it while it's caught up, unset to disable)
+    POSTGRES_REPLICA_DATABASE_URL: str | None = os.environ.get(
+        "POSTGRES_REPLICA_DATABASE_URL"
+    )
+    REPLICA_MAX_LAG_SECONDS: float = os.environ.get("REPLICA_MAX_LAG_SECONDS", 2)
+    REPLICA_LAG_CHECK_SECONDS: float = os.environ.get("REPLICA_LAG_CHECK_SECONDS", 1)
 
 
 @lru_cache
@@ -1,21 +1,45 @@
 """This module contains the main FastAPI application."""
 
-from contextlib import asynccontextmanager
+import asyncio
+import logging
+from contextlib import asynccontextmanager, suppress
 from anyio import to_thread
-from fastapi import Depends, FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Response
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.gzip import GZipMiddleware
+from sqlalchemy.exc import IntegrityError
 
 from app.config.handlers import (
     http_exception_handler,
+    integrity_error_handler,
     request_validation_exception_handler,
     uncaptured_exception_handler,
 )
+from app.common.admission import AdmissionControlMiddleware
+from app.common.consistency import LastWriteCookieMiddleware
 from app.common.dependencies import get_db
+from app.common.pubsub import broker
+from app.common.revocation import sync_revocations_periodically
+from app.common.security import key_ring, password_hasher
+from app.common.tasks import purge_expired_tokens_periodically
+from app.config.database import (
+    engine,
+    listen_engine,
+    replica_engine,
+    replica_monitor,
+    validate_connections_periodically,
+)
+from app.config.pool import pool_tracer
+from app.config.settings import get_settings
 from app.user.apis import router as user_router
 from app.admins.apis import router as admin_router
+from app.common.apis import router as internal_router
+
+settings = get_settings()
+
+logger = logging.getLogger(__name__)
 
 
 # Lifespan (startup, shutdown)
@@ -29,8 +53,71 @@ async def lifespan(_: FastAPI):
     limiter = to_thread.current_default_thread_limiter()
     limiter.total_tokens = 1000
 
+    # Process pool for password hashing, bcrypt would otherwise block the event loop
+    password_hasher.start()
+
+    # A single LISTEN connection per worker for the notification streams and cache
+    # invalidation
+    if listen_engine is not None:
+        await broker.start(engine=listen_engine)
+    else:
+        logger.warning(
+            "POSTGRES_DIRECT_DATABASE_URL isn't set, events won't reach other workers"
+        )
+
+    # Background Tasks
+    background_tasks: list[asyncio.Task] = []
+    if settings.TOKEN_PURGE_INTERVAL_SECONDS > 0:
+        background_tasks.append(
+            asyncio.create_task(
+                purge_expired_tokens_periodically(
+                    interval=settings.TOKEN_PURGE_INTERVAL_SECONDS
+                )
+            )
+        )
+
+    if settings.TOKEN_REVOCATION_SYNC_SECONDS > 0:
+        background_tasks.append(
+            asyncio.create_task(
+                sync_revocations_periodically(
+                    interval=settings.TOKEN_REVOCATION_SYNC_SECONDS
+                )
+            )
+        )
+
+    if replica_engine is not None:
+        background_tasks.append(
+            asyncio.create_task(replica_monitor.run(replica=replica_engine))
+        )
+
+    if settings.DB_POOL_LEAK_SECONDS > 0:
+        background_tasks.append(
+            asyncio.create_task(pool_tracer.check_leaks_periodically())
+        )
+
+    if settings.DB_POOL_MODE == "queue" and settings.DB_POOL_VALIDATION == "background":
+        background_tasks.append(
+            asyncio.create_task(
+                validate_connections_periodically(
+                    engines=[e for e in (engine, replica_engine) if e is not None],
+                    interval=settings.DB_POOL_VALIDATION_INTERVAL_SECONDS,
+                )
+            )
+        )
+
     # Shutdown
     yield
+    for task in background_tasks:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+    await broker.stop()
+    password_hasher.stop()
+    await engine.dispose()
+    if listen_engine is not None:
+        await listen_engine.dispose()
+    if replica_engine is not None:
+        await replica_engine.dispose()
     print("System Call: Release Recollection...")
 
 
@@ -48,6 +135,10 @@ app = FastAPI(
 origins = ["*"]
 
 # Middlewares
+if settings.ADMISSION_MAX_CONCURRENCY > 0:
+    # Added first so it runs inside CORS, rejections still get the CORS headers
+    app.add_middleware(AdmissionControlMiddleware)
+app.add_middleware(LastWriteCookieMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -65,6 +156,7 @@ app.add_middleware(
 app.add_exception_handler(Exception, uncaptured_exception_handler)
 app.add_exception_handler(RequestValidationError, request_validation_exception_handler)
 app.add_exception_handler(HTTPException, http_exception_handler)
+app.add_exception_handler(IntegrityError, integrity_error_handler)
 
 
 # Health Check
@@ -74,6 +166,23 @@ async def health_check(_=Depends(get_db)):
     return {"status": "ok"}
 
 
+# Public keys for verifying tokens without calling this API
+@app.get(
+    "/.well-known/jwks.json",
+    summary="Get JSON Web Key Set",
+    response_description="The public keys tokens are signed with",
+    status_code=200,
+    tags=["Auth"],
+)
+async def jwks(response: Response):
+    """This endpoint returns the public keys downstream services verify tokens with"""
+    response.headers["Cache-Control"] = (
+        f"public, max-age={settings.JWKS_MAX_AGE_SECONDS}"
+    )
+    return key_ring.jwks()
+
+
 # Routers
 app.include_router(user_router, prefix="/users", tags=["User APIs"])
 app.include_router(admin_router, prefix="/admins", tags=["Admin APIs"])
+app.include_router(internal_router, prefix="/internal", tags=["Internal APIs"])
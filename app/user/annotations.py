@@ -1,5 +1,9 @@
 from typing import Annotated
 from fastapi import Depends
 from app.user import models, selectors
+from app.common.types import AccessTokenClaims
 
 CurrentUser = Annotated[models.User, Depends(selectors.get_current_user)]
+CurrentUserClaims = Annotated[
+    AccessTokenClaims, Depends(selectors.get_current_user_claims)
+]
@@ -1,15 +1,25 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+from uuid import uuid4
 
-from fastapi import APIRouter, Body, HTTPException, status
-from pydantic import EmailStr
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import delete, select
 
-from app.common.annotations import DatabaseSession, PaginationParams
-from app.common.paginators import get_pagination_metadata, paginate
+from app.common.annotations import (
+    CursorPaginationParams,
+    DatabaseSession,
+    SessionMaker,
+)
+from app.common.dependencies import Deadline
+from app.common.paginators import MAX_PAGE_SIZE, cursor_paginate
+from app.common.pubsub import stream_events
+from app.common.revocation import revoke_subject
 from app.common.schemas import ResponseSchema
-from app.common.security import hash_password, verify_password
+from app.common.types import CountStrategy, NormalizedEmail
+from app.common.security import password_hasher
 from app.config.settings import get_settings
 from app.user import models, security, selectors, services
-from app.user.annotations import CurrentUser
+from app.user.annotations import CurrentUser, CurrentUserClaims
 from app.user.schemas import (
     base_schemas,
     create_schemas,
@@ -33,12 +43,7 @@ async def user_create(user_in: create_schemas.UserCreate, db: DatabaseSession):
     """Create a new user"""
     created_user = await services.create_user(data=user_in, db=db)
 
-    try:
-        await services.create_user_configuration(user_id=created_user.id, db=db)
-    except HTTPException as e:
-        db.delete(created_user)
-        db.commit()
-        raise e
+    await services.create_user_configuration(user_id=created_user.id, db=db)
 
     # Send Notification
     await services.create_user_notification(
@@ -65,16 +70,25 @@ async def user_login(
     else:
         expire_in = settings.REFRESH_TOKEN_EXPIRE_HOURS
 
+    family_id = uuid4().hex
     refresh_token = security.generate_user_token(
-        token_type="refresh", sub=f"USER-{user.id}", expire_in=expire_in
+        token_type="refresh",
+        sub=f"USER-{user.id}",
+        expire_in=expire_in,
+        claims={"fam": family_id},
     )
     access_token = security.generate_user_token(
         token_type="access",
         sub=f"USER-{user.id}",
         expire_in=settings.ACCESS_TOKEN_EXPIRE_MINUTES,
+        claims={"active": user.is_active, "verified": user.is_verified},
     )
     await services.create_user_refresh_token(
-        user_id=user.id, token=refresh_token, db=db
+        user_id=user.id,
+        token=refresh_token,
+        family_id=family_id,
+        expires_at=datetime.now() + timedelta(hours=expire_in),
+        db=db,
     )
     return {
         "data": {
@@ -114,19 +128,21 @@ async def user_refresh_token(
         description="The user's refresh token", min_length=1, embed=True
     ),
 ):
-    """This endpoint generates a new access token for the user using the refresh token"""
-    user_id = security.verify_user_refresh_token(token=refresh_token)
-    await selectors.get_user_refresh_token(user_id=user_id, token=refresh_token, db=db)
-    user = await selectors.get_user_by_id(user_id=user_id, db=db)
-    user.last_login = datetime.now()
-    db.commit()
+    """This endpoint generates a new access token for the user using the refresh token
+
+    The refresh token is rotated, the new one must be used for the next refresh"""
+    refresh_token, user = await services.rotate_user_refresh_token(
+        token=refresh_token, db=db
+    )
     return {
         "data": {
             "access_token": security.generate_user_token(
                 token_type="access",
-                sub=f"USER-{user_id}",
+                sub=f"USER-{user.id}",
                 expire_in=settings.ACCESS_TOKEN_EXPIRE_MINUTES,
-            )
+                claims={"active": user.is_active, "verified": user.is_verified},
+            ),
+            "refresh_token": refresh_token,
         }
     }
 
@@ -138,10 +154,12 @@ async def user_refresh_token(
     status_code=status.HTTP_200_OK,
     response_model=ResponseSchema,
 )
-async def user_logout(current_user: CurrentUser, db: DatabaseSession):
-    """This endpoint logs out the current user by deleting all their refresh tokens"""
-    db.query(models.UserRefreshToken).filter_by(user_id=current_user.id).delete()
-    db.commit()
+async def user_logout(current_user: CurrentUserClaims, db: DatabaseSession):
+    """This endpoint logs out the current user by deleting all their refresh tokens and
+    revoking their access tokens"""
+    await db.execute(delete(models.UserRefreshToken).filter_by(user_id=current_user.id))
+    await selectors.invalidate_cached_user(user_id=current_user.id, db=db)
+    await revoke_subject(db=db, subject=current_user.subject)
     return {"data": {"message": "User has been logged out"}}
 
 
@@ -163,8 +181,9 @@ def user_me(user: CurrentUser):
     response_description="The user's configuration",
     status_code=status.HTTP_200_OK,
     response_model=response_schemas.UserConfigurationResponse,
+    dependencies=[Depends(Deadline(seconds=2))],
 )
-async def user_configurations(current_user: CurrentUser, db: DatabaseSession):
+async def user_configurations(current_user: CurrentUserClaims, db: DatabaseSession):
     """This endpoint returns the user's configurations"""
 
     return {
@@ -183,7 +202,7 @@ async def user_configurations(current_user: CurrentUser, db: DatabaseSession):
 )
 async def user_configurations_edit(
     configuration_in: edit_schemas.UserConfigurationEdit,
-    current_user: CurrentUser,
+    current_user: CurrentUserClaims,
     db: DatabaseSession,
 ):
     """This endpoint returns the user's configurations"""
@@ -194,7 +213,6 @@ async def user_configurations_edit(
     # Update configurations
     for field, value in configuration_in.model_dump().items():
         setattr(configurations, field, value)
-    db.commit()
 
     return {"data": configurations}
 
@@ -205,19 +223,23 @@ async def user_configurations_edit(
     response_description="The list of the user's notifications",
     status_code=status.HTTP_200_OK,
     response_model=response_schemas.UserNotificationListResponse,
+    dependencies=[Depends(Deadline(seconds=5))],
 )
 async def user_notifications(
-    pagination: PaginationParams,
-    current_user: CurrentUser,
+    pagination: CursorPaginationParams,
+    current_user: CurrentUserClaims,
     db: DatabaseSession,
 ):
     """This endpoint returns a paginated list of the current logged in user's notifications"""
-    notifications_qs = db.query(models.UserNotification).filter_by(
-        user_id=current_user.id
-    )
-    paginated_notifications: list[models.UserNotification] = paginate(
-        qs=notifications_qs, page=pagination.page, size=pagination.size
+    notifications, meta = await cursor_paginate(
+        qs=select(models.UserNotification).filter_by(user_id=current_user.id),
+        db=db,
+        order_by=(models.UserNotification.created_at, models.UserNotification.id),
+        size=pagination.size,
+        cursor=pagination.cursor,
+        count_strategy=CountStrategy.CACHED,
     )
+    state = await selectors.get_user_notification_state(user_id=current_user.id, db=db)
     return {
         "data": {
             "notifications": [
@@ -225,21 +247,98 @@ async def user_notifications(
                     "id": noti.id,
                     "content": noti.content,
                     "created_at": noti.created_at,
-                    "is_read": noti.is_read,
+                    "is_read": noti.is_read or noti.id <= state.read_up_to_id,
                 }
-                for noti in paginated_notifications
+                for noti in notifications
             ],
-            "unread": any(not noti.is_read for noti in paginated_notifications),
-            "meta": get_pagination_metadata(
-                qs=notifications_qs,
-                count=len(paginated_notifications),
-                page=pagination.page,
-                size=pagination.size,
-            ),
+            "unread": state.unread_count > 0,
+            "unread_count": state.unread_count,
+            "meta": meta,
         }
     }
 
 
+@router.get(
+    "/notifications/unread",
+    summary="Get User Unread Notification Count",
+    response_description="The number of unread notifications",
+    status_code=status.HTTP_200_OK,
+    response_model=response_schemas.UserNotificationUnreadResponse,
+    dependencies=[Depends(Deadline(seconds=2))],
+)
+async def user_notification_unread(
+    current_user: CurrentUserClaims, db: DatabaseSession
+):
+    """This endpoint returns the number of unread notifications, it's cheap enough to poll"""
+    state = await selectors.get_user_notification_state(user_id=current_user.id, db=db)
+    return {
+        "data": {"unread": state.unread_count > 0, "unread_count": state.unread_count}
+    }
+
+
+@router.get(
+    "/notifications/stream",
+    summary="Stream User Notifications",
+    response_description="A text/event-stream of the user's new notifications",
+    status_code=status.HTTP_200_OK,
+    response_class=StreamingResponse,
+)
+async def user_notification_stream(
+    current_user: CurrentUserClaims,
+    db: DatabaseSession,
+    session_maker: SessionMaker,
+    last_event_id: int | None = Header(
+        default=None,
+        alias="Last-Event-ID",
+        description="The ID of the last notification received, to resume from",
+    ),
+):
+    """This endpoint streams the user's new notifications as Server-Sent Events
+
+    Without a Last-Event-ID only notifications created after connecting are sent
+    """
+    user_id = current_user.id
+    if last_event_id is None:
+        last_event_id = await selectors.get_user_latest_notification_id(
+            user_id=user_id, db=db
+        )
+
+    async def fetch_notifications(after_id: int):
+        # A session per fetch, so an idle stream doesn't hold a connection
+        async with session_maker() as stream_db:
+            notifications = await selectors.get_user_notifications_after(
+                user_id=user_id, after_id=after_id, db=stream_db
+            )
+            state = await selectors.get_user_notification_state(
+                user_id=user_id, db=stream_db
+            )
+        return [
+            (
+                noti.id,
+                {
+                    "id": noti.id,
+                    "content": noti.content,
+                    "created_at": noti.created_at,
+                    "is_read": noti.is_read or noti.id <= state.read_up_to_id,
+                },
+            )
+            for noti in notifications
+        ]
+
+    return StreamingResponse(
+        stream_events(
+            channel=models.UserNotification.__tablename__,
+            key=user_id,
+            fetch_events=fetch_notifications,
+            last_event_id=last_event_id,
+            event_name="notification",
+        ),
+        media_type="text/event-stream",
+        # identity keeps the gzip middleware from buffering the events
+        headers={"Cache-Control": "no-cache", "Content-Encoding": "identity"},
+    )
+
+
 @router.put(
     "/notifications/read",
     summary="Mark User Notifications as Read",
@@ -247,13 +346,21 @@ async def user_notifications(
     status_code=status.HTTP_200_OK,
     response_model=ResponseSchema,
 )
-async def user_notification_read(current_user: CurrentUser, db: DatabaseSession):
-    """This endpoint marks all the user's notifications as read"""
+async def user_notification_read(
+    current_user: CurrentUserClaims,
+    db: DatabaseSession,
+    notification_ids: list[int] | None = Body(
+        default=None,
+        description="The notifications to mark as read, all of them when omitted",
+        max_length=MAX_PAGE_SIZE,
+        embed=True,
+    ),
+):
+    """This endpoint marks the user's notifications as read"""
 
-    db.query(models.UserNotification).filter_by(
-        user_id=current_user.id, is_read=False
-    ).update({"is_read": True}, synchronize_session=False)
-    db.commit()
+    await services.read_user_notifications(
+        user_id=current_user.id, db=db, notification_ids=notification_ids
+    )
     return {"data": {"message": "Notifications have been marked as read"}}
 
 
@@ -270,7 +377,9 @@ async def user_password_confirm(
 ):
     """This endpoints confirms the user's password"""
 
-    if verify_password(plain_password=password, hashed_password=current_user.password):
+    if await password_hasher.verify(
+        plain_password=password, hashed_password=current_user.password
+    ):
         return {"data": {"is_correct": True}}
     return {"data": {"is_correct": False}}
 
@@ -289,12 +398,14 @@ async def user_password_change(
 ):
     """This endpoint changes the user's password"""
 
-    if verify_password(
+    if await password_hasher.verify(
         plain_password=password_change.old_password,
         hashed_password=current_user.password,
     ):
-        current_user.password = hash_password(raw=password_change.new_password)
-        db.commit()
+        current_user.password = await password_hasher.hash(
+            raw=password_change.new_password
+        )
+        await selectors.invalidate_cached_user(user_id=current_user.id, db=db)
 
         # Notifications
         await services.create_user_notification(
@@ -317,7 +428,7 @@ async def user_password_change(
 )
 async def user_newsletter_subscription(
     db: DatabaseSession,
-    email: EmailStr = Body(
+    email: NormalizedEmail = Body(
         description="The user's email address", min_lenght=1, embed=True
     ),
 ):
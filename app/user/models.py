@@ -1,6 +1,17 @@
 from datetime import datetime
-
-from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Integer, String
+from uuid import uuid4
+
+from sqlalchemy import (
+    Boolean,
+    CheckConstraint,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    text,
+)
 
 from app.config.database import DBBase
 
@@ -9,6 +20,14 @@ class User(DBBase):
     """Database model for User"""
 
     __tablename__ = "users"
+    __table_args__ = (
+        # Emails are stored lowercased, see NormalizedEmail
+        CheckConstraint("email = lower(email)", name="ck_users_email_lowercase"),
+        CheckConstraint(
+            "exception_alert_email = lower(exception_alert_email)",
+            name="ck_users_exception_alert_email_lowercase",
+        ),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     profile_picture_url = Column(String, default="/default_profile.jpg", nullable=False)
@@ -29,7 +48,10 @@ class UserConfiguration(DBBase):
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(
-        Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
     )
     notification_email = Column(Boolean, default=True)
     notification_inapp = Column(Boolean, default=True)
@@ -39,6 +61,24 @@ class UserNotification(DBBase):
     """This is the base database schema for user notifications"""
 
     __tablename__ = "user_notifications"
+    __table_args__ = (
+        # Serves the notification list (filter on owner, newest first). content isn't
+        # included, rows past the btree limit (~2.7KB) would fail to insert
+        Index(
+            "ix_user_notifications_user_id_created_at_id",
+            "user_id",
+            text("created_at DESC"),
+            text("id DESC"),
+            postgresql_include=["is_read"],
+        ),
+        # Only the unread rows, used when marking notifications as read
+        Index(
+            "ix_user_notifications_user_id_unread",
+            "user_id",
+            "id",
+            postgresql_where=text("is_read = false"),
+        ),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(
@@ -49,16 +89,40 @@ class UserNotification(DBBase):
     created_at = Column(DateTime(timezone=True), default=datetime.now, nullable=False)
 
 
+class UserNotificationState(DBBase):
+    """Database model for the user's notification state, kept in sync on every write"""
+
+    __tablename__ = "user_notification_states"
+
+    user_id = Column(
+        Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True
+    )
+    unread_count = Column(Integer, default=0, server_default="0", nullable=False)
+    # Every notification with an id <= read_up_to_id is read
+    read_up_to_id = Column(Integer, default=0, server_default="0", nullable=False)
+
+
 class UserRefreshToken(DBBase):
-    """Database model for user refresh tokens"""
+    """Database model for user refresh tokens
+
+    A row is a family of refresh tokens, every refresh swaps its token_hash for the
+    next token's so only the latest token of the family is valid
+    """
 
     __tablename__ = "user_refresh_tokens"
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(
-        Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
     )
-    token = Column(String, nullable=False)
+    token_hash = Column(String(64), unique=True, nullable=False)  # sha256 hex digest
+    family_id = Column(
+        String(32), unique=True, default=lambda: uuid4().hex, nullable=False
+    )
+    expires_at = Column(DateTime(timezone=True), nullable=False)
     created_at = Column(DateTime(timezone=True), default=datetime.now, nullable=False)
 
 
@@ -69,7 +133,10 @@ class UserPasswordResetToken(DBBase):
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(
-        Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
     )
     token = Column(String, unique=True, nullable=False)
     is_used = Column(Boolean, default=False)
@@ -80,6 +147,10 @@ class NewsLetter(DBBase):
     """Database model for newsletter subscribers"""
 
     __tablename__ = "newsletter"
+    __table_args__ = (
+        # Emails are stored lowercased, see NormalizedEmail
+        CheckConstraint("email = lower(email)", name="ck_newsletter_email_lowercase"),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True)
     email = Column(String, unique=True, nullable=False)
     created_at = Column(DateTime(timezone=True), default=datetime.now, nullable=False)
@@ -89,6 +160,10 @@ class Company(DBBase):
     """Database model for company"""
 
     __tablename__ = "companies"
+    __table_args__ = (
+        # Emails are stored lowercased, see NormalizedEmail
+        CheckConstraint("email = lower(email)", name="ck_companies_email_lowercase"),
+    )
     id = Column(Integer, primary_key=True, autoincrement=True)
     name = Column(String, nullable=False)
     registration_number = Column(String, unique=True, nullable=False)
@@ -100,7 +175,10 @@ class Company(DBBase):
     permit_image_url = Column(String, default="/default_permit.jpg", nullable=False)
     is_verified = Column(Boolean, default=False)
     user_id = Column(
-        Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
     )
     created_at = Column(DateTime(timezone=True), default=datetime.now, nullable=False)
 
@@ -116,7 +194,10 @@ class Support(DBBase):
     upload_file_url = Column(String, default="/upload_file.png", nullable=False)
     description = Column(String, nullable=False)
     user_id = Column(
-        Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False
+        Integer,
+        ForeignKey("users.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
     )
     is_resolved = Column(Boolean, default=False)
     created_at = Column(DateTime(timezone=True), default=datetime.now, nullable=False)
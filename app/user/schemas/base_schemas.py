@@ -1,8 +1,9 @@
 from datetime import datetime
 
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, Field
 
-from app.common.schemas import PaginationSchema, Token
+from app.common.schemas import CursorPaginationSchema, Token
+from app.common.types import NormalizedEmail
 
 
 class User(BaseModel):
@@ -28,7 +29,7 @@ class UserLogin(BaseModel):
 class UserLoginCredential(BaseModel):
     """The base user login credential model"""
 
-    email: EmailStr = Field(
+    email: NormalizedEmail = Field(
         description="The user's email address", examples=["user@shipnlogic.com"]
     )
     password: str = Field(description="The user's password", examples=["admin"])
@@ -55,6 +56,13 @@ class UserNotification(BaseModel):
     created_at: datetime = Field(description="The notification created date")
 
 
+class UserNotificationUnread(BaseModel):
+    """The base schema for the user's unread notification count"""
+
+    unread: bool = Field(description="Indicates if there are unread notifications")
+    unread_count: int = Field(description="The number of unread notifications")
+
+
 class PaginatedUserNotification(BaseModel):
     """The base schema for paginated user notifications"""
 
@@ -62,7 +70,8 @@ class PaginatedUserNotification(BaseModel):
         description="The list of user notifications"
     )
     unread: bool = Field(description="Indicates if there are unread notifications")
-    meta: PaginationSchema = Field(description="The pagination details")
+    unread_count: int = Field(description="The number of unread notifications")
+    meta: CursorPaginationSchema = Field(description="The pagination details")
 
 
 class Company(BaseModel):
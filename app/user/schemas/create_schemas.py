@@ -1,5 +1,7 @@
 from pydantic import BaseModel, EmailStr, Field
 
+from app.common.types import NormalizedEmail
+
 
 class UserCreate(BaseModel):
     """The User creation model"""
@@ -10,10 +12,10 @@ class UserCreate(BaseModel):
         max_length=255,
         examples=["Alice"],
     )
-    email: EmailStr = Field(
+    email: NormalizedEmail = Field(
         description="The user's email", min_length=1, examples=["user@shipnlogic.com"]
     )
-    exception_alert_email: EmailStr = Field(
+    exception_alert_email: NormalizedEmail = Field(
         description="The user's exception alert email",
         min_length=1,
         examples=["user@shipnlogic.com"],
@@ -39,7 +41,7 @@ class CompanyCreate(BaseModel):
         min_length=1,
         examples=["12345678"],
     )
-    email: EmailStr = Field(
+    email: NormalizedEmail = Field(
         description="The company's email",
         min_length=1,
         examples=["user@shipnlogic.com"],
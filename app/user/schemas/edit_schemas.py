@@ -1,4 +1,6 @@
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, Field
+
+from app.common.types import NormalizedEmail
 
 
 class UserEdit(BaseModel):
@@ -35,7 +37,7 @@ class UserProfilePicture(BaseModel):
 class UserEmailChange(BaseModel):
     """This schema is used to change the user's email"""
 
-    email: EmailStr = Field(
+    email: NormalizedEmail = Field(
         description="The user's new email",
         min_length=1,
         examples=["user@shipnlogic.com"],
@@ -59,7 +61,7 @@ class CompanyEdit(BaseModel):
     registration_number: str | None = Field(
         description="The company's registration number", min_length=1, default=None
     )
-    email: EmailStr | None = Field(
+    email: NormalizedEmail | None = Field(
         description="The company's email", min_length=1, default=None
     )
     phone: str | None = Field(
@@ -7,6 +7,7 @@ from app.user.schemas.base_schemas import (
     User,
     UserConfiguration,
     UserLogin,
+    UserNotificationUnread,
 )
 
 
@@ -36,6 +37,14 @@ class UserNotificationListResponse(ResponseSchema):
     )
 
 
+class UserNotificationUnreadResponse(ResponseSchema):
+    """This is the response schema for the user's unread notification count"""
+
+    data: UserNotificationUnread = Field(
+        description="The user's unread notification count"
+    )
+
+
 class CompanyResponse(ResponseSchema):
     """The company response model"""
 
@@ -1,16 +1,23 @@
+import time
 from datetime import datetime, timedelta
 from typing import Literal
 
 import jwt
 from fastapi import HTTPException, status
 
+from app.common.cache import token_cache
+from app.common.revocation import revocation_list
+from app.common.security import hash_token, key_ring
 from app.config.settings import get_settings
 
 settings = get_settings()
 
 
 def generate_user_token(
-    token_type: Literal["access", "refresh"], sub: str, expire_in: int
+    token_type: Literal["access", "refresh"],
+    sub: str,
+    expire_in: int,
+    claims: dict | None = None,
 ):
     """This function generates the user's jwt token
 
@@ -18,6 +25,7 @@ def generate_user_token(
         type (access, refresh): The type of token to generate
         sub (str): The subject of the token, typically the user's ID
         expire_in(int): The time in (minutes for access, hours for refresh) the token will expire
+        claims (dict | None, default=None): Extra claims e.g the ones handlers authorize with
     Returns:
         str: The generated Token
     """
@@ -38,47 +46,88 @@ def generate_user_token(
         "iat": iat.timestamp(),
         "exp": expire.timestamp(),
         "iss": "shipnlogic.com",
+        **(claims or {}),
     }
-    return jwt.encode(
-        payload=data,
-        key=settings.SECRET_KEY,
-        algorithm=settings.HASHING_ALGORITHM,
-    )
+    return key_ring.encode(payload=data)
 
 
-def verify_user_refresh_token(token: str):
-    """This function verifies the user's refresh token
+def decode_token(token: str):
+    """This function verifies a token and returns its claims
+
+    The claims of a verified token are cached by its digest until it expires, so its
+    signature is only checked once per worker. Failed verifications aren't cached.
+
+    Args:
+        token (str): The token
+
+    Raises:
+        jwt.PyJWTError: The token is invalid or expired
+
+    Returns:
+        dict: The token's claims
+    """
+    key = hash_token(token=token)
+    payload = token_cache.get(key)
+    if payload is None:
+        payload = key_ring.decode(token=token)
+        if "exp" in payload:
+            token_cache.set(key, payload, ttl=payload["exp"] - time.time())
+    return payload
+
+
+def get_user_refresh_token_claims(token: str):
+    """This function verifies the user's refresh token and returns its claims
 
     Args:
         token (str): The refresh token
 
+    Raises:
+        HTTPException[401]: Invalid or expired token
+
     Returns:
-        str: The user's ID
+        dict: The token's claims
     """
     try:
-        payload = jwt.decode(
-            jwt=token,
-            key=settings.SECRET_KEY,
-            algorithms=settings.HASHING_ALGORITHM,
+        payload = key_ring.decode(token=token)
+    except jwt.PyJWTError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Token"
         )
-        sub: str = payload.get("sub")
-        if payload.get("type") != "refresh":
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Token"
-            )
-        if sub is None:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Token"
-            )
-        return sub.split("-")[1]
-    except jwt.ExpiredSignatureError:
+    if payload.get("type") != "refresh" or payload.get("sub") is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Token"
         )
+    return payload
+
+
+def get_user_access_token_claims(token: str):
+    """This function verifies the user's access token and returns its claims
+
+    Args:
+        token (str): The access token
+
+    Raises:
+        HTTPException[401]: Invalid, expired or revoked token
+
+    Returns:
+        dict: The token's claims
+    """
+    try:
+        payload = decode_token(token=token)
     except jwt.PyJWTError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Token"
         )
+    sub: str = payload.get("sub")
+    if (
+        payload.get("type") != "access"
+        or sub is None
+        or revocation_list.is_revoked(subject=sub, issued_at=payload.get("iat", 0))
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Token"
+        )
+    return payload
 
 
 def verify_user_access_token(token: str, raise_exception: bool = True):
@@ -91,32 +140,8 @@ def verify_user_access_token(token: str, raise_exception: bool = True):
         str: The user's ID
     """
     try:
-        payload = jwt.decode(
-            jwt=token,
-            key=settings.SECRET_KEY,
-            algorithms=settings.HASHING_ALGORITHM,
-        )
-        sub: str = payload.get("sub")
-        if payload.get("type") != "access":
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Token"
-            )
-        if sub is None:
-            if raise_exception:
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Token"
-                )
-            return None
-        return sub.split("-")[1]
-    except jwt.ExpiredSignatureError:
-        if raise_exception:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Token"
-            )
-        return None
-    except jwt.PyJWTError:
+        return get_user_access_token_claims(token=token)["sub"].split("-")[1]
+    except HTTPException:
         if raise_exception:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Token"
-            )
+            raise
         return None
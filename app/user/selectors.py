@@ -1,19 +1,24 @@
 from fastapi import Depends, Header, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.common.cache import cache_principal, get_cached_principal
 from app.common.dependencies import get_db
+from app.common.paginators import MAX_PAGE_SIZE
+from app.common.pubsub import invalidate_cached
+from app.common.types import AccessTokenClaims
 from app.config.settings import get_settings
 from app.user import models, security
 
 settings = get_settings()
 
 
-async def get_user_by_id(user_id: int, db: Session, raise_exception: bool = True):
+async def get_user_by_id(user_id: int, db: AsyncSession, raise_exception: bool = True):
     """This function returns a user obj using it's id
     F
         Args:
             user_id (int): The user's id
-            db (Session): The database session
+            db (AsyncSession): The database session
             raise_exception (bool, default=True): Raise HTTPException[404] when user isn't found
 
         Raises:
@@ -22,7 +27,7 @@ async def get_user_by_id(user_id: int, db: Session, raise_exception: bool = True
         Returns:
             (models.User| None): The User obj or None
     """
-    if obj := db.query(models.User).filter_by(id=user_id).first():
+    if obj := await db.scalar(select(models.User).filter_by(id=user_id)):
         return obj
     if raise_exception:
         raise HTTPException(
@@ -32,17 +37,17 @@ async def get_user_by_id(user_id: int, db: Session, raise_exception: bool = True
     return None
 
 
-async def get_user_configuration_by_user_id(user_id: int, db: Session):
+async def get_user_configuration_by_user_id(user_id: int, db: AsyncSession):
     """This function returns the user configuration based on the user's ID
 
     Args:
         user_id (int): The user's ID
-        db (Session): The database session
+        db (AsyncSession): The database session
 
     Returns:
         (models.UserConfiguration): The User configuration obj
     """
-    obj = db.query(models.UserConfiguration).filter_by(user_id=user_id).first()
+    obj = await db.scalar(select(models.UserConfiguration).filter_by(user_id=user_id))
     if not obj:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -51,12 +56,12 @@ async def get_user_configuration_by_user_id(user_id: int, db: Session):
     return obj
 
 
-async def get_user_by_email(email: str, db: Session, raise_exception: bool = True):
+async def get_user_by_email(email: str, db: AsyncSession, raise_exception: bool = True):
     """This function returns a user obj based on the user's email
 
     Args:
         email (str): The user's email
-        db (Session): The database session
+        db (AsyncSession): The database session
         raise_exception (bool, default=True): Raise a HTTPException[404] when user isn't found
 
     Raises:
@@ -65,7 +70,7 @@ async def get_user_by_email(email: str, db: Session, raise_exception: bool = Tru
     Returns:
         (models.User, None): The user obj or None
     """
-    if obj := db.query(models.User).filter_by(email=email).first():
+    if obj := await db.scalar(select(models.User).filter_by(email=email.lower())):
         return obj
     if raise_exception:
         raise HTTPException(
@@ -76,7 +81,7 @@ async def get_user_by_email(email: str, db: Session, raise_exception: bool = Tru
 
 
 async def get_current_user(
-    token: str = Header(alias="Authorization"), db: Session = Depends(get_db)
+    token: str = Header(alias="Authorization"), db: AsyncSession = Depends(get_db)
 ):
     """This function returns the current user based on the token provided"""
     try:
@@ -92,7 +97,14 @@ async def get_current_user(
             detail="Invalid token",
         )
     user_id = int(security.verify_user_access_token(token=token))
-    if user := await get_user_by_id(user_id=user_id, db=db, raise_exception=False):
+    if user := await get_cached_principal(key=f"USER-{user_id}", db=db):
+        return user
+    # Read from the primary, a stale replica row would stay cached for the cache's TTL
+    user = await db.scalar(
+        select(models.User).filter_by(id=user_id).execution_options(use_primary=True)
+    )
+    if user:
+        cache_principal(key=f"USER-{user_id}", obj=user)
         return user
     raise HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -100,25 +112,116 @@ async def get_current_user(
     )
 
 
-async def get_user_refresh_token(user_id: int, token: str, db: Session):
-    """This function returns a user refresh token
+async def get_current_user_claims(token: str = Header(alias="Authorization")):
+    """This function returns the claims of the current user's access token
+
+    Nothing is queried, the token is verified (once, then cached) and checked against
+    the revocation list, so use it when the user's id/status/permission is enough.
+
+    Raises:
+        HTTPException[401]: Invalid token
+        HTTPException[403]: Inactive account or not a user's token
+
+    Returns:
+        AccessTokenClaims: The claims
+    """
+    try:
+        token_type, token = token.split(" ")
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid token",
+        )
+    if token_type != "Bearer":
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid token",
+        )
+    claims = security.get_user_access_token_claims(token=token)
+    if not claims.get("active", True):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Account is inactive"
+        )
+    # Users and admins share the signing keys, only the subject tells them apart
+    if not claims["sub"].startswith("USER-"):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Invalid token type"
+        )
+    return AccessTokenClaims(
+        id=int(claims["sub"].split("-")[1]),
+        subject=claims["sub"],
+        is_active=claims.get("active", True),
+        is_verified=claims.get("verified"),
+    )
+
+
+async def invalidate_cached_user(user_id: int, db: AsyncSession):
+    """This function evicts a user from the caches of every worker, call it before
+    committing a change to the user
+
+    Args:
+        user_id (int): The user's ID
+        db (AsyncSession): The database session the user was changed in
+    """
+    await invalidate_cached(db=db, key=f"USER-{user_id}")
+
+
+async def get_user_notification_state(user_id: int, db: AsyncSession):
+    """This function returns the notification state of a user
 
     Args:
         user_id (int): The user's ID
-        token (str): The user's refresh token
-        db (Session): The database session
+        db (AsyncSession): The database session
 
     Returns:
-        (models.UserRefreshToken): The user refresh token obj
+        models.UserNotificationState: The user's notification state obj (a blank one when
+            they've never been notified)
     """
-    obj = (
-        db.query(models.UserRefreshToken)
-        .filter_by(user_id=user_id, token=token)
-        .first()
+    state = await db.scalar(
+        select(models.UserNotificationState).filter_by(user_id=user_id)
     )
-    if not obj:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid Token",
+    if state is None:
+        state = models.UserNotificationState(
+            user_id=user_id, unread_count=0, read_up_to_id=0
         )
-    return obj
+    return state
+
+
+async def get_user_latest_notification_id(user_id: int, db: AsyncSession):
+    """This function returns the ID of the user's latest notification
+
+    Args:
+        user_id (int): The user's ID
+        db (AsyncSession): The database session
+
+    Returns:
+        int: The notification ID (0 when they have none)
+    """
+    latest_id = await db.scalar(
+        select(func.max(models.UserNotification.id)).filter_by(user_id=user_id)
+    )
+    return latest_id or 0
+
+
+async def get_user_notifications_after(
+    user_id: int, after_id: int, db: AsyncSession, limit: int = MAX_PAGE_SIZE
+):
+    """This function returns the user's notifications created after a notification
+
+    Args:
+        user_id (int): The user's ID
+        after_id (int): The ID of the notification to start after
+        db (AsyncSession): The database session
+        limit (int, default=MAX_PAGE_SIZE): The max number of notifications to return
+
+    Returns:
+        list[models.UserNotification]: The notifications, oldest first
+    """
+    notifications = await db.scalars(
+        select(models.UserNotification)
+        .filter_by(user_id=user_id)
+        .where(models.UserNotification.id > after_id)
+        .order_by(models.UserNotification.id)
+        .limit(limit)
+    )
+    return list(notifications)
@@ -1,95 +1,129 @@
 from datetime import datetime
+from uuid import uuid4
 
 from fastapi import HTTPException, status
 from pydantic import EmailStr
-from sqlalchemy import or_
-from sqlalchemy.orm import Session
-
-from app.common.security import hash_password, verify_password
-from app.user import models, selectors
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.common.pubsub import broker
+from app.common.queries import dialect_insert, get_unique_conflicts, insert_unique
+from app.common.security import hash_token, password_hasher
+from app.user import models, security, selectors
 from app.user.schemas import base_schemas, create_schemas, edit_schemas
 
+UNIQUE_FIELD_NAMES = {
+    "email": "email",
+    "exception_alert_email": "exception alert email",
+    "tax_identification_number": "tax identification number",
+    "registration_number": "registration number",
+    "phone": "phone",
+}
+
+
+def get_conflict_message(fields: list[str]):
+    """This function returns the error message of values that are already in use
 
-async def create_user(data: create_schemas.UserCreate, db: Session):
+    Args:
+        fields (list[str]): The conflicting columns
+
+    Returns:
+        str: The message
+    """
+    conflicting_fields = [
+        name for field, name in UNIQUE_FIELD_NAMES.items() if field in fields
+    ]
+    if not conflicting_fields:
+        return "The details are already in use."
+    if len(conflicting_fields) == 1:
+        return f"The {conflicting_fields[0]} is already in use."
+    fields_str = ", ".join(conflicting_fields[:-1]) + " and " + conflicting_fields[-1]
+    return f"The following fields are already in use: {fields_str}."
+
+
+async def create_user(data: create_schemas.UserCreate, db: AsyncSession):
     """This function creates a new user
 
     Args:
         data (create_schemas.UserCreate): The user's data
-        db (Session): The database session
+        db (AsyncSession): The database session
 
     Raises:
-        HTTPException[400]: User with email exists
+        HTTPException[400]: User with email (or exception alert email) exists
 
     Returns:
         models.User: The created user obj
     """
-    # Validate unique email
-    if db.query(models.User).filter_by(email=data.email).first():
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"user with email {data.email} exists",
-        )
-
-    obj = models.User(**data.model_dump())
-    obj.password = hash_password(raw=data.password)
-    db.add(obj)
-    db.commit()
-    db.refresh(obj)
+    values = data.model_dump()
+    values["password"] = await password_hasher.hash(raw=data.password)
+    obj = await insert_unique(db=db, model=models.User, values=values)
+    if obj is None:
+        conflicts = await get_unique_conflicts(db=db, model=models.User, values=values)
+        if "email" in conflicts:
+            detail = f"user with email {data.email} exists"
+        else:
+            detail = get_conflict_message(fields=conflicts)
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=detail)
     return obj
 
 
-async def create_user_configuration(user_id: int, db: Session):
+async def create_user_configuration(user_id: int, db: AsyncSession):
     """This function creates the user's configuration obj
 
     Args:
         user_id (int): The user's ID
-        db (Session): The database session
+        db (AsyncSession): The database session
 
     Returns:
         models.UserConfiguration: The created user configuration obj
     """
-    await selectors.get_user_by_id(user_id=user_id, db=db)
-    if db.query(models.UserConfiguration).filter_by(user_id=user_id).first():
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"user configuration for user {user_id} already exists",
-        )
     obj = models.UserConfiguration(user_id=user_id)
     db.add(obj)
-    db.commit()
-    db.refresh(obj)
+    await db.flush()
     return obj
 
 
-async def create_user_notification(user_id: int, content: str, db: Session):
+async def create_user_notification(user_id: int, content: str, db: AsyncSession):
     """This function creates a user notification
 
     Args:
         user_id (int): The user's ID
         content (str): The notification content
-        db (Session): The database session
+        db (AsyncSession): The database session
 
     Returns:
         models.UserNotification: The created user notification obj
     """
-    await selectors.get_user_by_id(user_id=user_id, db=db)
+    # Keep the unread counter in sync, the state row is locked before the notification
+    # gets its id so the id can't end up below a concurrent read watermark
+    await db.execute(
+        dialect_insert(db, models.UserNotificationState)
+        .values(user_id=user_id, unread_count=1)
+        .on_conflict_do_update(
+            index_elements=["user_id"],
+            set_={"unread_count": models.UserNotificationState.unread_count + 1},
+        )
+    )
     obj = models.UserNotification(user_id=user_id, content=content)
     db.add(obj)
-    db.commit()
-    db.refresh(obj)
+    await broker.publish(
+        db=db, channel=models.UserNotification.__tablename__, key=user_id
+    )
+    await db.flush()
     return obj
 
 
 async def login_user(
     data: base_schemas.UserLoginCredential,
-    db: Session,
+    db: AsyncSession,
     raise_exception: bool = True,
 ):
     """This function logs in a user and updates their last_login
 
     Args:
         data (base_schemas.UserLoginCredential): The user's login credentials
-        db (Session): The database session
+        db (AsyncSession): The database session
         raise_exception(bool, default=True): Indicates whether to raise an exception or not
 
     Raises:
@@ -108,10 +142,11 @@ async def login_user(
                 detail="Invalid login credentials",
             )
         return None
-    if verify_password(plain_password=data.password, hashed_password=user.password):
+    if await password_hasher.verify(
+        plain_password=data.password, hashed_password=user.password
+    ):
         user.last_login = datetime.now()
-        db.commit()
-        db.refresh(user)
+        await selectors.invalidate_cached_user(user_id=user.id, db=db)
         return user
     if raise_exception:
         raise HTTPException(
@@ -120,32 +155,102 @@ async def login_user(
     return None
 
 
-async def create_user_refresh_token(user_id: int, token: str, db: Session):
+async def create_user_refresh_token(
+    user_id: int, token: str, family_id: str, expires_at: datetime, db: AsyncSession
+):
     """This function creates a user refresh token
 
     Args:
         user_id (int): The user's ID
-        token(str): The access token
-        db (Session): The database session
+        token(str): The refresh token (only its digest is stored)
+        family_id (str): The token's fam claim, its rotations share it
+        expires_at (datetime): When the refresh token expires
+        db (AsyncSession): The database session
 
     Returns:
         models.UserRefreshToken: The created user refresh token obj
     """
-    await selectors.get_user_by_id(user_id=user_id, db=db)
-    obj = models.UserRefreshToken(user_id=user_id, token=token)
+    obj = models.UserRefreshToken(
+        user_id=user_id,
+        token_hash=hash_token(token=token),
+        family_id=family_id,
+        expires_at=expires_at,
+    )
     db.add(obj)
-    db.commit()
-    db.refresh(obj)
+    await db.flush()
     return obj
 
 
-async def edit_user(user_id: int, data: edit_schemas.UserEdit, db: Session):
+async def rotate_user_refresh_token(token: str, db: AsyncSession):
+    """This function swaps a refresh token for the next token of its family
+
+    The token is swapped and the user's claims are read in a single UPDATE ... RETURNING.
+    The new token expires with the family, so rotating doesn't extend the session. A
+    validly signed token that isn't its family's latest has been used before, i.e it
+    was stolen or replayed, so the whole family is revoked.
+
+    Args:
+        token (str): The refresh token
+        db (AsyncSession): The database session
+
+    Raises:
+        HTTPException[401]: Invalid, expired or reused token
+
+    Returns:
+        tuple[str, Row]: The new refresh token and the user's id, is_active and is_verified
+    """
+    claims = security.get_user_refresh_token_claims(token=token)
+    user_id = int(claims["sub"].split("-")[1])
+    # Tokens issued before families existed start one
+    family_id = claims.get("fam") or uuid4().hex
+    new_token = security.generate_user_token(
+        token_type="refresh",
+        sub=claims["sub"],
+        expire_in=0,
+        claims={"fam": family_id, "exp": claims["exp"]},
+    )
+
+    token_user = models.User.id == models.UserRefreshToken.user_id
+    row = (
+        await db.execute(
+            update(models.UserRefreshToken)
+            .filter_by(token_hash=hash_token(token=token), user_id=user_id)
+            .where(models.UserRefreshToken.expires_at > datetime.now())
+            .values(token_hash=hash_token(token=new_token), family_id=family_id)
+            .returning(
+                models.UserRefreshToken.user_id.label("id"),
+                select(models.User.is_active)
+                .where(token_user)
+                .scalar_subquery()
+                .label("is_active"),
+                select(models.User.is_verified)
+                .where(token_user)
+                .scalar_subquery()
+                .label("is_verified"),
+            )
+        )
+    ).one_or_none()
+    if row is None:
+        # Committed right away, the request fails so its unit of work is rolled back
+        if "fam" in claims:
+            await db.execute(
+                delete(models.UserRefreshToken).filter_by(family_id=claims["fam"])
+            )
+        await db.commit()
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Token",
+        )
+    return new_token, row
+
+
+async def edit_user(user_id: int, data: edit_schemas.UserEdit, db: AsyncSession):
     """This function edits a user's details
 
     Args:
         user_id (int): The user's ID
         data (edit_schemas.UserEdit): The user's data
-        db (Session): The database session
+        db (AsyncSession): The database session
 
     Returns:
         models.User: The edited user obj
@@ -159,39 +264,38 @@ async def edit_user(user_id: int, data: edit_schemas.UserEdit, db: Session):
         )
     for field, value in data.items():
         setattr(obj, field, value)
-    db.commit()
-    db.refresh(obj)
+    await selectors.invalidate_cached_user(user_id=obj.id, db=db)
+    await db.flush()
     return obj
 
 
-async def create_newsletter_subscriber(email: EmailStr, db: Session):
+async def create_newsletter_subscriber(email: EmailStr, db: AsyncSession):
     """This function creates a newsletter subscription
 
     Args:
         email (str): The subscriber's email
-        db (Session): The database session
+        db (AsyncSession): The database session
 
     Returns:
         models.Newsletter: The created newsletter subscription obj
     """
-    if db.query(models.NewsLetter).filter_by(email=email).first():
+    obj = await insert_unique(db=db, model=models.NewsLetter, values={"email": email})
+    if obj is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"email {email} already subscribed",
         )
-    obj = models.NewsLetter(email=email)
-    db.add(obj)
-    db.commit()
-    db.refresh(obj)
     return obj
 
 
-async def create_company(user_id: int, data: create_schemas.CompanyCreate, db: Session):
+async def create_company(
+    user_id: int, data: create_schemas.CompanyCreate, db: AsyncSession
+):
     """This function creates a new company
 
     Args:
         data (create_schemas.CompanyCreate): The company's data
-        db (Session): The database session
+        db (AsyncSession): The database session
 
     Raises:
         HTTPException[400]: Company with email exists
@@ -200,146 +304,76 @@ async def create_company(user_id: int, data: create_schemas.CompanyCreate, db: S
         models.Company: The created company obj
     """
 
-    # Fetch the company that matches any of the provided fields
-    company = (
-        db.query(models.Company)
-        .filter(
-            or_(
-                models.Company.email == data.email,
-                models.Company.tax_identification_number
-                == data.tax_identification_number,
-                models.Company.registration_number == data.registration_number,
-                models.Company.phone == data.phone,
-            )
+    values = {**data.model_dump(), "user_id": user_id}
+    obj = await insert_unique(db=db, model=models.Company, values=values)
+    if obj is None:
+        conflicts = await get_unique_conflicts(
+            db=db, model=models.Company, values=values
+        )
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=get_conflict_message(fields=conflicts),
         )
-        .first()
-    )
-
-    if company:
-        # Determine which fields conflict
-        conflicting_fields = [
-            field
-            for field, value in [
-                ("email", company.email == data.email),
-                (
-                    "tax identification number",
-                    company.tax_identification_number == data.tax_identification_number,
-                ),
-                (
-                    "registration number",
-                    company.registration_number == data.registration_number,
-                ),
-                ("phone", company.phone == data.phone),
-            ]
-            if value
-        ]
-
-        # Generate an appropriate message based on the number of conflicting fields
-        if conflicting_fields:
-            if len(conflicting_fields) == 1:
-                message = f"The {conflicting_fields[0]} is already in use."
-            else:
-                fields_str = (
-                    ", ".join(conflicting_fields[:-1])
-                    + " and "
-                    + conflicting_fields[-1]
-                )
-                message = f"The following fields are already in use: {fields_str}."
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=message,
-            )
-
-    obj = models.Company(**data.model_dump())
-    obj.user_id = user_id
-    db.add(obj)
-    db.commit()
-    db.refresh(obj)
     return obj
 
 
-async def edit_company(user_id: int, data: edit_schemas.CompanyEdit, db: Session):
+async def edit_company(user_id: int, data: edit_schemas.CompanyEdit, db: AsyncSession):
     """This function edits a company's details
 
     Args:
         user_id (int): The user's ID
         data (edit_schemas.CompanyEdit): The company's data
-        db (Session): The database session
+        db (AsyncSession): The database session
+
+    Raises:
+        HTTPException[400]: No data to update or it's in use by another company
+        HTTPException[404]: The user has no company
 
     Returns:
         models.Company: The edited company obj
     """
-    company = (
-        db.query(models.Company)
-        .filter(
-            or_(
-                models.Company.email == data.email,
-                models.Company.tax_identification_number
-                == data.tax_identification_number,
-                models.Company.registration_number == data.registration_number,
-                models.Company.phone == data.phone,
-            )
+    obj = await db.scalar(select(models.Company).filter_by(user_id=user_id))
+    if obj is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Company for user {user_id} not found",
         )
-        .first()
-    )
-
-    if company:
-        # Determine which fields conflict
-        conflicting_fields = [
-            field
-            for field, value in [
-                ("email", company.email == data.email),
-                (
-                    "tax identification number",
-                    company.tax_identification_number == data.tax_identification_number,
-                ),
-                (
-                    "registration number",
-                    company.registration_number == data.registration_number,
-                ),
-                ("phone", company.phone == data.phone),
-            ]
-            if value
-        ]
-
-        # Generate an appropriate message based on the number of conflicting fields
-        if conflicting_fields:
-            if len(conflicting_fields) == 1:
-                message = f"The {conflicting_fields[0]} is already in use."
-            else:
-                fields_str = (
-                    ", ".join(conflicting_fields[:-1])
-                    + " and "
-                    + conflicting_fields[-1]
-                )
-                message = f"The following fields are already in use: {fields_str}."
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=message,
-            )
-    obj = db.query(models.Company).filter_by(user_id=user_id).first()
     data = data.model_dump(exclude_unset=True)
     if data == {}:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="No data to update",
         )
+    company_id = obj.id  # The obj is expired if the update is rolled back
     for field, value in data.items():
         setattr(obj, field, value)
-    db.commit()
-    db.refresh(obj)
+    try:
+        await db.flush()
+    except IntegrityError:
+        # The transaction can't be used after a failed statement (postgres), the
+        # request fails anyway so its unit of work is rolled back
+        await db.rollback()
+        conflicts = await get_unique_conflicts(
+            db=db, model=models.Company, values=data, exclude_id=company_id
+        )
+        if not conflicts:
+            raise
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=get_conflict_message(fields=conflicts),
+        )
     return obj
 
 
 async def create_support_request(
-    user_id: int, data: create_schemas.SupportCreate, db: Session
+    user_id: int, data: create_schemas.SupportCreate, db: AsyncSession
 ):
     """This function creates a new support request
 
     Args:
         user_id (int): The user's ID
         data (create_schemas.SupportCreate): The support request's data
-        db (Session): The database session
+        db (AsyncSession): The database session
 
 
     Returns:
@@ -348,6 +382,77 @@ async def create_support_request(
     obj = models.Support(**data.model_dump())
     obj.user_id = user_id
     db.add(obj)
-    db.commit()
-    db.refresh(obj)
+    await db.flush()
     return obj
+
+
+async def read_user_notifications(
+    user_id: int, db: AsyncSession, notification_ids: list[int] | None = None
+):
+    """This function marks the user's notifications as read
+
+    Marking every notification read only moves the user's read watermark up to their
+    latest notification (a single row write), specific notifications are marked read
+    in one UPDATE. The unread counter is adjusted in the same transaction.
+
+    Args:
+        user_id (int): The user's ID
+        db (AsyncSession): The database session
+        notification_ids (list[int] | None, default=None): The notifications to mark
+            as read, all of them when None
+
+    Returns:
+        int | None: The number of notifications marked as read (None when all of
+            them were)
+    """
+    if notification_ids is None:
+        # Upserting first locks the state row, so the watermark below sees every
+        # notification counted before it
+        await db.execute(
+            dialect_insert(db, models.UserNotificationState)
+            .values(user_id=user_id)
+            .on_conflict_do_update(index_elements=["user_id"], set_={"unread_count": 0})
+        )
+        latest_id = (
+            select(func.max(models.UserNotification.id))
+            .filter_by(user_id=user_id)
+            .scalar_subquery()
+        )
+        await db.execute(
+            update(models.UserNotificationState)
+            .filter_by(user_id=user_id)
+            .values(
+                read_up_to_id=func.coalesce(
+                    latest_id, models.UserNotificationState.read_up_to_id
+                )
+            )
+        )
+        return None
+
+    if not notification_ids:
+        return 0
+    state = await db.scalar(
+        select(models.UserNotificationState)
+        .filter_by(user_id=user_id)
+        .with_for_update()
+    )
+    if state is None:
+        return 0  # Never notified
+    result = await db.execute(
+        update(models.UserNotification)
+        .filter_by(user_id=user_id, is_read=False)
+        .where(
+            models.UserNotification.id.in_(notification_ids),
+            models.UserNotification.id > state.read_up_to_id,
+        )
+        .values(is_read=True)
+    )
+    if result.rowcount:
+        await db.execute(
+            update(models.UserNotificationState)
+            .filter_by(user_id=user_id)
+            .values(
+                unread_count=models.UserNotificationState.unread_count - result.rowcount
+            )
+        )
+    return result.rowcount
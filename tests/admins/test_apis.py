@@ -1,16 +1,24 @@
 import random
 
+import pytest
 from faker import Faker
 from fastapi.testclient import TestClient
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 
-from app.common.dependencies import get_db
+from app.common import apis as internal_apis
+from app.common.cache import principal_cache
+from app.common.dependencies import get_db, get_session_maker
+from app.config.pool import TracedQueuePool
 from app.main import app
+from app.user import security
 
 
-from tests.deps_overrides import get_test_db
+from tests.deps_overrides import get_test_db, get_test_session_maker
 
 # App Dependency Overrides
 app.dependency_overrides[get_db] = get_test_db
+app.dependency_overrides[get_session_maker] = get_test_session_maker
 
 # Initialize the TestClient
 client = TestClient(app)
@@ -224,6 +232,7 @@ def test_generate_admin_access_token():
 
 def test_admin_logout():
     """This test is for the admin logout endpoint"""
+    global ACCESS_TOKEN  # pylint: disable=global-statement
 
     # Logout with valid access token
     good_response = client.delete(
@@ -247,6 +256,19 @@ def test_admin_logout():
     assert invalid_response_data["status"] == "error"
     assert invalid_response_data["data"]["message"] == "Invalid token"
 
+    # Check the access token has been revoked
+    revoked_response = client.get(
+        "/admins/configurations", headers={"Authorization": ACCESS_TOKEN}
+    )
+    assert revoked_response.status_code == 401
+
+    # Login again for further tests
+    login_response = client.post(
+        "/admins/login", json={"email": ADMIN["email"], "password": ADMIN["password"]}
+    )
+    assert login_response.status_code == 200
+    ACCESS_TOKEN = f"Bearer {login_response.json()['data']['tokens']['access_token']}"
+
 
 def test_admin_configurations():
     """This test is for the admin configurations endpoint"""
@@ -322,3 +344,100 @@ def test_admin_configurations_edit():
     assert bad_response_data["status"] == "error"
     assert "data" in bad_response_data
     assert bad_response_data["data"]["message"] == "Invalid token"
+
+
+def test_internal_cache_stats():
+    """This test is for the internal cache stats endpoint"""
+    good_response = client.get(
+        "/internal/caches", headers={"Authorization": ACCESS_TOKEN}
+    )
+    bad_response = client.get(
+        "/internal/caches", headers={"Authorization": faker.sha256()}
+    )
+
+    # Check successful response
+    assert good_response.status_code == 200
+    stats = good_response.json()["data"]
+    assert {"size", "hits", "misses", "hit_rate"} <= set(stats["principals"])
+    assert "pagination_counts" in stats
+
+    # Check unauthorized access response
+    assert bad_response.status_code == 401
+
+
+def test_internal_pool_stats():
+    """This test is for the internal connection pool stats endpoint"""
+    good_response = client.get(
+        "/internal/pool", headers={"Authorization": ACCESS_TOKEN}
+    )
+    bad_response = client.get(
+        "/internal/pool", headers={"Authorization": faker.sha256()}
+    )
+
+    # Check successful response
+    assert good_response.status_code == 200
+    stats = good_response.json()["data"]
+    assert {"size", "checked_in", "checked_out", "overflow"} <= set(stats["primary"])
+    assert "routes" in stats
+
+    # Check unauthorized access response
+    assert bad_response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_internal_pool_stats_exhausted(monkeypatch, tmp_path):
+    """This tests the pool stats can be read while every connection is checked out"""
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path / 'db.sqlite'}",
+        poolclass=TracedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.1,
+    )
+    session_maker = async_sessionmaker(bind=engine)
+
+    async def get_exhausted_db():
+        async with session_maker() as db:
+            yield db
+
+    principal_cache.clear()  # Loading the admin would need a connection
+    monkeypatch.setattr(internal_apis, "engine", engine)
+    monkeypatch.setitem(app.dependency_overrides, get_db, get_exhausted_db)
+    async with engine.connect(), AsyncClient(
+        transport=ASGITransport(app=app), base_url="http://test"
+    ) as async_client:
+        response = await async_client.get(
+            "/internal/pool", headers={"Authorization": ACCESS_TOKEN}
+        )
+    await engine.dispose()
+
+    # Check the stats are served without waiting for a connection
+    assert response.status_code == 200
+    assert response.json()["data"]["primary"]["checked_out"] == 1
+
+
+@pytest.mark.parametrize(
+    "method, path",
+    [
+        ("DELETE", "/admins/logout"),
+        ("GET", "/admins/configurations"),
+        ("PUT", "/admins/configurations"),
+        ("GET", "/admins/notifications"),
+        ("GET", "/admins/notifications/unread"),
+        ("GET", "/admins/notifications/stream"),
+        ("PUT", "/admins/notifications/read"),
+        ("GET", "/internal/caches"),
+        ("GET", "/internal/pool"),
+    ],
+)
+def test_admin_claims_reject_user_tokens(method, path):
+    """This tests a user's access token isn't accepted as an admin's"""
+    user_token = security.generate_user_token(
+        token_type="access", sub="USER-1", expire_in=3
+    )
+    response = client.request(
+        method, path, headers={"Authorization": f"Bearer {user_token}"}, json={}
+    )
+
+    assert response.status_code == 403
+    assert response.json()["data"]["message"] == "Invalid token type"
@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.common.admission import (
+    HIGH_PRIORITY,
+    LOW_PRIORITY,
+    NORMAL_PRIORITY,
+    AdmissionControlMiddleware,
+    AdmissionController,
+    get_priority,
+)
+
+
+def test_get_priority():
+    """This tests requests are classed by their path and method"""
+    assert get_priority({"path": "/health", "method": "GET"}) == HIGH_PRIORITY
+    assert get_priority({"path": "/users/token", "method": "POST"}) == HIGH_PRIORITY
+    assert (
+        get_priority({"path": "/users/notifications", "method": "GET"}) == LOW_PRIORITY
+    )
+    assert get_priority({"path": "/users/me", "method": "GET"}) == NORMAL_PRIORITY
+    assert (
+        get_priority({"path": "/users/notifications/stream", "method": "GET"}) is None
+    )
+
+
+@pytest.mark.asyncio
+async def test_admission_controller():
+    """This tests requests are queued by priority and shed once the queue is full"""
+    controller = AdmissionController(max_concurrency=1, max_queue=1, queue_timeout=1)
+    assert await controller.acquire(NORMAL_PRIORITY)
+
+    low = asyncio.create_task(controller.acquire(LOW_PRIORITY))
+    await asyncio.sleep(0)
+    assert controller.stats()["queued"] == 1
+
+    # The queue is full, a request of the same priority is rejected
+    assert not await controller.acquire(LOW_PRIORITY)
+
+    # A higher priority one takes the low priority one's place
+    high = asyncio.create_task(controller.acquire(HIGH_PRIORITY))
+    await asyncio.sleep(0)
+    assert not await low
+
+    controller.release()
+    assert await high
+    controller.release()
+    assert controller.stats()["active"] == 0
+    assert controller.stats()["rejected"] == 2
+
+
+@pytest.mark.asyncio
+async def test_admission_queue_timeout():
+    """This tests requests that wait too long in the queue are rejected"""
+    controller = AdmissionController(max_concurrency=1, max_queue=1, queue_timeout=0.01)
+    assert await controller.acquire(NORMAL_PRIORITY)
+    assert not await controller.acquire(NORMAL_PRIORITY)
+    assert controller.stats()["timed_out"] == 1
+    assert controller.stats()["queued"] == 0
+
+    # The next request gets the slot once it's freed
+    controller.release()
+    assert await controller.acquire(NORMAL_PRIORITY)
+
+
+def test_admission_control_middleware():
+    """This tests rejected requests get a 503 with a Retry-After header"""
+    app = FastAPI()
+    app.add_middleware(
+        AdmissionControlMiddleware,
+        controller=AdmissionController(max_concurrency=0, max_queue=0, queue_timeout=1),
+        retry_after=3,
+    )
+
+    @app.get("/users/me")
+    async def user_me():
+        """This endpoint is never reached"""
+        return {}
+
+    response = TestClient(app).get("/users/me")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "3"
+    assert response.json()["status"] == "error"
@@ -0,0 +1,48 @@
+import time
+
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+from app.common import dependencies
+from app.common.cache import recent_writers
+from app.common.consistency import LAST_WRITE_COOKIE, LastWriteCookieMiddleware
+from app.common.dependencies import get_db
+
+from tests.config import TestingSessionLocal
+
+app = FastAPI()
+app.add_middleware(LastWriteCookieMiddleware)
+
+
+@app.post("/write")
+async def write(db=Depends(get_db)):
+    """This endpoint writes"""
+    db.info["wrote"] = True
+
+
+@app.get("/read")
+async def read(db=Depends(get_db)):
+    """This endpoint returns whether its session reads from the replica"""
+    return {"read_only": db.info["read_only"]}
+
+
+def test_read_after_write(monkeypatch):
+    """This tests a client that wrote reads from the primary on any worker"""
+    monkeypatch.setattr(dependencies, "SessionLocal", TestingSessionLocal)
+    client = TestClient(app)
+    headers = {"Authorization": "Bearer token"}
+
+    response = client.post("/write", headers=headers)
+    assert LAST_WRITE_COOKIE in response.cookies
+
+    # Another worker doesn't know about the write, the cookie tells it
+    recent_writers.clear()
+    assert client.get("/read", headers=headers).json() == {"read_only": False}
+
+    # Other clients, and the client once the replica has caught up, use the replica
+    assert TestClient(app).get("/read").json() == {"read_only": True}
+    client.cookies.set(LAST_WRITE_COOKIE, str(time.time() - 60))
+    assert client.get("/read", headers=headers).json() == {"read_only": True}
+
+    # Reads don't set the cookie
+    assert LAST_WRITE_COOKIE not in client.get("/read").cookies
@@ -0,0 +1,226 @@
+import logging
+import time
+
+import pytest
+from sqlalchemy import AsyncAdaptedQueuePool, NullPool, StaticPool, event, func, select
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    async_sessionmaker,
+    create_async_engine,
+)
+from sqlalchemy.orm import make_transient_to_detached
+
+from app.config.database import (
+    DBBase,
+    ReplicaMonitor,
+    RoutingSession,
+    get_engine_options,
+    validate_idle_connections,
+)
+from app.user.models import UserRefreshToken
+
+
+async def create_engine_with_tables():
+    """This function creates an in-memory database with the tables"""
+    engine = create_async_engine(
+        "sqlite+aiosqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    async with engine.begin() as connection:
+        await connection.run_sync(DBBase.metadata.create_all)
+    return engine
+
+
+@pytest.mark.asyncio
+async def test_replica_routing():
+    """This tests read only sessions read from the replica until they write"""
+    primary, replica = (
+        await create_engine_with_tables(),
+        await create_engine_with_tables(),
+    )
+    monitor = ReplicaMonitor(max_lag=2, interval=1)
+    monitor.lag, monitor.checked_at = 0.0, time.monotonic()
+    session_class = type(
+        "TestRoutingSession",
+        (RoutingSession,),
+        {"replica": replica.sync_engine, "monitor": monitor},
+    )
+    session_maker = async_sessionmaker(
+        bind=primary, sync_session_class=session_class, expire_on_commit=False
+    )
+    count = select(func.count()).select_from(UserRefreshToken)
+
+    # Only the primary has the row
+    async with session_maker() as db:
+        db.add(UserRefreshToken(user_id=1, token_hash="token", expires_at=func.now()))
+        await db.commit()
+
+    async with session_maker() as db:
+        db.info["read_only"] = True
+        assert await db.scalar(count) == 0
+        assert await db.scalar(count.execution_options(use_primary=True)) == 1
+        assert await db.scalar(count.with_for_update()) == 1
+
+        # Lagging too far behind
+        monitor.lag = 5.0
+        assert await db.scalar(count) == 1
+        monitor.lag = 0.0
+
+        # Stale measure e.g the replica is unreachable
+        monitor.checked_at -= 10
+        assert await db.scalar(count) == 1
+        monitor.checked_at = time.monotonic()
+        assert await db.scalar(count) == 0
+
+    # Read after write
+    async with session_maker() as db:
+        db.info["read_only"] = True
+        db.add(UserRefreshToken(user_id=1, token_hash="token2", expires_at=func.now()))
+        await db.flush()
+        assert await db.scalar(count) == 2
+        await db.rollback()
+
+    # SELECTs with side effects are writes
+    async with session_maker() as db:
+        db.info["read_only"] = True
+        notify = select(func.pg_notify("channel", "key"))
+        assert db.sync_session.get_bind(clause=notify) is primary.sync_engine
+        assert db.info["wrote"]
+        assert await db.scalar(count) == 1
+
+    # Sessions that aren't read only never touch the replica
+    async with session_maker() as db:
+        assert await db.scalar(count) == 1
+
+    await primary.dispose()
+    await replica.dispose()
+
+
+def test_engine_options():
+    """This tests the pool is sized from the connection budget and pooler mode"""
+    options = get_engine_options(
+        pool_mode="queue", transaction_pooler=False, max_connections=90, worker_count=24
+    )
+    assert options["pool_size"] == 2  # A connection is reserved for LISTEN
+    assert options["max_overflow"] == 0
+    assert options["pool_pre_ping"]
+    assert "connect_args" not in options
+
+    options = get_engine_options(
+        pool_mode="queue",
+        transaction_pooler=False,
+        max_connections=90,
+        worker_count=24,
+        validation="background",
+    )
+    assert not options["pool_pre_ping"]
+
+    # The replica's pools have nothing reserved
+    options = get_engine_options(
+        pool_mode="queue",
+        transaction_pooler=False,
+        max_connections=90,
+        worker_count=24,
+        reserved=0,
+    )
+    assert options["pool_size"] == 3
+
+    # Every worker needs a pooled connection on top of its LISTEN connection
+    with pytest.raises(ValueError):
+        get_engine_options(
+            pool_mode="queue",
+            transaction_pooler=False,
+            max_connections=24,
+            worker_count=24,
+        )
+
+    options = get_engine_options(
+        pool_mode="null", transaction_pooler=True, max_connections=90, worker_count=24
+    )
+    assert options["poolclass"] is NullPool
+    assert options["connect_args"]["statement_cache_size"] == 0
+    assert options["connect_args"]["prepared_statement_cache_size"] == 0
+
+    with pytest.raises(ValueError):
+        get_engine_options(
+            pool_mode="session",
+            transaction_pooler=False,
+            max_connections=90,
+            worker_count=24,
+        )
+
+
+def close_on_checkin(engine):
+    """This function closes the next connection returned to the pool, as if the
+    server had dropped it while idle"""
+    event.listen(
+        engine.sync_engine.pool,
+        "checkin",
+        lambda dbapi_connection, _record: dbapi_connection.close(),
+        once=True,
+    )
+
+
+@pytest.mark.asyncio
+async def test_dead_connections(tmp_path):
+    """This tests dead idle connections are replaced without failing requests"""
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path / 'db.sqlite'}",
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+    )
+    session_maker = async_sessionmaker(
+        bind=engine, sync_session_class=RoutingSession, expire_on_commit=False
+    )
+
+    # Caught by the background validation
+    async with engine.connect():
+        close_on_checkin(engine)
+    await validate_idle_connections(engine=engine)
+    async with engine.connect() as connection:
+        assert await connection.scalar(select(1)) == 1
+
+    # Caught by the first statement of the transaction, which is retried
+    async with engine.connect():
+        close_on_checkin(engine)
+    async with session_maker() as db:
+        token = UserRefreshToken(id=1, user_id=1, token_hash="token")
+        make_transient_to_detached(token)
+        token = await db.merge(token, load=False)
+        assert await db.scalar(select(1)) == 1
+        assert token.token_hash == "token"  # Still loaded
+
+    # Later statements aren't, the transaction's work would be lost
+    async with session_maker() as db:
+        assert await db.scalar(select(1)) == 1
+        raw_connection = await (await db.connection()).get_raw_connection()
+        await raw_connection.driver_connection.close()
+        with pytest.raises(DBAPIError):
+            await db.scalar(select(1))
+    await engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_validation_connect_errors(tmp_path, monkeypatch, caplog):
+    """This tests connection errors other than DBAPIError don't stop the validation"""
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path / 'db.sqlite'}",
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=1,
+        max_overflow=0,
+    )
+    async with engine.connect():
+        pass
+
+    def refuse_connection(_engine):
+        raise ConnectionRefusedError("Connection refused")
+
+    monkeypatch.setattr(AsyncEngine, "connect", refuse_connection)
+    with caplog.at_level(logging.ERROR):
+        await validate_idle_connections(engine=engine)
+    assert "Idle connection validation failed" in caplog.text
+    monkeypatch.undo()
+    await engine.dispose()
@@ -0,0 +1,45 @@
+import asyncio
+
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy.exc import OperationalError
+
+from app.common.dependencies import QUERY_CANCELED, Deadline, request_deadline
+
+app = FastAPI()
+
+
+@app.get("/fast", dependencies=[Depends(Deadline(seconds=1))])
+async def fast():
+    """This endpoint returns within its deadline"""
+    return {"deadline": request_deadline.get()}
+
+
+@app.get("/slow", dependencies=[Depends(Deadline(seconds=0.05))])
+async def slow():
+    """This endpoint outlives its deadline"""
+    await asyncio.sleep(1)
+
+
+class QueryCanceledError(Exception):
+    """Stands in for the driver's error of a statement cancelled by its timeout"""
+
+    sqlstate = QUERY_CANCELED
+
+
+@app.get("/cancelled", dependencies=[Depends(Deadline(seconds=1))])
+async def cancelled():
+    """This endpoint's query runs past its statement timeout"""
+    raise OperationalError("SELECT 1", {}, QueryCanceledError())
+
+
+def test_deadline():
+    """This tests requests are bounded by their route's deadline"""
+    client = TestClient(app)
+
+    response = client.get("/fast")
+    assert response.status_code == 200
+    assert response.json()["deadline"] is not None
+
+    assert client.get("/slow").status_code == 504
+    assert client.get("/cancelled").status_code == 503
@@ -0,0 +1,197 @@
+from datetime import datetime, timedelta
+
+import pytest
+from faker import Faker
+from fastapi import HTTPException
+from sqlalchemy import delete, event, select
+
+from app.common.paginators import cursor_paginate
+from app.common.security import hash_password
+from app.common.types import CountStrategy
+from app.user import models as user_models
+
+from tests.config import TestingSessionLocal, engine
+
+# Intialize Faker
+faker = Faker()
+
+
+@pytest.mark.asyncio
+async def test_cursor_paginate():
+    """This tests walking forwards and backwards through cursor pages"""
+    async with TestingSessionLocal() as db:
+
+        user = user_models.User(
+            full_name=faker.name()[:50],
+            email=faker.email(),
+            password=hash_password(raw="admin"),
+        )
+        db.add(user)
+        await db.commit()
+        now = datetime.now()
+        db.add_all(
+            [
+                user_models.UserNotification(
+                    user_id=user.id,
+                    content=str(i),
+                    created_at=now + timedelta(seconds=i),
+                )
+                for i in range(7)
+            ]
+        )
+        await db.commit()
+
+        qs = select(user_models.UserNotification).filter_by(user_id=user.id)
+        order_by = (
+            user_models.UserNotification.created_at,
+            user_models.UserNotification.id,
+        )
+
+        # First page (newest first)
+        items, meta = await cursor_paginate(qs=qs, db=db, order_by=order_by, size=3)
+        assert [item.content for item in items] == ["6", "5", "4"]
+        assert meta["has_next_page"] is True
+        assert meta["has_prev_page"] is False
+        assert meta["prev_cursor"] is None
+
+        # Second page
+        items, meta = await cursor_paginate(
+            qs=qs, db=db, order_by=order_by, size=3, cursor=meta["next_cursor"]
+        )
+        assert [item.content for item in items] == ["3", "2", "1"]
+        assert meta["has_next_page"] is True
+        assert meta["has_prev_page"] is True
+
+        # Last page
+        last_items, last_meta = await cursor_paginate(
+            qs=qs, db=db, order_by=order_by, size=3, cursor=meta["next_cursor"]
+        )
+        assert [item.content for item in last_items] == ["0"]
+        assert last_meta["has_next_page"] is False
+        assert last_meta["next_cursor"] is None
+
+        # Back to the first page
+        items, meta = await cursor_paginate(
+            qs=qs, db=db, order_by=order_by, size=3, cursor=meta["prev_cursor"]
+        )
+        assert [item.content for item in items] == ["6", "5", "4"]
+        assert meta["has_prev_page"] is False
+        assert meta["has_next_page"] is True
+
+        # Clean up
+        await db.execute(
+            delete(user_models.UserNotification).filter_by(user_id=user.id)
+        )
+        await db.delete(user)
+        await db.commit()
+
+
+@pytest.mark.asyncio
+async def test_cursor_paginate_invalid_cursor():
+    """This tests that a tampered cursor is rejected"""
+    async with TestingSessionLocal() as db:
+        with pytest.raises(HTTPException) as exc:
+            await cursor_paginate(
+                qs=select(user_models.UserNotification),
+                db=db,
+                order_by=(user_models.UserNotification.id,),
+                size=3,
+                cursor=faker.sha256(),
+            )
+        assert exc.value.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_cursor_paginate_count_strategies():
+    """This tests the cursor paginator with every count strategy"""
+    async with TestingSessionLocal() as db:
+        user = user_models.User(
+            full_name=faker.name()[:50],
+            email=faker.email(),
+            password=hash_password(raw="admin"),
+        )
+        db.add(user)
+        await db.commit()
+        db.add_all(
+            [
+                user_models.UserNotification(user_id=user.id, content=str(i))
+                for i in range(5)
+            ]
+        )
+        await db.commit()
+        qs = select(user_models.UserNotification).filter_by(user_id=user.id)
+        order_by = (user_models.UserNotification.id,)
+        statements = []
+
+        def record_statement(_conn, _cursor, statement, *_args):
+            statements.append(statement)
+
+        # Exact, counted in the page query, the total isn't narrowed by the cursor
+        event.listen(engine.sync_engine, "before_cursor_execute", record_statement)
+        try:
+            items, meta = await cursor_paginate(
+                qs=qs,
+                db=db,
+                order_by=order_by,
+                size=2,
+                count_strategy=CountStrategy.EXACT,
+            )
+            assert len(statements) == 1
+            items, meta = await cursor_paginate(
+                qs=qs,
+                db=db,
+                order_by=order_by,
+                size=2,
+                cursor=meta["next_cursor"],
+                count_strategy=CountStrategy.EXACT,
+            )
+            assert len(statements) == 2
+        finally:
+            event.remove(engine.sync_engine, "before_cursor_execute", record_statement)
+        assert [item.content for item in items] == ["2", "1"]
+        assert meta["total_no_items"] == 5
+        assert meta["count_strategy"] == CountStrategy.EXACT
+
+        # Not counted
+        _, meta = await cursor_paginate(qs=qs, db=db, order_by=order_by, size=2)
+        assert meta["total_no_items"] is None
+        assert meta["count_strategy"] == CountStrategy.NONE
+
+        # Cached, the cached total is returned until it expires
+        _, meta = await cursor_paginate(
+            qs=qs,
+            db=db,
+            order_by=order_by,
+            size=2,
+            count_strategy=CountStrategy.CACHED,
+        )
+        assert meta["total_no_items"] == 5
+        db.add(user_models.UserNotification(user_id=user.id, content="5"))
+        await db.commit()
+        _, meta = await cursor_paginate(
+            qs=qs,
+            db=db,
+            order_by=order_by,
+            size=2,
+            count_strategy=CountStrategy.CACHED,
+        )
+        assert meta["total_no_items"] == 5
+        assert meta["count_strategy"] == CountStrategy.CACHED
+
+        # Estimated, sqlite has no planner estimate so it falls back to exact
+        _, meta = await cursor_paginate(
+            qs=qs,
+            db=db,
+            order_by=order_by,
+            size=2,
+            count_strategy=CountStrategy.ESTIMATED,
+        )
+        assert meta["total_no_items"] == 6
+        assert meta["count_strategy"] == CountStrategy.EXACT
+
+        # Clean up
+        await db.execute(
+            delete(user_models.UserNotification).filter_by(user_id=user.id)
+        )
+        await db.delete(user)
+        await db.commit()
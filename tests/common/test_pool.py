@@ -0,0 +1,47 @@
+import asyncio
+import logging
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.config.pool import PoolTracer, TracedQueuePool, current_route, pool_tracer
+
+
+@pytest.mark.asyncio
+async def test_pool_tracer(tmp_path):
+    """This tests checkouts are attributed to the current route"""
+    engine = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path / 'db.sqlite'}", poolclass=TracedQueuePool
+    )
+    current_route.set("GET /test/pool")
+    async with engine.connect() as connection:
+        await connection.scalar(select(1))
+        assert pool_tracer.routes["GET /test/pool"].held == 1
+
+    stats = pool_tracer.stats()["GET /test/pool"]
+    assert stats["checkouts"] == 1
+    assert stats["held"] == 0
+    assert stats["hold_max"] > 0
+    assert stats["wait_max"] > 0  # Includes opening the connection
+    await engine.dispose()
+
+
+def test_leak_detection(caplog):
+    """This tests connections held past the threshold are logged once with a stack"""
+    tracer = PoolTracer(leak_threshold=0.01)
+    record = object()
+
+    async def hold_connection():
+        current_route.set("GET /test/leak")
+        tracer.on_checkout(None, record, None)
+        await asyncio.sleep(0.05)
+        with caplog.at_level(logging.WARNING):
+            assert tracer.check_leaks() == 1
+            assert tracer.check_leaks() == 0
+        tracer.on_checkin(None, record)
+
+    asyncio.run(hold_connection())
+    assert "GET /test/leak" in caplog.text
+    assert "hold_connection" in caplog.text
+    assert tracer.stats()["GET /test/leak"]["leaks"] == 1
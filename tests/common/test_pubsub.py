@@ -0,0 +1,218 @@
+import asyncio
+
+import orjson
+import pytest
+from faker import Faker
+from sqlalchemy import delete
+
+from app.common.cache import principal_cache
+from app.common.pubsub import (
+    CACHE_INVALIDATION_CHANNEL,
+    Broker,
+    broker,
+    clear_cached,
+    evict_cached,
+    invalidate_cached,
+    stream_events,
+)
+from app.common.security import hash_password
+from app.user import models as user_models, selectors as user_selectors
+from app.user import services as user_services
+
+from tests.config import TestingSessionLocal
+
+# Intialize Faker
+faker = Faker()
+
+
+def parse_event(message: str):
+    """This function returns the id and data of a Server-Sent Event"""
+    fields = dict(line.split(": ", 1) for line in message.strip().splitlines())
+    return int(fields["id"]), orjson.loads(fields["data"])
+
+
+@pytest.mark.asyncio
+async def test_publish_after_commit():
+    """This tests subscribers are only woken up once the transaction commits"""
+    channel = user_models.UserNotification.__tablename__
+    async with broker.subscribe(channel=channel, key=0) as wake_up:
+        async with TestingSessionLocal() as db:
+            await broker.publish(db=db, channel=channel, key=0)
+            assert wake_up.empty()
+            await db.commit()
+        assert not wake_up.empty()
+
+
+@pytest.mark.asyncio
+async def test_invalidate_cached():
+    """This tests changed entities are evicted locally and by every worker's handler"""
+    principal_cache.set("USER-0", "stale")
+    async with TestingSessionLocal() as db:
+        await invalidate_cached(db=db, key="USER-0")
+        assert "USER-0" not in principal_cache
+
+        # Re-cached by a concurrent request before the commit
+        principal_cache.set("USER-0", "stale")
+        await db.commit()
+    assert "USER-0" not in principal_cache
+
+    # Another worker's change, as delivered by LISTEN
+    principal_cache.set("USER-0", "stale")
+    broker.dispatch(channel=CACHE_INVALIDATION_CHANNEL, key="USER-0")
+    assert "USER-0" not in principal_cache
+
+
+@pytest.mark.asyncio
+async def test_stream_events():
+    """This tests replaying from Last-Event-ID and then streaming new notifications"""
+    async with TestingSessionLocal() as db:
+        user = user_models.User(
+            full_name=faker.name()[:50],
+            email=faker.email(),
+            password=hash_password(raw="admin"),
+        )
+        db.add(user)
+        await db.commit()
+        first = await user_services.create_user_notification(
+            user_id=user.id, content="First", db=db
+        )
+        await db.commit()
+
+    async def fetch_notifications(after_id: int):
+        async with TestingSessionLocal() as db:
+            notifications = await user_selectors.get_user_notifications_after(
+                user_id=user.id, after_id=after_id, db=db
+            )
+        return [(noti.id, {"content": noti.content}) for noti in notifications]
+
+    stream = stream_events(
+        channel=user_models.UserNotification.__tablename__,
+        key=user.id,
+        fetch_events=fetch_notifications,
+        last_event_id=first.id - 1,
+        keepalive=5,
+    )
+    try:
+        # Check the replay
+        assert parse_event(await anext(stream)) == (first.id, {"content": "First"})
+
+        # Check new notifications are pushed
+        next_event = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0)
+        assert not next_event.done()
+        async with TestingSessionLocal() as db:
+            second = await user_services.create_user_notification(
+                user_id=user.id, content="Second", db=db
+            )
+            await db.commit()
+        event = await asyncio.wait_for(next_event, timeout=1)
+        assert parse_event(event) == (second.id, {"content": "Second"})
+    finally:
+        await stream.aclose()
+        async with TestingSessionLocal() as db:
+            for model in (
+                user_models.UserNotification,
+                user_models.UserNotificationState,
+            ):
+                await db.execute(delete(model).filter_by(user_id=user.id))
+            await db.execute(delete(user_models.User).filter_by(id=user.id))
+            await db.commit()
+
+
+class FakeDriverConnection:
+    """Stands in for an asyncpg connection, notifications are sent by the test"""
+
+    def __init__(self):
+        self.listeners = {}
+        self.termination_listeners = []
+
+    async def add_listener(self, channel, callback):
+        self.listeners[channel] = callback
+
+    def add_termination_listener(self, callback):
+        self.termination_listeners.append(callback)
+
+    def notify(self, channel, payload):
+        self.listeners[channel](self, 0, channel, payload)
+
+    def terminate(self):
+        for callback in self.termination_listeners:
+            callback(self)
+
+
+class FakeConnection:
+    """Stands in for the engine connection the broker LISTENs on"""
+
+    def __init__(self):
+        self.driver_connection = FakeDriverConnection()
+        self.invalidated = False
+
+    async def get_raw_connection(self):
+        return self
+
+    async def invalidate(self):
+        self.invalidated = True
+
+    async def close(self):
+        pass
+
+
+class FakeEngine:
+    """Stands in for a postgres engine, the first connect after a drop fails"""
+
+    class dialect:  # pylint: disable=invalid-name
+        name = "postgresql"
+
+    def __init__(self):
+        self.connections = []
+        self.failures = 0
+
+    async def connect(self):
+        if len(self.connections) == 1 and self.failures == 0:
+            self.failures += 1
+            raise OSError("Connection refused")
+        self.connections.append(FakeConnection())
+        return self.connections[-1]
+
+
+@pytest.mark.asyncio
+async def test_broker_reconnect():
+    """This tests invalidations still arrive after the LISTEN connection drops"""
+    reconnected = asyncio.Event()
+
+    async def on_reconnect():
+        await clear_cached()
+        reconnected.set()
+
+    reconnect_broker = Broker(min_reconnect_delay=0.01)
+    reconnect_broker.add_handler(
+        channel=CACHE_INVALIDATION_CHANNEL, handler=evict_cached
+    )
+    reconnect_broker.add_reconnect_handler(on_reconnect)
+    engine = FakeEngine()
+    await reconnect_broker.start(engine=engine)
+
+    principal_cache.set("USER-1000", "user")
+    engine.connections[0].driver_connection.notify(
+        CACHE_INVALIDATION_CHANNEL, "USER-1000"
+    )
+    assert principal_cache.get("USER-1000") is None
+
+    # The connection drops, whatever was missed meanwhile is cleared on reconnect
+    principal_cache.set("USER-1001", "user")
+    async with reconnect_broker.subscribe(channel="other", key=1) as wake_up:
+        engine.connections[0].driver_connection.terminate()
+        await asyncio.wait_for(reconnected.wait(), timeout=1)
+        assert not wake_up.empty()
+    assert engine.connections[0].invalidated
+    assert engine.failures == 1
+    assert principal_cache.get("USER-1001") is None
+
+    # The new connection LISTENs on every channel
+    principal_cache.set("USER-1002", "user")
+    new_connection = engine.connections[1].driver_connection
+    assert {CACHE_INVALIDATION_CHANNEL, "other"} <= set(new_connection.listeners)
+    new_connection.notify(CACHE_INVALIDATION_CHANNEL, "USER-1002")
+    assert principal_cache.get("USER-1002") is None
+
+    await reconnect_broker.stop()
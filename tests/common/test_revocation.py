@@ -0,0 +1,81 @@
+import time
+
+import pytest
+from sqlalchemy import delete
+
+from app.common.models import TokenRevocation
+from app.common.pubsub import broker
+from app.common.revocation import (
+    TOKEN_REVOCATION_CHANNEL,
+    BloomFilter,
+    RevocationList,
+    revocation_list,
+    revoke_subject,
+)
+
+from tests.config import TestingSessionLocal
+
+
+def test_bloom_filter():
+    """This tests the bloom filter has no false negatives and few false positives"""
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    for i in range(1000):
+        bloom.add(f"USER-{i}")
+
+    assert all(f"USER-{i}" in bloom for i in range(1000))
+    false_positives = sum(f"ADMIN-{i}" in bloom for i in range(1000))
+    assert false_positives < 50
+
+
+def test_revocation_list():
+    """This tests tokens are revoked by subject and issue time"""
+    revocations = RevocationList(capacity=2)
+    now = time.time()
+    revocations.add(subject="USER-1", revoked_at=now)
+
+    assert revocations.is_revoked(subject="USER-1", issued_at=now - 1)
+    assert not revocations.is_revoked(subject="USER-1", issued_at=now + 1)
+    assert not revocations.is_revoked(subject="USER-2", issued_at=now - 1)
+
+    # An older revocation doesn't undo a newer one
+    revocations.add(subject="USER-1", revoked_at=now - 10)
+    assert revocations.is_revoked(subject="USER-1", issued_at=now - 1)
+
+    # Past capacity the filter grows
+    for i in range(2, 6):
+        revocations.add(subject=f"USER-{i}", revoked_at=now)
+    assert revocations.capacity >= len(revocations) == 5
+    assert all(
+        revocations.is_revoked(subject=f"USER-{i}", issued_at=now) for i in range(1, 6)
+    )
+
+
+@pytest.mark.asyncio
+async def test_revoke_subject():
+    """This tests revocations are applied on commit, by every worker and on reload"""
+    async with TestingSessionLocal() as db:
+        await revoke_subject(db=db, subject="USER-0")
+        issued_at = time.time() - 1
+        assert not revocation_list.is_revoked(subject="USER-0", issued_at=issued_at)
+        await db.commit()
+        assert revocation_list.is_revoked(subject="USER-0", issued_at=issued_at)
+
+    # A rolled back revocation isn't applied
+    async with TestingSessionLocal() as db:
+        await revoke_subject(db=db, subject="USER-00")
+        await db.rollback()
+    assert not revocation_list.is_revoked(subject="USER-00", issued_at=issued_at)
+
+    # A fresh reload keeps it, now that it's in the table
+    revocations = RevocationList(capacity=10)
+    async with TestingSessionLocal() as db:
+        await revocations.load(db=db)
+    assert revocations.is_revoked(subject="USER-0", issued_at=issued_at)
+
+    # Another worker's revocation, as delivered by LISTEN
+    broker.dispatch(channel=TOKEN_REVOCATION_CHANNEL, key=f"ADMIN-0 {time.time()}")
+    assert revocation_list.is_revoked(subject="ADMIN-0", issued_at=issued_at)
+
+    async with TestingSessionLocal() as db:
+        await db.execute(delete(TokenRevocation))
+        await db.commit()
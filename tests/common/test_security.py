@@ -0,0 +1,89 @@
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+from cryptography.hazmat.primitives.serialization import (
+    Encoding,
+    NoEncryption,
+    PrivateFormat,
+    PublicFormat,
+)
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from app.common.security import KeyRing, PasswordHasher
+from app.main import app
+
+
+def private_pem(private_key):
+    """This function PEM encodes a private key"""
+    return private_key.private_bytes(Encoding.PEM, PrivateFormat.PKCS8, NoEncryption())
+
+
+@pytest.mark.asyncio
+async def test_password_hasher():
+    """This tests hashing and verifying passwords in the process pool"""
+    hasher = PasswordHasher(max_workers=1, max_queue=1)
+    hasher.start()
+    try:
+        hashed = await hasher.hash(raw="admin")
+        assert hashed != "admin"
+        assert await hasher.verify(plain_password="admin", hashed_password=hashed)
+        assert not await hasher.verify(plain_password="nimda", hashed_password=hashed)
+    finally:
+        hasher.stop()
+
+
+@pytest.mark.asyncio
+async def test_password_hasher_queue_full():
+    """This tests that the hasher rejects work when its queue is full"""
+    hasher = PasswordHasher(max_workers=0, max_queue=0)
+
+    with pytest.raises(HTTPException) as exc:
+        await hasher.hash(raw="admin")
+    assert exc.value.status_code == 503
+
+
+def test_key_ring_rotation():
+    """This tests signing with the active key and verifying with retired ones"""
+    old_key = ed25519.Ed25519PrivateKey.generate()
+    new_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    old_public_pem = old_key.public_key().public_bytes(
+        Encoding.PEM, PublicFormat.SubjectPublicKeyInfo
+    )
+
+    old_ring = KeyRing(keys=[KeyRing.load_key(kid="1", pem=private_pem(old_key))])
+    old_token = old_ring.encode(payload={"sub": "USER-1"})
+    assert jwt.get_unverified_header(old_token) == {
+        "alg": "EdDSA",
+        "kid": "1",
+        "typ": "JWT",
+    }
+
+    # The old key is kept for verification only after rotating
+    ring = KeyRing(
+        keys=[
+            KeyRing.load_key(kid="1", pem=old_public_pem),
+            KeyRing.load_key(kid="2", pem=private_pem(new_key)),
+        ]
+    )
+    assert ring.active_kid == "2"
+    token = ring.encode(payload={"sub": "USER-2"})
+    assert jwt.get_unverified_header(token)["alg"] == "RS256"
+    assert ring.decode(token=token) == {"sub": "USER-2"}
+    assert ring.decode(token=old_token) == {"sub": "USER-1"}
+    assert [jwk["kid"] for jwk in ring.jwks()["keys"]] == ["1", "2"]
+
+    # Check unknown kids and HS tokens without a secret are rejected
+    with pytest.raises(jwt.PyJWTError):
+        old_ring.decode(token=token)
+    with pytest.raises(jwt.PyJWTError):
+        ring.decode(token=jwt.encode({"sub": "USER-1"}, "secret", algorithm="HS256"))
+
+
+def test_jwks():
+    """This tests the JWKS endpoint"""
+    response = TestClient(app).get("/.well-known/jwks.json")
+
+    assert response.status_code == 200
+    assert "keys" in response.json()
+    assert response.headers["Cache-Control"].startswith("public, max-age=")
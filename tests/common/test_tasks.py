@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta
+
+import pytest
+from faker import Faker
+from sqlalchemy import delete, func, select
+
+from app.common.security import hash_token
+from app.common.tasks import purge_expired_tokens
+from app.user import models as user_models
+
+from tests.config import TestingSessionLocal
+
+# Intialize Faker
+faker = Faker()
+
+
+@pytest.mark.asyncio
+async def test_purge_expired_tokens():
+    """This tests that only expired tokens are purged, in batches"""
+    async with TestingSessionLocal() as db:
+        now = datetime.now()
+        db.add_all(
+            [
+                user_models.UserRefreshToken(
+                    user_id=1,
+                    token_hash=hash_token(token=faker.sha256()),
+                    expires_at=now + timedelta(hours=hours),
+                )
+                for hours in (-2, -1, -1, 1)
+            ]
+            + [
+                user_models.UserPasswordResetToken(
+                    user_id=1, token=faker.sha256(), is_used=is_used
+                )
+                for is_used in (True, False)
+            ]
+        )
+        await db.commit()
+
+        report = await purge_expired_tokens(db=db, batch_size=2, max_batches=10)
+
+        assert report["rows_deleted"] == {
+            "user_refresh_tokens": 3,
+            "admin_refresh_tokens": 0,
+            "token_revocations": 0,
+            "user_password_reset_tokens": 1,
+        }
+        assert report["duration_seconds"] >= 0
+        assert (
+            await db.scalar(
+                select(func.count()).select_from(user_models.UserRefreshToken)
+            )
+            == 1
+        )
+
+        # Clean up
+        await db.execute(delete(user_models.UserRefreshToken))
+        await db.execute(delete(user_models.UserPasswordResetToken))
+        await db.commit()
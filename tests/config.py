@@ -1,16 +1,26 @@
-from sqlalchemy import StaticPool, create_engine
-from sqlalchemy.orm import sessionmaker
+import asyncio
+
+from sqlalchemy import StaticPool
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 
 from app.config.database import DBBase
 
-SQLALCHEMY_DATABASE_URL = "sqlite://"
+SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite://"
 
-engine = create_engine(
+engine = create_async_engine(
     SQLALCHEMY_DATABASE_URL,
     connect_args={"check_same_thread": False},
     poolclass=StaticPool,
 )
-TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+TestingSessionLocal = async_sessionmaker(
+    bind=engine, autoflush=False, expire_on_commit=False
+)
+
+
+async def create_tables():
+    """This function creates the database tables for the tests"""
+    async with engine.begin() as connection:
+        await connection.run_sync(DBBase.metadata.create_all)
 
 
-DBBase.metadata.create_all(bind=engine)
+asyncio.run(create_tables())
@@ -1,10 +1,13 @@
 from tests.config import TestingSessionLocal
 
 
-def get_test_db():
+async def get_test_db():
     """This function overrides the get_db function in the dependencies module."""
-    try:
-        db = TestingSessionLocal()
+    async with TestingSessionLocal() as db:
         yield db
-    finally:
-        db.close()
+        await db.commit()
+
+
+def get_test_session_maker():
+    """This function overrides the get_session_maker function in the dependencies module."""
+    return TestingSessionLocal
@@ -1,16 +1,24 @@
+import asyncio
 import random
+import string
 
+import pytest
 from faker import Faker
 from fastapi.testclient import TestClient
+from sqlalchemy import event, select
 
-from app.common.dependencies import get_db
+from app.common.cache import principal_cache
+from app.common.dependencies import get_db, get_session_maker
 from app.main import app
 from app.user import models as user_models, security
+from app.user import services as user_services
 
-from tests.deps_overrides import get_test_db
+from tests.config import TestingSessionLocal, engine
+from tests.deps_overrides import get_test_db, get_test_session_maker
 
 # App Dependency Overrides
 app.dependency_overrides[get_db] = get_test_db
+app.dependency_overrides[get_session_maker] = get_test_session_maker
 
 
 # Initialize the TestClient
@@ -68,6 +76,38 @@ def test_user_create():
     )
 
 
+def test_user_create_statements():
+    """This tests signing up takes one INSERT per table it writes to and nothing else"""
+    statements = []
+
+    def record_statement(_conn, _cursor, statement, *_args):
+        statements.append(" ".join(statement.split()[:3]))
+
+    event.listen(engine.sync_engine, "before_cursor_execute", record_statement)
+    try:
+        good_response = client.post(
+            "/users",
+            json={
+                **USER,
+                "email": faker.email(),
+                "exception_alert_email": faker.email(),
+            },
+        )
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", record_statement)
+
+    # Check the unique constraints are checked by the INSERTs themselves. Signup writes
+    # a row to four tables, so four INSERTs is the floor (postgres adds the NOTIFY of
+    # the welcome notification), fewer would need data-modifying CTEs sqlite lacks
+    assert good_response.status_code == 201
+    assert statements == [
+        "INSERT INTO users",
+        "INSERT INTO user_configurations",
+        "INSERT INTO user_notification_states",
+        "INSERT INTO user_notifications",
+    ]
+
+
 def test_user_login():
     """This test is for the user login endpoint"""
 
@@ -116,6 +156,33 @@ def test_user_login():
     REFRESH_TOKEN += response_data["data"]["tokens"]["refresh_token"]
 
 
+def test_user_email_case_insensitive():
+    """This tests emails identify the same user whatever their case"""
+    login_response = client.post(
+        "/users/login",
+        json={"email": USER["email"].upper(), "password": USER["password"]},
+    )
+    create_response = client.post(
+        "/users",
+        json={
+            **USER,
+            "email": USER["email"].upper(),
+            "exception_alert_email": faker.email(),
+        },
+    )
+
+    # Check the login matches the existing user
+    assert login_response.status_code == 200
+    assert login_response.json()["data"]["user"]["email"] == USER["email"]
+
+    # Check the email is already registered
+    assert create_response.status_code == 400
+    assert (
+        create_response.json()["data"]["message"]
+        == f"user with email {USER['email']} exists"
+    )
+
+
 def test_user_me():
     """This test is for the user detail (me) endpoint"""
     good_response = client.get(
@@ -190,8 +257,30 @@ def test_user_edit():
     assert bad_user.get("data", {}).get("message") == "Invalid token"
 
 
+def test_user_principal_cache():
+    """This test checks the current user is cached and evicted when edited"""
+    principal_cache.clear()
+    headers = {"Authorization": ACCESS_TOKEN}
+    user_id = client.get("/users/me", headers=headers).json()["data"]["id"]
+    assert f"USER-{user_id}" in principal_cache
+
+    # Check a cached read
+    hits = principal_cache.hits
+    good_response = client.get("/users/me", headers=headers)
+    assert good_response.status_code == 200
+    assert principal_cache.hits == hits + 1
+
+    # Check the edit evicts the user and the change is visible
+    full_name = faker.name()[:50]
+    client.put("/users", headers=headers, json={"full_name": full_name})
+    assert f"USER-{user_id}" not in principal_cache
+    good_response = client.get("/users/me", headers=headers)
+    assert good_response.json()["data"]["full_name"] == full_name
+
+
 def test_user_token():
     """This test is for the user token endpoint"""
+    global REFRESH_TOKEN  # pylint: disable=global-statement
     bad_response = client.post("/users/token", json={"refresh_token": faker.sha256()})
     good_response = client.post("/users/token", json={"refresh_token": REFRESH_TOKEN})
 
@@ -203,6 +292,29 @@ def test_user_token():
     assert good_response.status_code == 200
     assert "access_token" in response_data["data"]
 
+    # The refresh token is rotated
+    REFRESH_TOKEN = response_data["data"]["refresh_token"]
+
+
+def test_user_token_reuse():
+    """This tests refresh tokens are rotated and replaying one revokes its family"""
+    first_response = client.post("/users/token", json={"refresh_token": REFRESH_TOKEN})
+    assert first_response.status_code == 200
+    rotated_token = first_response.json()["data"]["refresh_token"]
+    assert rotated_token != REFRESH_TOKEN
+
+    second_response = client.post("/users/token", json={"refresh_token": rotated_token})
+    assert second_response.status_code == 200
+    latest_token = second_response.json()["data"]["refresh_token"]
+
+    # Replay a rotated token
+    replay_response = client.post("/users/token", json={"refresh_token": rotated_token})
+    assert replay_response.status_code == 401
+
+    # Check the whole family has been revoked
+    latest_response = client.post("/users/token", json={"refresh_token": latest_token})
+    assert latest_response.status_code == 401
+
 
 def test_user_logout():
     """This test is for the user logout endpoint"""
@@ -222,13 +334,19 @@ def test_user_logout():
     # Check good response
     assert good_response.status_code == 200
 
+    # Check the access token has been revoked
+    revoked_response = client.get(
+        "/users/configurations", headers={"Authorization": ACCESS_TOKEN}
+    )
+    assert revoked_response.status_code == 401
+
 
-def test_user_notifications():
+@pytest.mark.asyncio
+async def test_user_notifications():
     """This test is for the user notifications endpoint"""
-    db = next(get_test_db())
-
-    # Get existing user
-    existing_user = db.query(user_models.User).first()
+    async with TestingSessionLocal() as db:
+        # Get existing user
+        existing_user = await db.scalar(select(user_models.User))
 
     assert existing_user is not None
 
@@ -246,22 +364,23 @@ def test_user_notifications():
     assert good_response.status_code == 200
 
 
-def test_user_notification_read():
+@pytest.mark.asyncio
+async def test_user_notification_read():
     """This test is for the user notification read endpoint"""
-    db = next(get_test_db())
-
-    # Get existing user
-    existing_user = db.query(user_models.User).first()
+    async with TestingSessionLocal() as db:
+        # Get existing user
+        existing_user = await db.scalar(select(user_models.User))
 
     assert existing_user is not None
 
     # Generate access token
     access_token = security.generate_user_token(
-        token_type="access", sub=f"GUARDIAN-{existing_user.id}", expire_in=3
+        token_type="access", sub=f"USER-{existing_user.id}", expire_in=3
     )
 
     # Get existing notification
-    existing_notification = db.query(user_models.UserNotification).first()
+    async with TestingSessionLocal() as db:
+        existing_notification = await db.scalar(select(user_models.UserNotification))
 
     assert existing_notification is not None
 
@@ -274,12 +393,100 @@ def test_user_notification_read():
     assert good_response.status_code == 200
 
 
-def test_user_password_change():
-    """This test is for the user change password endpoint"""
-    db = next(get_test_db())
+@pytest.mark.asyncio
+async def test_user_notification_unread():
+    """This test is for the user unread notification count endpoint"""
+    async with TestingSessionLocal() as db:
+        # Get existing user
+        existing_user = await db.scalar(select(user_models.User))
+
+    assert existing_user is not None
+
+    # Generate access token
+    access_token = security.generate_user_token(
+        token_type="access", sub=f"USER-{existing_user.id}", expire_in=3
+    )
+    headers = {"Authorization": f"Bearer {access_token}"}
 
-    # Generate good reset password token
-    existing_user = db.query(user_models.User).first()
+    # Add an unread notification
+    async with TestingSessionLocal() as db:
+        await user_services.create_user_notification(
+            user_id=existing_user.id, content="Unread", db=db
+        )
+        await db.commit()
+
+    good_response = client.get("/users/notifications/unread", headers=headers)
+
+    # Check good response
+    assert good_response.status_code == 200
+    assert good_response.json()["data"] == {"unread": True, "unread_count": 1}
+    list_response = client.get("/users/notifications", headers=headers)
+    assert list_response.json()["data"]["unread_count"] == 1
+
+    # Check the count is reset once read
+    client.put("/users/notifications/read", headers=headers)
+    good_response = client.get("/users/notifications/unread", headers=headers)
+    assert good_response.json()["data"] == {"unread": False, "unread_count": 0}
+
+
+@pytest.mark.asyncio
+async def test_user_notification_read_by_id():
+    """This test is for marking specific user notifications as read"""
+    async with TestingSessionLocal() as db:
+        # Get existing user
+        existing_user = await db.scalar(select(user_models.User))
+
+    assert existing_user is not None
+
+    # Generate access token
+    access_token = security.generate_user_token(
+        token_type="access", sub=f"USER-{existing_user.id}", expire_in=3
+    )
+    headers = {"Authorization": f"Bearer {access_token}"}
+
+    async with TestingSessionLocal() as db:
+        first = await user_services.create_user_notification(
+            user_id=existing_user.id, content="First", db=db
+        )
+        await user_services.create_user_notification(
+            user_id=existing_user.id, content="Second", db=db
+        )
+        await db.commit()
+
+    good_response = client.put(
+        "/users/notifications/read",
+        headers=headers,
+        json={"notification_ids": [first.id]},
+    )
+
+    # Check good response
+    assert good_response.status_code == 200
+    data = client.get("/users/notifications", headers=headers).json()["data"]
+    assert data["unread_count"] == 1
+    is_read = {noti["id"]: noti["is_read"] for noti in data["notifications"]}
+    assert is_read[first.id] is True
+    assert list(is_read.values()).count(False) == 1
+
+    # Check marking everything read only moves the watermark
+    client.put("/users/notifications/read", headers=headers)
+    data = client.get("/users/notifications", headers=headers).json()["data"]
+    assert data["unread_count"] == 0
+    assert all(noti["is_read"] for noti in data["notifications"])
+    async with TestingSessionLocal() as db:
+        unread = await db.scalars(
+            select(user_models.UserNotification).filter_by(
+                user_id=existing_user.id, is_read=False
+            )
+        )
+        assert len(unread.all()) > 0
+
+
+@pytest.mark.asyncio
+async def test_user_password_change():
+    """This test is for the user change password endpoint"""
+    async with TestingSessionLocal() as db:
+        # Generate good reset password token
+        existing_user = await db.scalar(select(user_models.User))
     assert existing_user is not None  # Confirm that a guardian exists
 
     # Generate access token
@@ -305,12 +512,12 @@ def test_user_password_change():
     assert good_response.status_code == 200
 
 
-def test_user_password_confirm():
+@pytest.mark.asyncio
+async def test_user_password_confirm():
     """This test is for the user confirm password endpoint"""
-    db = next(get_test_db())
-
-    # Generate good reset password token
-    existing_user = db.query(user_models.User).first()
+    async with TestingSessionLocal() as db:
+        # Generate good reset password token
+        existing_user = await db.scalar(select(user_models.User))
     assert existing_user is not None  # Confirm that a user exists
 
     # Generate access token
@@ -340,12 +547,12 @@ def test_user_password_confirm():
     assert good_response_data["data"]["is_correct"] is True
 
 
-def test_get_user_configurations():
+@pytest.mark.asyncio
+async def test_get_user_configurations():
     """This test is for the get user configurations endpoint"""
-    db = next(get_test_db())
-
-    # Generate good reset password token
-    existing_user = db.query(user_models.User).first()
+    async with TestingSessionLocal() as db:
+        # Generate good reset password token
+        existing_user = await db.scalar(select(user_models.User))
     assert existing_user is not None  # Confirm that a user exists
 
     # Generate access token
@@ -362,12 +569,12 @@ def test_get_user_configurations():
     assert good_response.status_code == 200
 
 
-def test_user_configurations_edit():
+@pytest.mark.asyncio
+async def test_user_configurations_edit():
     """This test is for the user configurations edit endpoint"""
-    db = next(get_test_db())
-
-    # Generate good reset password token
-    existing_user = db.query(user_models.User).first()
+    async with TestingSessionLocal() as db:
+        # Generate good reset password token
+        existing_user = await db.scalar(select(user_models.User))
     assert existing_user is not None  # Confirm that a user exists
 
     # Generate access token
@@ -385,12 +592,12 @@ def test_user_configurations_edit():
     assert good_response.status_code == 200
 
 
-def test_news_letter_subscribe():
+@pytest.mark.asyncio
+async def test_news_letter_subscribe():
     """This test is for the news letter subscribe endpoint"""
-    db = next(get_test_db())
-
-    # Generate good reset password token
-    existing_user = db.query(user_models.User).first()
+    async with TestingSessionLocal() as db:
+        # Generate good reset password token
+        existing_user = await db.scalar(select(user_models.User))
     assert existing_user is not None  # Confirm that a user exists
 
     # Generate access token
@@ -408,6 +615,41 @@ def test_news_letter_subscribe():
     assert good_response.status_code == 200
 
 
+ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def ascii_lower(value):
+    """This function lowercases like sqlite's built-in lower(), ASCII letters only"""
+    return value.translate(ASCII_LOWER) if isinstance(value, str) else value
+
+
+def casefold_lower(value):
+    """This function lowercases like a postgres collation lowering "ß" to "ss", unlike
+    str.lower"""
+    return value.casefold() if isinstance(value, str) else value
+
+
+async def set_sqlite_lower(func):
+    """This function replaces lower() in the test database"""
+    async with engine.connect() as connection:
+        raw_connection = await connection.get_raw_connection()
+        await raw_connection.driver_connection.create_function("lower", 1, func)
+
+
+def test_news_letter_subscribe_invalid_email():
+    """This tests an email the database lowercases differently is rejected"""
+    asyncio.run(set_sqlite_lower(casefold_lower))
+    try:
+        response = client.post(
+            "/users/newsletter", json={"email": f"STRAẞE{faker.email()}"}
+        )
+    finally:
+        asyncio.run(set_sqlite_lower(ascii_lower))
+
+    assert response.status_code == 400
+    assert response.json()["data"]["message"] == "Invalid email"
+
+
 COMPANY = {
     "name": faker.name(),
     "registration_number": faker.name(),
@@ -418,12 +660,12 @@ COMPANY = {
 }
 
 
-def test_company_create():
+@pytest.mark.asyncio
+async def test_company_create():
     """This test is for the create company endpoint"""
-    db = next(get_test_db())
-
-    # Generate good reset password token
-    existing_user = db.query(user_models.User).first()
+    async with TestingSessionLocal() as db:
+        # Generate good reset password token
+        existing_user = await db.scalar(select(user_models.User))
     assert existing_user is not None  # Confirm that a user exists
 
     # Generate access token
@@ -437,17 +679,33 @@ def test_company_create():
         headers={"Authorization": f"Bearer {access_token}"},
         json=company,
     )
+    bad_response = client.post(
+        "users/company",
+        headers={"Authorization": f"Bearer {access_token}"},
+        json={
+            **company,
+            "registration_number": faker.name(),
+            "tax_identification_number": faker.name(),
+        },
+    )
 
     # Check good response
     assert good_response.status_code == 200
 
+    # Check the conflicting fields are reported
+    assert bad_response.status_code == 400
+    assert (
+        bad_response.json()["data"]["message"]
+        == "The following fields are already in use: email and phone."
+    )
+
 
-def test_company_edit():
+@pytest.mark.asyncio
+async def test_company_edit():
     """This test is for the edit company endpoint"""
-    db = next(get_test_db())
-
-    # Generate good reset password token
-    existing_user = db.query(user_models.User).first()
+    async with TestingSessionLocal() as db:
+        # Generate good reset password token
+        existing_user = await db.scalar(select(user_models.User))
     assert existing_user is not None  # Confirm that a user exists
 
     # Generate access token
@@ -464,20 +722,71 @@ def test_company_edit():
     good_response = client.put(
         "users/company",
         headers={"Authorization": f"Bearer {access_token}"},
-        json={"name": faker.name()},
+        json={"name": faker.name(), "email": COMPANY["email"]},
+    )
+
+    # Another user's company
+    async with TestingSessionLocal() as db:
+        other_user = user_models.User(
+            full_name=faker.name()[:50], email=faker.email(), password="admin"
+        )
+        db.add(other_user)
+        await db.flush()
+        other_company = user_models.Company(
+            name=faker.name(),
+            registration_number=faker.name(),
+            email=faker.email(),
+            phone=faker.phone_number(),
+            address=faker.address(),
+            tax_identification_number=faker.name(),
+            user_id=other_user.id,
+        )
+        db.add(other_company)
+        await db.commit()
+    conflict_response = client.put(
+        "users/company",
+        headers={"Authorization": f"Bearer {access_token}"},
+        json={"email": other_company.email},
     )
 
     # Check good response
     assert good_response.status_code == 200
     assert bad_response.status_code == 400
 
+    # Check the company's own values aren't conflicts, another company's are
+    assert conflict_response.status_code == 400
+    assert conflict_response.json()["data"]["message"] == "The email is already in use."
 
-def test_support_request():
-    """This test is for the support request endpoint"""
-    db = next(get_test_db())
 
-    # Generate good reset password token
-    existing_user = db.query(user_models.User).first()
+@pytest.mark.asyncio
+async def test_company_edit_without_company():
+    """This tests editing the company of a user who has none"""
+    async with TestingSessionLocal() as db:
+        user = user_models.User(
+            full_name=faker.name()[:50], email=faker.email(), password="admin"
+        )
+        db.add(user)
+        await db.commit()
+
+    access_token = security.generate_user_token(
+        token_type="access", sub=f"USER-{user.id}", expire_in=3
+    )
+    response = client.put(
+        "users/company",
+        headers={"Authorization": f"Bearer {access_token}"},
+        json={"name": faker.name()},
+    )
+
+    assert response.status_code == 404
+    assert response.json()["data"]["message"] == f"Company for user {user.id} not found"
+
+
+@pytest.mark.asyncio
+async def test_support_request():
+    """This test is for the support request endpoint"""
+    async with TestingSessionLocal() as db:
+        # Generate good reset password token
+        existing_user = await db.scalar(select(user_models.User))
     assert existing_user is not None  # Confirm that a user exists
 
     # Generate access token
@@ -498,3 +807,28 @@ def test_support_request():
 
     # Check good response
     assert good_response.status_code == 200
+
+
+@pytest.mark.parametrize(
+    "method, path",
+    [
+        ("DELETE", "/users/logout"),
+        ("GET", "/users/configurations"),
+        ("PUT", "/users/configurations"),
+        ("GET", "/users/notifications"),
+        ("GET", "/users/notifications/unread"),
+        ("GET", "/users/notifications/stream"),
+        ("PUT", "/users/notifications/read"),
+    ],
+)
+def test_user_claims_reject_admin_tokens(method, path):
+    """This tests an admin's access token isn't accepted as a user's"""
+    admin_token = security.generate_user_token(
+        token_type="access", sub="ADMIN-1", expire_in=3
+    )
+    response = client.request(
+        method, path, headers={"Authorization": f"Bearer {admin_token}"}, json={}
+    )
+
+    assert response.status_code == 403
+    assert response.json()["data"]["message"] == "Invalid token type"
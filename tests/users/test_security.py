@@ -0,0 +1,45 @@
+import time
+
+import jwt
+
+from app.common.cache import token_cache
+from app.common.pubsub import evict_cached
+from app.common.security import hash_token
+from app.user import security
+
+
+def test_verify_user_access_token_cache(monkeypatch):
+    """This tests a token's signature is only verified until its claims are cached"""
+    token = security.generate_user_token(token_type="access", sub="USER-1", expire_in=3)
+    decodes = []
+    decode = jwt.decode
+
+    def counting_decode(*args, **kwargs):
+        decodes.append(1)
+        return decode(*args, **kwargs)
+
+    monkeypatch.setattr(security.jwt, "decode", counting_decode)
+
+    assert security.verify_user_access_token(token=token) == "1"
+    assert security.verify_user_access_token(token=token) == "1"
+    assert len(decodes) == 1
+
+    # Check the entry expires with the token
+    expires_at, _ = token_cache._entries[hash_token(token=token)]
+    assert 0 < expires_at - time.monotonic() <= 3 * 60
+
+    # Check the revocation hook evicts it
+    evict_cached(hash_token(token=token))
+    assert security.verify_user_access_token(token=token) == "1"
+    assert len(decodes) == 2
+
+
+def test_verify_user_access_token_invalid():
+    """This tests failed verifications aren't cached"""
+    token = security.generate_user_token(token_type="access", sub="USER-1", expire_in=3)
+    tampered = token[:-2] + ("AA" if token[-2:] != "AA" else "BB")
+
+    assert (
+        security.verify_user_access_token(token=tampered, raise_exception=False) is None
+    )
+    assert hash_token(token=tampered) not in token_cache
@@ -1,6 +1,9 @@
 # pylint: disable=unused-argument, redefined-outer-name
+import asyncio
+
 import pytest
 from faker import Faker
+from sqlalchemy import select
 
 from app.main import app
 from app.common.security import hash_password
@@ -8,6 +11,7 @@ from app.common.dependencies import get_db
 from app.user import models as user_models, selectors
 
 
+from tests.config import TestingSessionLocal
 from tests.deps_overrides import get_test_db
 
 # App Dependency Overrides
@@ -17,32 +21,35 @@ app.dependency_overrides[get_db] = get_test_db
 faker = Faker()
 
 
+async def create_user():
+    """This function makes sure we have a user in the database"""
+    async with TestingSessionLocal() as db:
+        # Check if there is an existing user
+        if not await db.scalar(select(user_models.User)):
+            user = user_models.User(
+                full_name=faker.name(),
+                email=faker.email(),
+                exception_alert_email=faker.email(),  # noqa
+                password=hash_password(raw="admin"),
+            )
+            db.add(user)
+            await db.commit()
+            await db.refresh(user)
+
+
 @pytest.fixture(scope="session")
 def setup():
     """This fixture makes sure we have a user in the database"""
-    db = next(get_test_db())
-
-    # Check if there is an existing user
-    if not db.query(user_models.User).first():
-        user = user_models.User(
-            full_name=faker.name(),
-            email=faker.email(),
-            exception_alert_email=faker.email(),  # noqa
-            password=hash_password(raw="admin"),
-        )
-        db.add(user)
-        db.commit()
-        db.refresh(user)
+    asyncio.run(create_user())
 
 
 @pytest.mark.asyncio
 async def test_get_user_by_id(setup):
     """This tests the get_user_by_id selector"""
     # Initialize db
-    db = next(get_test_db())
-
-    user = db.query(user_models.User).first()
-    assert user is not None
+    async with TestingSessionLocal() as db:
+        user = await db.scalar(select(user_models.User))
+        assert user is not None
 
-    user_id = user.id
-    assert await selectors.get_user_by_id(user_id=user_id, db=db) == user
+        user_id = user.id
+        assert await selectors.get_user_by_id(user_id=user_id, db=db) == user
@@ -0,0 +1,162 @@
+# pylint: disable=unused-argument, redefined-outer-name
+import asyncio
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+import pytest
+from faker import Faker
+from fastapi import HTTPException
+from sqlalchemy import func, select
+
+from app.main import app
+from app.common.security import hash_password, hash_token
+from app.common.dependencies import get_db
+from app.user import models as user_models, security, services
+
+
+from tests.config import TestingSessionLocal
+from tests.deps_overrides import get_test_db
+
+# App Dependency Overrides
+app.dependency_overrides[get_db] = get_test_db
+
+# Intialize Faker
+faker = Faker()
+
+
+async def create_user():
+    """This function makes sure we have a user in the database"""
+    async with TestingSessionLocal() as db:
+        # Check if there is an existing user
+        if not await db.scalar(select(user_models.User)):
+            user = user_models.User(
+                full_name=faker.name(),
+                email=faker.email(),
+                exception_alert_email=faker.email(),  # noqa
+                password=hash_password(raw="admin"),
+            )
+            db.add(user)
+            await db.commit()
+            await db.refresh(user)
+
+
+@pytest.fixture(scope="session")
+def setup():
+    """This fixture makes sure we have a user in the database"""
+    asyncio.run(create_user())
+
+
+async def issue_refresh_token(user_id: int, expires_at: datetime, db):
+    """This function stores a new refresh token family for a user
+
+    Returns:
+        tuple[str, str]: The refresh token and its family ID
+    """
+    family_id = uuid4().hex
+    token = security.generate_user_token(
+        token_type="refresh",
+        sub=f"USER-{user_id}",
+        expire_in=1,
+        claims={"fam": family_id},
+    )
+    await services.create_user_refresh_token(
+        user_id=user_id,
+        token=token,
+        family_id=family_id,
+        expires_at=expires_at,
+        db=db,
+    )
+    await db.commit()
+    return token, family_id
+
+
+async def count_family(family_id: str, db):
+    """This function returns the number of stored tokens of a family"""
+    return await db.scalar(
+        select(func.count())
+        .select_from(user_models.UserRefreshToken)
+        .filter_by(family_id=family_id)
+    )
+
+
+@pytest.mark.asyncio
+async def test_rotate_user_refresh_token(setup):
+    """This tests refresh tokens are rotated and only their digest is stored"""
+    async with TestingSessionLocal() as db:
+        user = await db.scalar(select(user_models.User))
+        assert user is not None
+
+        token, family_id = await issue_refresh_token(
+            user_id=user.id, expires_at=datetime.now() + timedelta(hours=1), db=db
+        )
+        new_token, row = await services.rotate_user_refresh_token(token=token, db=db)
+        await db.commit()
+        assert row.id == user.id
+        assert row.is_active == user.is_active
+
+        # The family's only row now holds the digest of the new token
+        obj = await db.scalar(
+            select(user_models.UserRefreshToken).filter_by(family_id=family_id)
+        )
+        assert obj.token_hash == hash_token(token=new_token) != new_token
+        assert await count_family(family_id=family_id, db=db) == 1
+
+        # The new token can be rotated in turn
+        await services.rotate_user_refresh_token(token=new_token, db=db)
+        await db.commit()
+
+
+@pytest.mark.asyncio
+async def test_rotate_user_refresh_token_rejected(setup):
+    """This tests expired tokens and other users' tokens can't be rotated"""
+    async with TestingSessionLocal() as db:
+        user = await db.scalar(select(user_models.User))
+        assert user is not None
+
+        expired_token, _ = await issue_refresh_token(
+            user_id=user.id, expires_at=datetime.now() - timedelta(hours=1), db=db
+        )
+        # Signed for another user, but stored for this one
+        family_id = uuid4().hex
+        other_token = security.generate_user_token(
+            token_type="refresh",
+            sub=f"USER-{user.id + 1}",
+            expire_in=1,
+            claims={"fam": family_id},
+        )
+        await services.create_user_refresh_token(
+            user_id=user.id,
+            token=other_token,
+            family_id=family_id,
+            expires_at=datetime.now() + timedelta(hours=1),
+            db=db,
+        )
+        await db.commit()
+
+        for bad_token in (expired_token, other_token, faker.sha256()):
+            with pytest.raises(HTTPException) as exc:
+                await services.rotate_user_refresh_token(token=bad_token, db=db)
+            assert exc.value.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_rotate_user_refresh_token_reuse(setup):
+    """This tests reusing a rotated token revokes its whole family"""
+    async with TestingSessionLocal() as db:
+        user = await db.scalar(select(user_models.User))
+        assert user is not None
+
+        token, family_id = await issue_refresh_token(
+            user_id=user.id, expires_at=datetime.now() + timedelta(hours=1), db=db
+        )
+        new_token, _ = await services.rotate_user_refresh_token(token=token, db=db)
+        await db.commit()
+
+        with pytest.raises(HTTPException) as exc:
+            await services.rotate_user_refresh_token(token=token, db=db)
+        assert exc.value.status_code == 401
+        assert await count_family(family_id=family_id, db=db) == 0
+
+        # The token it was rotated to went with the family
+        with pytest.raises(HTTPException):
+            await services.rotate_user_refresh_token(token=new_token, db=db)